@@ -0,0 +1,66 @@
+"""
+Compares plain requests.get against http_get's shared keep-alive session
+
+Sends the same number of small requests with each to a local HTTP/1.1 server and
+reports the time per request and how many connections the server accepted. Over
+loopback a connection is cheap, against a real host every new one also costs a
+TCP and TLS handshake. Usage: python benchmarks/keepalive.py [requests]
+"""
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from zotify.config import CONFIG_VALUES, Config
+from zotify.zotify import Zotify
+
+Zotify.CONFIG = Config
+Config.Values = {key: Config.parse_arg_value(key, value['default']) for key, value in CONFIG_VALUES.items()}
+
+from zotify.network import http_get
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, Nagle would hold the body back on a kept-alive connection
+    disable_nagle_algorithm = True
+    connections = 0
+    
+    def setup(self) -> None:
+        super().setup()
+        Handler.connections += 1
+    
+    def do_GET(self) -> None:
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/'
+    
+    try:
+        for name, get in (('requests.get', requests.get), ('http_get', http_get)):
+            Handler.connections = 0
+            start = time.perf_counter()
+            for _ in range(count):
+                get(url).raise_for_status()
+            elapsed = time.perf_counter() - start
+            print(f'{name:>12}: {elapsed / count * 1000:.2f} ms per request, {Handler.connections} connections')
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Measures the CPU time OggPassthrough spends rewriting an Ogg stream
+
+Feeds a generated stream of Vorbis sized pages in CHUNK_SIZE writes, the way a
+download does, into a file that discards the data, so only the page parsing and
+CRC work is measured. Usage: python benchmarks/ogg_passthrough.py [MiB]
+"""
+import io
+import os
+import struct
+import sys
+import time
+
+from zotify.ogg import PAGE_HEADER, CRC_OFFSET, BEGINNING_OF_STREAM, OggPassthrough, ogg_crc
+
+CHUNK_SIZE = 20000
+
+
+class NullFile(io.RawIOBase):
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        return len(data)
+
+
+def make_stream(size: int, sequence_gap: bool) -> bytes:
+    pages = []
+    total = 0
+    sequence = 0
+    while total < size:
+        payload = os.urandom(4000 + len(pages) % 7 * 100)
+        segments = [255] * (len(payload) // 255) + [len(payload) % 255]
+        header_type = BEGINNING_OF_STREAM if sequence == 0 else 0
+        page = bytearray(PAGE_HEADER.pack(b'OggS', 0, header_type, sequence * 1024, 1, sequence, 0, len(segments)))
+        page += bytes(segments) + payload
+        struct.pack_into('<I', page, CRC_OFFSET, ogg_crc(page))
+        pages.append(bytes(page))
+        total += len(page)
+        # a gap makes every later page's header change
+        sequence += 2 if sequence_gap and sequence == 5 else 1
+    return b''.join(pages)
+
+
+def main() -> None:
+    mib = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for name, sequence_gap in (('in sequence', False), ('renumbered', True)):
+        data = make_stream(mib * 1024 * 1024, sequence_gap)
+        chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+        start = time.process_time()
+        with OggPassthrough(NullFile()) as ogg:
+            for chunk in chunks:
+                ogg.write(chunk)
+        elapsed = time.process_time() - start
+        print(f'{name:>12}: {elapsed / (len(data) / 1024 / 1024) * 1000:.2f} ms CPU per MiB')
+
+
+if __name__ == '__main__':
+    main()
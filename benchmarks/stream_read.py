@@ -0,0 +1,84 @@
+"""
+Compares the CPU time of reading a content stream with read() against download_stream
+
+Runs on an in-memory librespot chunked stream, so only the copying and progress bar
+overhead is measured, not the network. Usage: python benchmarks/stream_read.py [MiB]
+"""
+import hashlib
+import io
+import os
+import sys
+import time
+
+from librespot.audio import AbsChunkedInputStream
+from librespot.audio.storage import ChannelManager
+from tqdm import tqdm
+
+from zotify.config import CONFIG_VALUES, Config
+from zotify.zotify import Zotify
+
+Zotify.CONFIG = Config
+Config.Values = {key: Config.parse_arg_value(key, value['default']) for key, value in CONFIG_VALUES.items()}
+
+from zotify.streamreader import download_stream
+
+# the header librespot skips before the audio data
+HEADER_SIZE = 0xa7
+
+
+class MemoryStream(AbsChunkedInputStream):
+    def __init__(self, data: bytes) -> None:
+        size = ChannelManager.chunk_size
+        self.chunk_buffer = [data[i:i + size] for i in range(0, len(data), size)]
+        self.flags = [True] * len(self.chunk_buffer)
+        super().__init__(False)
+        self.seek(HEADER_SIZE)
+    
+    def buffer(self):
+        return self.chunk_buffer
+    
+    def size(self):
+        return sum(len(chunk) for chunk in self.chunk_buffer)
+    
+    def requested_chunks(self):
+        return self.flags
+    
+    def available_chunks(self):
+        return self.flags
+    
+    def chunks(self):
+        return len(self.chunk_buffer)
+    
+    def request_chunk_from_stream(self, index):
+        pass
+
+
+def read_loop(stream, file, pbar) -> None:
+    """ The download loop download_stream replaced """
+    b = 0
+    while b < 5:
+        data = stream.read(Config.get_chunk_size())
+        pbar.update(file.write(data))
+        b += 1 if data == b'' else 0
+
+
+def main() -> None:
+    mib = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    # read() fails at the end of a stream that fills its last chunk exactly
+    data = os.urandom(mib * 1024 * 1024 + 12345)
+    expected = hashlib.sha1(data[HEADER_SIZE:]).hexdigest()
+    
+    for name, run in (('read()', lambda stream, file, pbar: read_loop(stream, file, pbar)),
+                      ('download_stream', lambda stream, file, pbar: download_stream(stream, len(data), file, pbar, 0))):
+        stream = MemoryStream(data)
+        file = io.BytesIO()
+        with open(os.devnull, 'w') as devnull, tqdm(total=len(data), file=devnull, unit='B', unit_scale=True) as pbar:
+            start = time.process_time()
+            run(stream, file, pbar)
+            elapsed = time.process_time() - start
+        intact = hashlib.sha1(file.getvalue()).hexdigest() == expected
+        print(f'{name:>16}: {elapsed / mib * 1000:.2f} ms CPU per MiB, output intact: {intact}')
+
+
+if __name__ == '__main__':
+    main()
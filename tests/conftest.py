@@ -0,0 +1,17 @@
+import pytest
+
+from zotify.config import CONFIG_VALUES, Config
+from zotify.const import ROOT_PATH, SONG_ARCHIVE_LOCATION, API_CACHE_LOCATION
+from zotify.zotify import Zotify
+
+
+@pytest.fixture(autouse=True)
+def config(tmp_path, monkeypatch) -> dict:
+    """ The default config, with the library and every database inside tmp_path """
+    values = {key: Config.parse_arg_value(key, value['default']) for key, value in CONFIG_VALUES.items()}
+    values[ROOT_PATH] = str(tmp_path / 'library')
+    values[SONG_ARCHIVE_LOCATION] = str(tmp_path / 'data')
+    values[API_CACHE_LOCATION] = str(tmp_path / 'data')
+    monkeypatch.setattr(Config, 'Values', values, raising=False)
+    monkeypatch.setattr(Zotify, 'CONFIG', Config)
+    return values
@@ -0,0 +1,82 @@
+import os
+from pathlib import Path
+
+from zotify.archive import SongArchive
+from zotify.config import Config
+from zotify.const import EXPORT_TSV_ARCHIVES, ROOT_PATH
+
+
+def test_adds_persist_across_runs(config):
+    archive = SongArchive()
+    assert archive.song_ids() == set()
+    archive.add('id1', '2024-01-01 00:00:00', 'Artist', 'Song', 'Song.ogg')
+    assert archive.song_ids() == {'id1'}
+    assert SongArchive().song_ids() == {'id1'}
+
+
+def test_global_tsv_edits_are_picked_up(config):
+    tsv = Path(Config.get_song_archive_location())
+    tsv.write_text('id1\t2024-01-01 00:00:00\tArtist\tSong\tSong.ogg\nid2\n\n', encoding='utf-8')
+    assert SongArchive().song_ids() == {'id1', 'id2'}
+    
+    tsv.write_text('id2\nid3\n', encoding='utf-8')
+    os.utime(tsv, ns=(0, 0))
+    assert SongArchive().song_ids() == {'id2', 'id3'}
+
+
+def test_global_tsv_keeps_songs_it_never_held(config):
+    config[EXPORT_TSV_ARCHIVES] = False
+    tsv = Path(Config.get_song_archive_location())
+    tsv.write_text('id1\n', encoding='utf-8')
+    archive = SongArchive()
+    archive.add('id2', '', '', '', '')
+    assert archive.song_ids() == {'id1', 'id2'}
+    
+    tsv.write_text('id3\n', encoding='utf-8')
+    assert SongArchive().song_ids() == {'id2', 'id3'}
+    tsv.unlink()
+    assert SongArchive().song_ids() == {'id2', 'id3'}
+
+
+def test_exported_adds_follow_global_tsv_edits(config):
+    tsv = Path(Config.get_song_archive_location())
+    tsv.write_text('id1\n', encoding='utf-8')
+    archive = SongArchive()
+    archive.add('id2', '', '', '', '')
+    with open(tsv, 'a', encoding='utf-8') as file:
+        file.write('id2\n')
+    
+    tsv.write_text('id1\n', encoding='utf-8')
+    os.utime(tsv, ns=(0, 0))
+    assert SongArchive().song_ids() == {'id1'}
+
+
+def test_directory_archives_are_separate(tmp_path):
+    archive = SongArchive()
+    first, second = tmp_path / 'library' / 'a', tmp_path / 'library' / 'b'
+    archive.add_to_directory(first, 'id1', '', '', '', '')
+    assert archive.directory_song_ids(first) == {'id1'}
+    assert archive.directory_song_ids(second) == set()
+    assert SongArchive().directory_song_ids(first) == {'id1'}
+
+
+def test_directory_tsv_edits_are_picked_up(tmp_path):
+    directory = tmp_path / 'library' / 'album'
+    directory.mkdir(parents=True)
+    tsv = directory / '.song_ids'
+    tsv.write_text('id1\nid2\n', encoding='utf-8')
+    assert SongArchive().directory_song_ids(directory) == {'id1', 'id2'}
+    
+    tsv.write_text('id2\n', encoding='utf-8')
+    os.utime(tsv, ns=(0, 0))
+    assert SongArchive().directory_song_ids(directory) == {'id2'}
+    
+    tsv.unlink()
+    assert SongArchive().directory_song_ids(directory) == set()
+
+
+def test_directory_keys_follow_a_moved_library(tmp_path, config):
+    old_root = tmp_path / 'library'
+    SongArchive().add_to_directory(old_root / 'album', 'id1', '', '', '', '')
+    config[ROOT_PATH] = str(tmp_path / 'moved')
+    assert SongArchive().directory_song_ids(tmp_path / 'moved' / 'album') == {'id1'}
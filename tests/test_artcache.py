@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import pytest
+import requests
+
+from zotify import artcache
+from zotify.artcache import AlbumArtCache
+from zotify.config import Config
+
+
+JPEG = b'\xff\xd8\xff\xe0' + bytes(100)
+
+
+class Response:
+    def __init__(self, status_code: int, content: bytes) -> None:
+        self.status_code = status_code
+        self.content = content
+    
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} error')
+
+
+@pytest.fixture
+def responses(monkeypatch) -> list:
+    """ Responses the next requests get, in order """
+    queue = []
+    monkeypatch.setattr(artcache, 'http_get', lambda url: queue.pop(0))
+    return queue
+
+
+def cached_files() -> list[Path]:
+    directory = Path(Config.get_album_art_cache_location())
+    return list(directory.iterdir()) if directory.exists() else []
+
+
+def test_covers_are_cached_in_memory_and_on_disk(responses):
+    responses.append(Response(200, JPEG))
+    cache = AlbumArtCache()
+    assert cache.get('https://i.scdn.co/image/a') == JPEG
+    assert cache.get('https://i.scdn.co/image/a') == JPEG
+    assert cache.downloads == 1
+    # the next run reads it from disk
+    assert AlbumArtCache().get('https://i.scdn.co/image/a') == JPEG
+    assert responses == []
+
+
+@pytest.mark.parametrize('response', [Response(503, b'<html>Service Unavailable</html>'),
+                                      Response(200, b'<html>not an image</html>')])
+def test_failed_loads_are_not_cached(responses, response):
+    responses.extend([response, Response(200, JPEG)])
+    cache = AlbumArtCache()
+    with pytest.raises((requests.HTTPError, ValueError)):
+        cache.get('https://i.scdn.co/image/a')
+    assert cached_files() == []
+    # retried by the next track, not answered with the error
+    assert cache.get('https://i.scdn.co/image/a') == JPEG
+
+
+def test_non_image_disk_entries_are_replaced(responses):
+    cache = AlbumArtCache()
+    path = Path(Config.get_album_art_cache_location()) / f'{cache.key("https://i.scdn.co/image/a")}.jpg'
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b'<html>Service Unavailable</html>')
+    responses.append(Response(200, JPEG))
+    assert cache.get('https://i.scdn.co/image/a') == JPEG
+    assert path.read_bytes() == JPEG
@@ -0,0 +1,98 @@
+import threading
+import time
+
+from zotify import cache
+from zotify.cache import ApiCache
+from zotify.const import TRACKS_URL, ALBUM_URL, USER_SAVED_TRACKS_URL, DISABLE_API_CACHE, API_CACHE_SIZE
+
+
+def test_responses_are_cached_by_url_and_params():
+    api_cache = ApiCache()
+    api_cache.put(TRACKS_URL, '{"tracks": []}', {'ids': 'a,b'})
+    assert api_cache.get(TRACKS_URL, {'ids': 'a,b'}) == '{"tracks": []}'
+    assert api_cache.get(TRACKS_URL, {'ids': 'a'}) is None
+    assert ApiCache().get(TRACKS_URL, {'ids': 'a,b'}) == '{"tracks": []}'
+    assert (api_cache.hits, api_cache.misses) == (1, 1)
+
+
+def test_uncacheable_endpoints_and_disabled_cache(config):
+    api_cache = ApiCache()
+    api_cache.put(USER_SAVED_TRACKS_URL, '{"items": []}')
+    assert api_cache.get(USER_SAVED_TRACKS_URL) is None
+    
+    api_cache.put(ALBUM_URL + '/x', '{}')
+    config[DISABLE_API_CACHE] = True
+    assert api_cache.get(ALBUM_URL + '/x') is None
+
+
+def test_expired_responses_are_not_returned(monkeypatch):
+    api_cache = ApiCache()
+    api_cache.put(ALBUM_URL + '/x', '{}')
+    now = time.time()
+    monkeypatch.setattr(cache.time, 'time', lambda: now + 8 * cache.DAY)
+    assert api_cache.get(ALBUM_URL + '/x') is None
+
+
+def test_least_recently_used_are_evicted(config, monkeypatch):
+    config[API_CACHE_SIZE] = 1
+    api_cache = ApiCache()
+    body = 'x' * 300 * 1024
+    clock = [time.time()]
+    monkeypatch.setattr(cache.time, 'time', lambda: clock[0])
+    for i in range(3):
+        clock[0] += 1
+        api_cache.put(f'{ALBUM_URL}/{i}', body)
+    clock[0] += 1
+    # now the most recently used
+    assert api_cache.get(f'{ALBUM_URL}/0') == body
+    clock[0] += 1
+    api_cache.put(f'{ALBUM_URL}/3', body)
+    assert api_cache.get(f'{ALBUM_URL}/0') == body
+    assert api_cache.get(f'{ALBUM_URL}/1') is None
+    assert api_cache.get(f'{ALBUM_URL}/3') == body
+
+
+def test_request_memo_shares_one_call_between_concurrent_callers():
+    memo = cache.RequestMemo()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    
+    def fetch() -> dict:
+        calls.append(None)
+        started.set()
+        release.wait()
+        return {'items': [1]}
+    
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(memo.fetch('key', fetch))) for _ in range(4)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    
+    assert len(calls) == 1
+    assert results == [{'items': [1]}] * 4
+    assert memo.fetch('key', fetch) == {'items': [1]}
+    assert len(calls) == 1 and memo.saved == 4
+
+
+def test_request_memo_callers_get_their_own_copy():
+    memo = cache.RequestMemo()
+    first = memo.fetch('key', lambda: {'items': [1]})
+    first['items'].append(2)
+    first.pop('items')
+    assert memo.fetch('key', lambda: None) == {'items': [1]}
+
+
+def test_request_memo_forgets_failures_and_old_entries():
+    memo = cache.RequestMemo(max_entries=2)
+    assert memo.fetch('error', lambda: {'error': 1}, keep=lambda result: 'error' not in result) == {'error': 1}
+    assert memo.fetch('error', lambda: {'ok': 1}) == {'ok': 1}
+    
+    memo.fetch('a', lambda: 'a')
+    memo.fetch('b', lambda: 'b')
+    assert memo.fetch('error', lambda: 'refetched') == 'refetched'
@@ -0,0 +1,133 @@
+import errno
+import random
+import time
+
+import pytest
+
+from zotify import mover, track, utils
+from zotify.archive import SongArchive
+from zotify.const import MOVE_WORKERS, MOVE_RETRIES
+from zotify.dirindex import DirectoryIndex
+from zotify.mover import FileMover, move_file
+
+
+@pytest.fixture
+def index(monkeypatch) -> DirectoryIndex:
+    index = DirectoryIndex()
+    monkeypatch.setattr(mover, 'DIR_INDEX', index)
+    monkeypatch.setattr(track, 'DIR_INDEX', index)
+    return index
+
+
+@pytest.fixture
+def archive(monkeypatch) -> SongArchive:
+    archive = SongArchive()
+    monkeypatch.setattr(track, 'SONG_ARCHIVE', archive)
+    monkeypatch.setattr(utils, 'SONG_ARCHIVE', archive)
+    return archive
+
+
+@pytest.fixture
+def dirs(tmp_path, config) -> tuple:
+    config[MOVE_RETRIES] = 0
+    stage, library = tmp_path / 'stage', tmp_path / 'library'
+    stage.mkdir()
+    library.mkdir()
+    return stage, library
+
+
+def test_move_file_across_filesystems(dirs, monkeypatch):
+    stage, library = dirs
+    (stage / 'a.ogg').write_bytes(b'audio')
+    (library / 'a.ogg').write_bytes(b'old')
+    replace = mover.os.replace
+    
+    def cross_device(source, target):
+        if mover.Path(source).parent == stage:
+            raise OSError(errno.EXDEV, 'cross-device link')
+        replace(source, target)
+    
+    monkeypatch.setattr(mover.os, 'replace', cross_device)
+    move_file(stage / 'a.ogg', library / 'a.ogg')
+    assert (library / 'a.ogg').read_bytes() == b'audio'
+    assert list(stage.iterdir()) == []
+    assert [path.name for path in library.iterdir()] == ['a.ogg']
+
+
+@pytest.mark.parametrize('workers', [0, 3])
+def test_commits_run_in_order_after_their_moves(dirs, index, config, workers, monkeypatch):
+    config[MOVE_WORKERS] = workers
+    stage, library = dirs
+    replace = mover.os.replace
+    
+    def slow_replace(source, target):
+        time.sleep(random.uniform(0, 0.02))
+        replace(source, target)
+    
+    monkeypatch.setattr(mover.os, 'replace', slow_replace)
+    file_mover = FileMover()
+    log = []
+    for i in range(10):
+        (stage / f'{i}.ogg').write_bytes(b'audio')
+        move = file_mover.move(stage / f'{i}.ogg', library / f'{i}.ogg')
+        file_mover.commit(move, log.append, (i,))
+        file_mover.commit(None, log.append, (f'plain {i}',))
+    file_mover.join()
+    
+    assert log == [entry for i in range(10) for entry in (i, f'plain {i}')]
+    assert sorted(path.name for path in library.iterdir()) == sorted(f'{i}.ogg' for i in range(10))
+    assert all(index.file_size(library / f'{i}.ogg') == 5 for i in range(10))
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_failed_moves_drop_their_commits(dirs, index, config, workers):
+    config[MOVE_WORKERS] = workers
+    stage, library = dirs
+    file_mover = FileMover()
+    log = []
+    for name, target in (('a', library), ('b', library / 'missing'), ('c', library)):
+        (stage / f'{name}.ogg').write_bytes(b'audio')
+        move = file_mover.move(stage / f'{name}.ogg', target / f'{name}.ogg')
+        file_mover.commit(move, log.append, (name,))
+    file_mover.join()
+    
+    assert log == ['a', 'c']
+    # left staged, not lost
+    assert [path.name for path in stage.iterdir()] == ['b.ogg']
+
+
+def test_queued_moves_reserve_names_and_song_ids(dirs, index, archive):
+    stage, library = dirs
+    filename = library / 'Artist - Song.ogg'
+    assert track.check_duplicates(filename, 'id1') == (0, False, False)
+    
+    track.reserve_staged_track('id1', filename, 5, False, False)
+    assert track.check_duplicates(filename, 'id1') == (5, True, True)
+    # a different song wanting the same name is renamed away from it
+    assert index.count_matching(library, 'Artist - Song*') == 1
+    
+    track.release_staged_track('id1', filename)
+    assert track.check_duplicates(filename, 'id1') == (0, False, False)
+
+
+def test_reservations_end_when_the_song_is_archived(dirs, index, archive):
+    stage, library = dirs
+    filename = library / 'Artist - Song.ogg'
+    track.reserve_staged_track('id1', filename, 5, False, False)
+    archive.add('id1', '', '', '', filename.name)
+    archive.add_to_directory(library, 'id1', '', '', '', filename.name)
+    filename.write_bytes(b'audio')
+    index.added(filename)
+    
+    # a late release (the move callback of another download) doesn't undo the archive
+    track.release_staged_track('id1', filename)
+    assert track.check_duplicates(filename, 'id1') == (5, True, True)
+
+
+def test_release_keeps_a_file_that_was_already_there(dirs, index, archive):
+    stage, library = dirs
+    filename = library / 'Artist - Song.ogg'
+    filename.write_bytes(b'earlier download')
+    track.reserve_staged_track('id1', filename, 5, False, False)
+    track.release_staged_track('id1', filename)
+    assert index.file_size(filename) == len(b'earlier download')
@@ -0,0 +1,102 @@
+import io
+import os
+import struct
+
+from zotify.ogg import PAGE_HEADER, CRC_OFFSET, CONTINUED, BEGINNING_OF_STREAM, END_OF_STREAM, \
+    OggPassthrough, ogg_crc
+
+
+def reference_crc(data: bytes) -> int:
+    """ Bit by bit CRC-32 as the Ogg spec defines it """
+    crc = 0
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+    return crc
+
+
+def make_page(serial: int, sequence: int, payload: bytes, header_type: int = 0, granule: int = 0) -> bytes:
+    segments = [255] * (len(payload) // 255) + [len(payload) % 255]
+    page = bytearray(PAGE_HEADER.pack(b'OggS', 0, header_type, granule, serial, sequence, 0, len(segments)))
+    page += bytes(segments) + payload
+    struct.pack_into('<I', page, CRC_OFFSET, ogg_crc(page))
+    return bytes(page)
+
+
+def read_pages(data: bytes) -> list[tuple[int, int, int, bytes]]:
+    """ Returns each page's (header type, serial, sequence, payload), checking its CRC """
+    pages = []
+    offset = 0
+    while offset < len(data):
+        _, version, header_type, granule, serial, sequence, crc, count = PAGE_HEADER.unpack_from(data, offset)
+        body = offset + PAGE_HEADER.size + count
+        end = body + sum(data[offset + PAGE_HEADER.size:body])
+        page = bytearray(data[offset:end])
+        struct.pack_into('<I', page, CRC_OFFSET, 0)
+        assert reference_crc(page) == crc
+        pages.append((header_type, serial, sequence, data[body:end]))
+        offset = end
+    return pages
+
+
+class Output(io.BytesIO):
+    def close(self) -> None:
+        self.data = self.getvalue()
+        super().close()
+
+
+def passthrough(chunks: list[bytes]) -> bytes:
+    output = Output()
+    with OggPassthrough(output) as ogg:
+        for chunk in chunks:
+            ogg.write(chunk)
+    return output.data
+
+
+def split(data: bytes, size: int) -> list[bytes]:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_crc_matches_reference():
+    for data in (b'', b'OggS', os.urandom(1), os.urandom(1000), bytes(300)):
+        assert ogg_crc(data) == reference_crc(data)
+    assert ogg_crc(bytearray(b'123456789')) == reference_crc(b'123456789')
+
+
+def test_pages_are_cleaned_up():
+    payloads = [os.urandom(n) for n in (30, 600, 255, 1, 4000)]
+    pages = [make_page(7, sequence, payload) for sequence, payload in zip((3, 4, 9, 10, 11), payloads)]
+    damaged = bytearray(make_page(7, 5, b'damaged'))
+    damaged[-1] ^= 0xFF
+    other_stream = make_page(8, 0, b'other')
+    stream = b'garbage before the first page' + pages[0] + pages[1] + bytes(damaged) + \
+        other_stream + b'OggS but not a page' + pages[2] + pages[3] + pages[4]
+    
+    for chunk_size in (1, 7, 100, len(stream)):
+        result = read_pages(passthrough(split(stream, chunk_size)))
+        assert [payload for _, _, _, payload in result] == payloads
+        assert {serial for _, serial, _, _ in result} == {7}
+        assert [sequence for _, _, sequence, _ in result] == list(range(len(payloads)))
+        assert [header_type for header_type, _, _, _ in result] == \
+            [BEGINNING_OF_STREAM, 0, 0, 0, END_OF_STREAM]
+
+
+def test_continued_flag_is_kept():
+    stream = make_page(1, 0, b'a') + make_page(1, 1, b'b', header_type=CONTINUED | END_OF_STREAM) + make_page(1, 2, b'c')
+    result = read_pages(passthrough([stream]))
+    assert [header_type for header_type, _, _, _ in result] == \
+        [BEGINNING_OF_STREAM, CONTINUED, END_OF_STREAM]
+
+
+def test_non_ogg_streams_are_written_unchanged():
+    data = os.urandom(200 * 1024).replace(b'OggS', b'oggs')
+    assert passthrough(split(data, 4096)) == data
+    assert passthrough([b'short']) == b'short'
+
+
+def test_clean_pages_are_written_unchanged():
+    pages = [make_page(3, 0, b'a', header_type=BEGINNING_OF_STREAM), make_page(3, 1, os.urandom(5000)), make_page(3, 2, b'c')]
+    result = passthrough(split(b''.join(pages), 1000))
+    assert result[:len(pages[0]) + len(pages[1])] == pages[0] + pages[1]
+    assert read_pages(result)[-1] == (END_OF_STREAM, 3, 2, b'c')
@@ -0,0 +1,83 @@
+import random
+import threading
+import time
+
+from zotify.const import DOWNLOAD_WORKERS, DOWNLOAD_PIPELINE, TRANSCODE_WORKERS
+from zotify.pool import DownloadPool, commit_in_order, in_worker
+
+
+def job(index: int, log: list) -> None:
+    # finish out of order
+    time.sleep(random.uniform(0, 0.02))
+    commit_in_order(log.append, index)
+
+
+def test_commits_land_in_submission_order(config):
+    config[DOWNLOAD_WORKERS] = 4
+    log = []
+    with DownloadPool() as pool:
+        assert pool.parallel
+        for i in range(40):
+            pool.submit(job, i, log)
+    assert log == list(range(40))
+
+
+def test_failed_job_does_not_hold_back_later_commits(config):
+    config[DOWNLOAD_WORKERS] = 3
+    log = []
+    
+    def failing(index: int, log: list) -> None:
+        commit_in_order(log.append, index)
+        raise RuntimeError('download failed')
+    
+    with DownloadPool() as pool:
+        for i in range(10):
+            pool.submit(failing if i == 3 else job, i, log)
+    assert log == list(range(10))
+
+
+def test_single_worker_runs_inline(config):
+    config[DOWNLOAD_WORKERS] = 1
+    threads = []
+    with DownloadPool() as pool:
+        assert not pool.parallel
+        pool.submit(lambda: threads.append((threading.current_thread(), in_worker())))
+    assert threads == [(threading.current_thread(), False)]
+
+
+def test_nested_pool_runs_inline(config):
+    config[DOWNLOAD_WORKERS] = 2
+    nested = []
+    
+    def outer() -> None:
+        with DownloadPool() as pool:
+            nested.append(pool.parallel)
+    
+    with DownloadPool() as pool:
+        pool.submit(outer)
+    assert nested == [False]
+
+
+def staged_job(index: int, log: list, stages: list):
+    for stage in range(3):
+        time.sleep(random.uniform(0, 0.01))
+        stages.append((index, stage, threading.current_thread().name))
+        if stage < 2:
+            yield
+    commit_in_order(log.append, index)
+
+
+def test_pipeline_runs_every_stage_and_keeps_commit_order(config):
+    config[DOWNLOAD_WORKERS] = 2
+    config[DOWNLOAD_PIPELINE] = True
+    config[TRANSCODE_WORKERS] = 2
+    log, stages = [], []
+    with DownloadPool() as pool:
+        for i in range(20):
+            pool.submit(staged_job, i, log, stages)
+    assert log == list(range(20))
+    for i in range(20):
+        ran = [(stage, thread) for index, stage, thread in stages if index == i]
+        assert [stage for stage, thread in ran] == [0, 1, 2]
+        # each stage is handed to its own workers
+        assert len({thread for stage, thread in ran}) == 3
@@ -0,0 +1,106 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+from zotify import ratelimit
+from zotify.ratelimit import RateLimiter, backoff_delay, parse_retry_after
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(formatdate(time.time() + 30, usegmt=True)) == pytest.approx(30, abs=2)
+
+
+def test_backoff_delay_grows_and_is_capped():
+    for attempt in range(8):
+        assert 2 ** attempt / 2 <= backoff_delay(attempt, cap=1000) <= 2 ** attempt
+    assert backoff_delay(20, cap=60) <= 60
+
+
+def test_paces_and_bursts_after_idling():
+    limiter = RateLimiter('TEST', lambda: 50)
+    start = time.monotonic()
+    for _ in range(11):
+        limiter.acquire()
+    # the first goes straight through, the rest come at 50 per second
+    assert time.monotonic() - start == pytest.approx(0.2, abs=0.05)
+    
+    # idle time fills the bucket, up to one second's worth of requests
+    time.sleep(0.5)
+    start = time.monotonic()
+    for _ in range(20):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.05
+
+
+def test_unlimited_never_waits():
+    limiter = RateLimiter('TEST', lambda: 0)
+    start = time.monotonic()
+    for _ in range(1000):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.1
+
+
+def test_throttled_pauses_halves_and_ramps_back(monkeypatch):
+    monkeypatch.setattr(ratelimit.Printer, 'print', lambda *args: None)
+    limiter = RateLimiter('TEST', lambda: 100)
+    limiter.acquire()
+    
+    assert limiter.throttled(retry_after=0.1) == pytest.approx(0.1, abs=0.01)
+    assert limiter.rate == 50
+    # rejections during the same pause are the same limit, the rate only halves once
+    limiter.throttled(retry_after=0.05)
+    assert limiter.rate == 50
+    
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+    
+    limiter.succeeded()
+    assert limiter.rate == 55
+    for _ in range(20):
+        limiter.succeeded()
+    assert limiter.rate == 100
+
+
+def test_throttled_backoff_follows_the_callers_attempt(monkeypatch):
+    monkeypatch.setattr(ratelimit.Printer, 'print', lambda *args: None)
+    monkeypatch.setattr(ratelimit, 'backoff_delay', lambda attempt: attempt / 100)
+    limiter = RateLimiter('TEST', lambda: 100)
+    assert limiter.throttled(attempt=3) == pytest.approx(0.03, abs=0.005)
+    # another caller's success doesn't reset this caller's attempts
+    limiter.succeeded()
+    time.sleep(0.04)
+    assert limiter.throttled(attempt=4) == pytest.approx(0.04, abs=0.005)
+
+
+class ThrottledResponse:
+    status_code = 429
+    headers = {'Retry-After': '0'}
+    text = ''
+    
+    def json(self) -> dict:
+        return {'error': {'status': 429, 'message': 'API rate limit exceeded'}}
+
+
+def test_throttled_retries_are_counted_per_request(monkeypatch):
+    from zotify import zotify
+    limiter = RateLimiter('TEST', lambda: 0)
+    monkeypatch.setattr(zotify, 'API_LIMITER', limiter)
+    monkeypatch.setattr(ratelimit.Printer, 'print', lambda *args: None)
+    monkeypatch.setattr(zotify.Zotify, 'get_auth_header', classmethod(lambda cls: {}))
+    calls = []
+    
+    def http_get(url, **kwargs):
+        calls.append(url)
+        # other workers' requests keep going through meanwhile
+        limiter.succeeded()
+        return ThrottledResponse()
+    
+    monkeypatch.setattr(zotify, 'http_get', http_get)
+    zotify.Zotify._Zotify__fetch_url_with_params('https://api.example/items', {'limit': 50})
+    assert len(calls) == ratelimit.MAX_THROTTLED_RETRIES + 1
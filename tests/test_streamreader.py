@@ -0,0 +1,102 @@
+import io
+import os
+
+import pytest
+from librespot.audio import AbsChunkedInputStream
+from librespot.audio.storage import ChannelManager
+
+from zotify.const import CHUNK_SIZE
+from zotify.streamreader import ChunkReader, download_stream
+
+
+# the header librespot skips before the audio data
+HEADER_SIZE = 0xa7
+
+
+class MemoryStream(AbsChunkedInputStream):
+    """ librespot chunked stream over data held in memory, missing_chunks of it never arriving """
+    
+    def __init__(self, data: bytes, missing_chunks: int = 0) -> None:
+        size = ChannelManager.chunk_size
+        self.total = len(data)
+        self.chunk_buffer = [data[i:i + size] for i in range(0, len(data), size)]
+        for chunk in range(len(self.chunk_buffer) - missing_chunks, len(self.chunk_buffer)):
+            self.chunk_buffer[chunk] = b''
+        self.flags = [True] * len(self.chunk_buffer)
+        super().__init__(False)
+        self.seek(HEADER_SIZE)
+    
+    def buffer(self):
+        return self.chunk_buffer
+    
+    def size(self):
+        return self.total
+    
+    def requested_chunks(self):
+        return self.flags
+    
+    def available_chunks(self):
+        return self.flags
+    
+    def chunks(self):
+        return len(self.chunk_buffer)
+    
+    def request_chunk_from_stream(self, index):
+        pass
+
+
+class ReadStream:
+    """ Stream with nothing but read() """
+    
+    def __init__(self, data: bytes) -> None:
+        self.file = io.BytesIO(data)
+    
+    def read(self, size: int) -> bytes:
+        return self.file.read(size)
+
+
+class Progress:
+    def __init__(self) -> None:
+        self.n = 0
+    
+    def update(self, n: int) -> None:
+        self.n += n
+
+
+@pytest.mark.parametrize('size', [HEADER_SIZE + 1, 1000, ChannelManager.chunk_size,
+                                  3 * ChannelManager.chunk_size, 5 * ChannelManager.chunk_size + 12345])
+@pytest.mark.parametrize('chunk_size', [1000, 20000, 200000])
+def test_chunk_stream_skips_the_header(config, size, chunk_size):
+    config[CHUNK_SIZE] = chunk_size
+    data = os.urandom(size)
+    file, progress = io.BytesIO(), Progress()
+    written = download_stream(MemoryStream(data), size, file, progress, 1000)
+    assert file.getvalue() == data[HEADER_SIZE:]
+    assert written == progress.n == size - HEADER_SIZE
+
+
+def test_blocks_are_views_of_the_chunks():
+    data = os.urandom(3 * ChannelManager.chunk_size)
+    stream = MemoryStream(data)
+    blocks = list(ChunkReader(stream, len(data)))
+    assert all(isinstance(block, memoryview) and block.obj in stream.chunk_buffer for block in blocks)
+    assert b''.join(blocks) == data[HEADER_SIZE:]
+
+
+def test_short_chunk_stream_raises():
+    data = os.urandom(3 * ChannelManager.chunk_size + 100)
+    with pytest.raises(IOError):
+        download_stream(MemoryStream(data, missing_chunks=1), len(data), io.BytesIO(), Progress(), 1000)
+
+
+def test_read_stream_is_read_to_its_size():
+    data = os.urandom(300000)
+    file = io.BytesIO()
+    assert download_stream(ReadStream(data), len(data), file, Progress(), 1000) == len(data)
+    assert file.getvalue() == data
+
+
+def test_short_read_stream_raises():
+    data = os.urandom(1000)
+    with pytest.raises(IOError):
+        download_stream(ReadStream(data), len(data) + 1, io.BytesIO(), Progress(), 1000)
@@ -0,0 +1,28 @@
+from zotify.syncstate import SyncState
+
+
+def test_playlists_are_remembered_across_runs():
+    state = SyncState()
+    assert state.get_playlist('playlist') is None
+    state.set_playlist('playlist', 'snapshot1', {'id1', 'id2'}, False)
+    assert state.get_playlist('playlist') == ('snapshot1', {'id1', 'id2'}, False)
+    
+    state.set_playlist('playlist', 'snapshot2', {'id1', 'id2', 'id3'}, True)
+    assert SyncState().get_playlist('playlist') == ('snapshot2', {'id1', 'id2', 'id3'}, True)
+
+
+def test_last_sync_is_remembered_per_key():
+    state = SyncState()
+    assert state.get_last_sync('liked') is None
+    state.set_last_sync('liked', 123.5)
+    state.set_last_sync('artist:x', 10.0)
+    assert SyncState().get_last_sync('liked') == 123.5
+    assert SyncState().get_last_sync('artist:x') == 10.0
+
+
+def test_done_tracks_are_only_kept_for_the_run():
+    state = SyncState()
+    state.track_done('id1')
+    state.track_done('id1')
+    assert state.done_tracks() == {'id1'}
+    assert SyncState().done_tracks() == set()
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from zotify import trackstore
+from zotify.const import TRACK_DEDUP_MODE, DOWNLOAD_FORMAT
+from zotify.dirindex import DirectoryIndex
+from zotify.trackstore import TrackStore, materialize
+
+
+@pytest.fixture
+def store(config, monkeypatch) -> TrackStore:
+    config[TRACK_DEDUP_MODE] = 'copy'
+    # a fresh index, so files changed by a test aren't answered from an earlier listing
+    monkeypatch.setattr(trackstore, 'DIR_INDEX', DirectoryIndex())
+    return TrackStore()
+
+
+def test_finds_files_by_song_and_variant(store, tmp_path, config):
+    path = tmp_path / 'song.ogg'
+    path.write_bytes(b'audio')
+    store.add('id1', 'HIGH', path, 'tags')
+    assert store.find('id1', 'HIGH') == (path, 'tags')
+    assert store.find('id1', 'VERY_HIGH') is None
+    assert store.find('id2', 'HIGH') is None
+    
+    config[DOWNLOAD_FORMAT] = 'mp3'
+    assert store.find('id1', 'HIGH') is None
+
+
+def test_forgets_files_that_changed(store, tmp_path, monkeypatch):
+    path = tmp_path / 'song.ogg'
+    path.write_bytes(b'audio')
+    store.add('id1', 'HIGH', path, None)
+    path.write_bytes(b'edited audio')
+    monkeypatch.setattr(trackstore, 'DIR_INDEX', DirectoryIndex())
+    assert store.find('id1', 'HIGH') is None
+    path.write_bytes(b'audio')
+    assert store.find('id1', 'HIGH') is None
+
+
+def test_disabled_when_mode_is_none(store, tmp_path, config):
+    path = tmp_path / 'song.ogg'
+    path.write_bytes(b'audio')
+    config[TRACK_DEDUP_MODE] = 'none'
+    store.add('id1', 'HIGH', path, None)
+    config[TRACK_DEDUP_MODE] = 'copy'
+    assert store.find('id1', 'HIGH') is None
+
+
+@pytest.mark.parametrize('mode', ['copy', 'hardlink', 'reflink'])
+def test_materialize(tmp_path, mode):
+    source, target = tmp_path / 'source.ogg', tmp_path / 'target.ogg'
+    source.write_bytes(b'audio')
+    target.write_bytes(b'old')
+    made = materialize(source, target, mode)
+    assert target.read_bytes() == b'audio'
+    # reflinks fall back to a copy where the filesystem can't
+    assert made in {mode, 'copy'}
+    assert (os.stat(source).st_ino == os.stat(target).st_ino) == (made == 'hardlink')
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['source.ogg', 'target.ogg']
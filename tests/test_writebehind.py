@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from zotify.const import WRITE_BUFFER_SIZE, FSYNC_POLICY
+from zotify.writebehind import WriteBehindFile, open_output
+
+
+@pytest.mark.parametrize('policy', ['never', 'file', 'batch'])
+def test_writes_everything_in_order(tmp_path, config, policy):
+    config[WRITE_BUFFER_SIZE] = 1
+    config[FSYNC_POLICY] = policy
+    data = os.urandom(3 * 1024 * 1024 + 7)
+    path = tmp_path / 'out.bin'
+    with open_output(path, 4 * 1024 * 1024) as file:
+        assert isinstance(file, WriteBehindFile)
+        view = memoryview(data)
+        for i in range(0, len(data), 70000):
+            assert file.write(view[i:i + 70000]) == len(view[i:i + 70000])
+    # the preallocated size is given back
+    assert path.read_bytes() == data
+
+
+def test_mutable_buffers_are_copied(tmp_path):
+    path = tmp_path / 'out.bin'
+    with open_output(path) as file:
+        buffer = bytearray(b'abc')
+        file.write(buffer)
+        buffer[:] = b'xyz'
+        file.write(buffer)
+    assert path.read_bytes() == b'abcxyz'
+
+
+def test_failed_download_is_not_left_at_its_preallocated_size(tmp_path):
+    path = tmp_path / 'out.bin'
+    with pytest.raises(KeyError):
+        with open_output(path, 1024 * 1024) as file:
+            file.write(b'x' * 1000)
+            raise KeyError
+    assert path.stat().st_size < 1024 * 1024
+    assert path.read_bytes() == b'x' * path.stat().st_size
+
+
+@pytest.mark.skipif(not os.path.exists('/dev/full'), reason='needs /dev/full')
+def test_write_errors_surface():
+    file = WriteBehindFile('/dev/full')
+    with pytest.raises(OSError):
+        try:
+            for _ in range(1000):
+                file.write(b'x' * 100000)
+        finally:
+            file.close()
+    assert file.fd is None
+
+
+def test_disabled_buffer_is_a_plain_file(tmp_path, config):
+    config[WRITE_BUFFER_SIZE] = 0
+    with open_output(tmp_path / 'out.bin') as file:
+        assert not isinstance(file, WriteBehindFile)
+
+
+def test_invalid_fsync_policy_is_rejected(tmp_path, config):
+    config[FSYNC_POLICY] = 'sometimes'
+    with pytest.raises(ValueError):
+        open_output(tmp_path / 'out.bin')
+    assert not (tmp_path / 'out.bin').exists()
@@ -4,9 +4,9 @@ __version__ = "0.7.12"
 from enum import IntEnum
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
-from threading import Thread
+from threading import Lock, Thread
 from typing import Any
-from time import time_ns
+from time import time, time_ns
 from urllib.parse import urlencode, urlparse, parse_qs
 
 from librespot.audio import AudioKeyManager, CdnManager
@@ -25,8 +25,10 @@ from librespot.core import (
 from librespot.mercury import MercuryClient
 from librespot.proto import Authentication_pb2 as Authentication
 from pkce import generate_code_verifier, get_code_challenge
-from requests import HTTPError, get, post
+from requests import HTTPError, post
 from logging import getLogger
+
+from zotify.network import http_get
 getLogger("Librespot:AudioKeyManager").disabled = True
 
 
@@ -211,7 +213,7 @@ class ApiClient(LibrespotApiClient):
         params["limit"] = limit
         params["offset"] = offset
 
-        response = get(API_URL + url, headers=headers, params=params)
+        response = http_get(API_URL + url, headers=headers, params=params)
         data = response.json()
 
         try:
@@ -235,15 +237,64 @@ class ApiClient(LibrespotApiClient):
 
 
 class TokenProvider(LibrespotTokenProvider):
+    refresh_margin = 300
+    
     def __init__(self, session: Session):
         super(TokenProvider, self).__init__(session)
         self._session = session
-
+        self._cached: dict[frozenset[str], TokenProvider.StoredToken] = {}
+        self._refresh_lock = Lock()
+    
     def get_token(self, *scopes) -> TokenProvider.StoredToken:
+        """
+        Returns a cached token, refreshed a few minutes before it expires
+        Only one thread refreshes at a time, the others keep using the
+        current token while it is still valid instead of waiting on it.
+        Args:
+            scopes: Scopes the token must grant
+        Returns:
+            StoredToken
+        """
+        key = frozenset(scopes)
+        token = self._cached.get(key)
+        if token is not None and not self.__expires_soon(token):
+            return token
+        
+        if token is not None and not token.expired():
+            if not self._refresh_lock.acquire(blocking=False):
+                return token
+        else:
+            self._refresh_lock.acquire()
+        try:
+            # another thread may have refreshed it while this one waited
+            token = self._cached.get(key)
+            if token is None or self.__expires_soon(token):
+                token = self.__fetch_token(token, *scopes)
+                self._cached[key] = token
+            return token
+        finally:
+            self._refresh_lock.release()
+    
+    def __fetch_token(self, current: TokenProvider.StoredToken | None, *scopes) -> TokenProvider.StoredToken:
         oauth = self._session.oauth()
         if oauth is None:
-            return super().get_token(*scopes)
-        return oauth.get_token()
+            # skip librespot's own cache, it would hand back the same token until it has expired
+            token = self.login5(list(scopes))
+        else:
+            token = oauth.get_token()
+            if self.__expires_soon(token):
+                oauth.set_token(token.refresh_token, OAuth.RequestType.REFRESH)
+                token = oauth.get_token()
+        
+        if token is None:
+            if current is not None and not current.expired():
+                return current
+            raise RuntimeError("Failed fetching access token!")
+        return token
+    
+    def __expires_soon(self, token: LibrespotTokenProvider.StoredToken) -> bool:
+        margin = min(self.refresh_margin, token.expires_in / 2)
+        return token.timestamp / 1_000_000 + token.expires_in - margin < time()
 
     class StoredToken(LibrespotTokenProvider.StoredToken):
         def __init__(self, obj):
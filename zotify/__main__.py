@@ -55,6 +55,9 @@ def main():
                         action='store_true')
     parser.add_argument('--update-config',
                         action='store_true')
+    parser.add_argument('--plan-only',
+                        action='store_true',
+                        help='Print what would be downloaded and skipped, with estimated sizes, without downloading anything')
     
     group = parser.add_mutually_exclusive_group(required=False)
     group.add_argument('urls',
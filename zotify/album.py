@@ -1,10 +1,21 @@
-from zotify.const import ALBUM_URL, ARTIST_URL, ITEMS, ARTISTS, NAME, ID, DISC_NUMBER
-from zotify.termoutput import Printer
-from zotify.track import download_track
+import datetime
+from time import time
+
+from zotify.const import ALBUM_URL, ARTIST_URL, ITEMS, ARTISTS, NAME, ID, DISC_NUMBER, TRACKS, RELEASE_DATE
+from zotify.mover import MOVER
+from zotify.plan import PLANNER
+from zotify.pool import DownloadPool
+from zotify.syncstate import SYNC_STATE
+from zotify.termoutput import Printer, PrintChannel
+from zotify.track import download_track_stages, prefetch_song_info
 from zotify.utils import fix_filename
 from zotify.zotify import Zotify
 
 
+# album id -> track ids of the albums already handled this run, a collaboration shows up under each of its artists
+DOWNLOADED_ALBUMS: dict[str, list[str]] = {}
+
+
 def get_album_info(album_id):
     """ Returns album info and tracklist"""
     
@@ -13,62 +24,93 @@ def get_album_info(album_id):
     album_name = fix_filename(resp[NAME])
     album_artist = resp[ARTISTS][0][NAME]
     
-    songs = []
-    offset = 0
-    limit = 50
-    
-    while True:
-        resp = Zotify.invoke_url_with_params(f'{ALBUM_URL}/{album_id}/tracks', limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
+    # the album response already holds the first page of its tracks
+    songs = Zotify.invoke_url_paginated(f'{ALBUM_URL}/{album_id}/tracks', limit=50, first_page=resp[TRACKS])
     
     total_discs = songs[-1][DISC_NUMBER]
     
     return album_name, album_artist, songs, total_discs
 
 
-def get_artist_albums(artist_id):
+def get_artist_albums(artist_id) -> list[dict]:
     """ Returns artist's albums """
-    (raw, resp) = Zotify.invoke_url(f'{ARTIST_URL}/{artist_id}/albums?include_groups=album%2Csingle')
-    # Return a list each album's id
-    album_ids = [resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))]
+    (raw, resp) = Zotify.invoke_url(f'{ARTIST_URL}/{artist_id}/albums?include_groups=album%2Csingle&limit=50')
+    albums = list(resp[ITEMS])
     # Recursive requests to get all albums including singles an EPs
     while resp['next'] is not None:
         (raw, resp) = Zotify.invoke_url(resp['next'])
-        album_ids.extend([resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))])
+        albums.extend(resp[ITEMS])
     
-    return album_ids
+    return albums
+
+
+def is_released_since(album: dict, timestamp: float) -> bool:
+    """ Whether an album's release_date is on or after the given time, at the precision the date is given in """
+    since = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%d')
+    # release dates may only be "YYYY" or "YYYY-MM", so compare just as many characters
+    release_date = album.get(RELEASE_DATE) or ''
+    return release_date >= since[:len(release_date)]
+
+
+def release_timestamp(album: dict) -> float:
+    """ Returns the start of an album's release_date as a UTC timestamp """
+    if not album.get(RELEASE_DATE):
+        return 0.0
+    date = (album[RELEASE_DATE] + '-01-01')[:10]
+    return datetime.datetime.strptime(date, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc).timestamp()
 
 
 def download_artist_albums(artist, pbar_stack: list | None = None):
-    """ Downloads albums of an artist """
+    """ Downloads albums of an artist, when syncing incrementally only those released since its last sync """
     albums = get_artist_albums(artist)
     
+    incremental = Zotify.CONFIG.get_incremental_sync()
+    sync_start = time()
+    if incremental:
+        last_sync = SYNC_STATE.get_last_sync(f'artist:{artist}')
+        if last_sync is not None:
+            albums = [album for album in albums if is_released_since(album, last_sync)]
+            if not albums:
+                Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  NO NEW RELEASES SINCE LAST SYNC   ###\n' +\
+                                                 f'###   Artist_ID: {artist}   ###')
+    
     pos, pbar_stack = Printer.pbar_position_handler(5, pbar_stack)
     pbar = Printer.pbar(albums, unit='album', pos=pos,
                         disable=not Zotify.CONFIG.get_show_artist_pbar())
     pbar_stack.append(pbar)
     
-    for album_id in pbar:
-        download_album(album_id, pbar_stack)
-        pbar.set_description(get_album_info(album_id)[0])
-        Printer.refresh_all_pbars(pbar_stack)
+    synced_until = sync_start
+    for album in pbar:
+        if album[ID] in DOWNLOADED_ALBUMS:
+            # already downloaded for another artist, its tracks still count for this one's sync
+            track_ids = DOWNLOADED_ALBUMS[album[ID]]
+        else:
+            album_name, track_ids = download_album(album[ID], pbar_stack)
+            DOWNLOADED_ALBUMS[album[ID]] = track_ids
+            pbar.set_description(album_name)
+            Printer.refresh_all_pbars(pbar_stack)
+        
+        if incremental:
+            # an album with tracks this run didn't get into the library stays "new" until they make it in
+            MOVER.join()
+            done = SYNC_STATE.done_tracks()
+            if any(track_id not in done for track_id in track_ids):
+                synced_until = min(synced_until, release_timestamp(album))
+    
+    if incremental and not PLANNER.plan_only:
+        SYNC_STATE.set_last_sync(f'artist:{artist}', synced_until)
 
 
-def download_album(album, pbar_stack: list | None = None, M3U8_bypass: str | None = None):
-    """ Downloads songs from an album """
+def download_album(album, pbar_stack: list | None = None, M3U8_bypass: str | None = None) -> tuple[str, list[str]]:
+    """ Downloads songs from an album, returning its name and track ids """
     album_name, album_artist, tracks, total_discs = get_album_info(album)
     char_num = max({len(str(len(tracks))), 2})
     
-    pos, pbar_stack = Printer.pbar_position_handler(3, pbar_stack)
-    pbar = Printer.pbar(tracks, unit='song', pos=pos, 
-                        disable=not Zotify.CONFIG.get_show_album_pbar())
-    pbar_stack.append(pbar)
+    prefetch_song_info([track[ID] for track in tracks])
+    
+    jobs = []
+    for n, track in enumerate(tracks, 1):
     
-    for n, track in enumerate(pbar, 1):
-        
         extra_keys={'album_num': str(n).zfill(char_num), 
                     'album_artist': album_artist, 
                     'album': album_name, 
@@ -78,8 +120,24 @@ def download_album(album, pbar_stack: list | None = None, M3U8_bypass: str | Non
         if M3U8_bypass is not None:
             extra_keys['M3U8_bypass'] = M3U8_bypass
         
-        download_track('album', track[ID], 
-                       extra_keys,
-                       pbar_stack)
-        pbar.set_description(track[NAME])
-        Printer.refresh_all_pbars(pbar_stack)
+        jobs.append(('album', track[ID], extra_keys))
+    
+    jobs = PLANNER.plan(album_name, jobs)
+    if PLANNER.plan_only:
+        return album_name, [track[ID] for track in tracks]
+    track_names = {track[ID]: track[NAME] for track in tracks}
+    
+    pos, pbar_stack = Printer.pbar_position_handler(3, pbar_stack)
+    pbar = Printer.pbar(jobs, unit='song', pos=pos, 
+                        disable=not Zotify.CONFIG.get_show_album_pbar())
+    pbar_stack.append(pbar)
+    
+    with DownloadPool() as pool:
+        for mode, track_id, extra_keys in pbar:
+            pool.submit(download_track_stages, mode, track_id, 
+                        extra_keys,
+                        pbar_stack)
+            pbar.set_description(track_names[track_id])
+            Printer.refresh_all_pbars(pbar_stack)
+    
+    return album_name, [track[ID] for track in tracks]
@@ -2,15 +2,22 @@ from argparse import Namespace
 from librespot.audio.decoders import AudioQuality
 from tabulate import tabulate
 from pathlib import Path
+from time import time
 
 from zotify.album import download_album, download_artist_albums
+from zotify.artcache import ALBUM_ART_CACHE
+from zotify.cache import API_CACHE, REQUEST_MEMO
 from zotify.const import TRACK, NAME, ID, ARTIST, ARTISTS, ITEMS, TRACKS, EXPLICIT, ALBUM, ALBUMS, \
-    OWNER, PLAYLIST, PLAYLISTS, DISPLAY_NAME, USER_FOLLOWED_ARTISTS_URL, USER_SAVED_TRACKS_URL, SEARCH_URL
+    OWNER, PLAYLIST, PLAYLISTS, DISPLAY_NAME, USER_FOLLOWED_ARTISTS_URL, USER_SAVED_TRACKS_URL, SEARCH_URL, ADDED_AT
 from zotify.playlist import get_playlist_info, download_from_user_playlist, download_playlist
+from zotify.mover import MOVER
+from zotify.plan import PLANNER
 from zotify.podcast import download_episode, download_show
+from zotify.pool import DownloadPool
+from zotify.syncstate import SYNC_STATE
 from zotify.termoutput import Printer, PrintChannel
-from zotify.track import download_track
-from zotify.utils import split_sanitize_input, regex_input_for_urls
+from zotify.track import download_track, download_track_stages, prefetch_song_info
+from zotify.utils import split_sanitize_input, regex_input_for_urls, strptime_utc
 from zotify.zotify import Zotify
 
 
@@ -23,45 +30,67 @@ def download_from_urls(urls: list[str]) -> int:
                         disable=not Zotify.CONFIG.get_show_url_pbar())
     pbar_stack = [pbar]
     
-    for url in pbar:
-        result = regex_input_for_urls(url)
-        if all({res is None for res in result}):
-            continue
-        
-        track_id, album_id, playlist_id, episode_id, show_id, artist_id = result
-        if track_id is not None:
-            download_track('single', track_id, None, pbar_stack)
-        elif album_id is not None:
-            download_album(album_id, pbar_stack)
-        elif playlist_id is not None:
-            download_playlist({ID: playlist_id,
-                               NAME: get_playlist_info(playlist_id)[0]},
-                               pbar_stack)
-        elif episode_id is not None:
-            download_episode(episode_id, pbar_stack)
-        elif show_id is not None:
-            download_show(show_id, pbar_stack)
-        elif artist_id is not None:
-            download_artist_albums(artist_id, pbar_stack)
-        
-        download += 1 
-        Printer.refresh_all_pbars(pbar_stack)
+    track_ids = [regex_input_for_urls(url)[0] for url in urls]
+    prefetch_song_info(track_ids)
+    # collections are planned on their own once they're reached
+    queued = {track_id for mode, track_id, extra_keys in
+              PLANNER.plan('Tracks', [('single', track_id, None) for track_id in track_ids if track_id is not None])}
+    
+    with DownloadPool() as pool:
+        for url in pbar:
+            result = regex_input_for_urls(url)
+            if all({res is None for res in result}):
+                continue
+            
+            track_id, album_id, playlist_id, episode_id, show_id, artist_id = result
+            if track_id is not None:
+                if track_id in queued and not PLANNER.plan_only:
+                    pool.submit(download_track_stages, 'single', track_id, None, pbar_stack)
+            elif PLANNER.plan_only and (episode_id is not None or show_id is not None):
+                # podcasts aren't planned
+                continue
+            else:
+                # collections run their own pool, finish queued singles first to keep m3u8 order
+                pool.join()
+                if album_id is not None:
+                    download_album(album_id, pbar_stack)
+                elif playlist_id is not None:
+                    download_playlist({ID: playlist_id,
+                                       NAME: get_playlist_info(playlist_id)[0]},
+                                       pbar_stack)
+                elif episode_id is not None:
+                    download_episode(episode_id, pbar_stack)
+                elif show_id is not None:
+                    download_show(show_id, pbar_stack)
+                elif artist_id is not None:
+                    download_artist_albums(artist_id, pbar_stack)
+            
+            download += 1 
+            Printer.refresh_all_pbars(pbar_stack)
     
     return download
 
 
-def get_saved_tracks() -> list:
-    """ Returns user's saved tracks """
+def get_saved_tracks(incremental: bool = False) -> list:
+    """ Returns user's saved tracks, when incremental only down to the first page with nothing new """
+    if not incremental:
+        return Zotify.invoke_url_paginated(USER_SAVED_TRACKS_URL, limit=50)
+    
+    last_sync = SYNC_STATE.get_last_sync('liked')
+    
+    def is_synced(song: dict) -> bool:
+        return last_sync is not None and strptime_utc(song[ADDED_AT]).timestamp() < last_sync
+    
+    # liked songs come newest first, so everything past a fully synced page was synced too
     songs = []
     offset = 0
     limit = 50
-    
     while True:
-        resp = Zotify.invoke_url_with_params(
-            USER_SAVED_TRACKS_URL, limit=limit, offset=offset)
+        resp = Zotify.invoke_url_with_params(USER_SAVED_TRACKS_URL, limit=limit, offset=offset)
         offset += limit
+        # the synced page is kept, the Liked Songs .m3u8 archive merges on the first known song
         songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
+        if len(resp[ITEMS]) < limit or all(is_synced(song) for song in resp[ITEMS]):
             break
     
     return songs
@@ -249,7 +278,9 @@ def search(search_term) -> None:
         
         selection = search_results[choice - 1]
         if selection['type'] == TRACK:
-            download_track('single', selection[ID], None, pbar_stack)
+            prefetch_song_info([selection[ID]])
+            if PLANNER.plan('Tracks', [('single', selection[ID], None)]) and not PLANNER.plan_only:
+                download_track('single', selection[ID], None, pbar_stack)
         elif selection['type'] == ALBUM:
             download_album(selection[ID], pbar_stack)
         elif selection['type'] == ARTIST:
@@ -272,7 +303,21 @@ def client(args: Namespace) -> None:
         'very_high': AudioQuality.VERY_HIGH
     }
     Zotify.DOWNLOAD_QUALITY = quality_options[Zotify.CONFIG.get_download_quality()]
+    PLANNER.plan_only = args.plan_only
     
+    try:
+        download_from_args(args)
+    finally:
+        # staged tracks still being moved into the library, and their archive and m3u8 entries
+        MOVER.join()
+        PLANNER.print_totals()
+        API_CACHE.print_stats()
+        REQUEST_MEMO.print_stats()
+        ALBUM_ART_CACHE.print_stats()
+
+
+def download_from_args(args: Namespace) -> None:
+    """ Runs the download or search requested on the commandline """
     if args.file_of_urls:
         urls = []
         filename = args.file_of_urls
@@ -299,21 +344,43 @@ def client(args: Namespace) -> None:
         return
     
     elif args.liked_songs:
-        liked_songs = get_saved_tracks()
+        # a partial pass only fits the cumulative Liked Songs .m3u8, not a fresh one per run
+        incremental = Zotify.CONFIG.get_incremental_sync() and \
+            (not Zotify.CONFIG.get_export_m3u8() or Zotify.CONFIG.get_liked_songs_archive_m3u8())
+        sync_start = time()
+        liked_songs = get_saved_tracks(incremental)
         
         pos = 3
         pbar = Printer.pbar(liked_songs, unit='song', pos=pos, 
                             disable=not Zotify.CONFIG.get_show_playlist_pbar())
         pbar_stack = [pbar]
         
-        for song in pbar:
-            if not song[TRACK][NAME] or not song[TRACK][ID]:
-                Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG NO LONGER EXISTS   ###\n' +\
-                                                 f'###   Track_Name: {song[TRACK][NAME]} - Track_Name: {song[TRACK][ID]}   ###')
-            else:
-                download_track('liked', song[TRACK][ID], None, pbar_stack)
-                pbar.set_description(song[TRACK][NAME])
-                Printer.refresh_all_pbars(pbar_stack)
+        prefetch_song_info([song[TRACK][ID] for song in liked_songs if song[TRACK][NAME]])
+        queued = {track_id for mode, track_id, extra_keys in
+                  PLANNER.plan('Liked Songs', [('liked', song[TRACK][ID], None) for song in liked_songs
+                                               if song[TRACK][NAME] and song[TRACK][ID]])}
+        if PLANNER.plan_only:
+            return
+        
+        with DownloadPool() as pool:
+            for song in pbar:
+                if not song[TRACK][NAME] or not song[TRACK][ID]:
+                    Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG NO LONGER EXISTS   ###\n' +\
+                                                     f'###   Track_Name: {song[TRACK][NAME]} - Track_Name: {song[TRACK][ID]}   ###')
+                elif song[TRACK][ID] in queued:
+                    pool.submit(download_track_stages, 'liked', song[TRACK][ID], None, pbar_stack)
+                    pbar.set_description(song[TRACK][NAME])
+                    Printer.refresh_all_pbars(pbar_stack)
+        
+        if incremental:
+            # resume from the oldest song whose download failed, so it's retried; unavailable ones count as done
+            synced_until = sync_start
+            MOVER.join()
+            done = SYNC_STATE.done_tracks()
+            for song in liked_songs:
+                if song[TRACK][NAME] and song[TRACK][ID] and song[TRACK][ID] not in done:
+                    synced_until = min(synced_until, strptime_utc(song[ADDED_AT]).timestamp())
+            SYNC_STATE.set_last_sync('liked', synced_until)
         return
     
     elif args.followed_artists:
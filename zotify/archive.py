@@ -0,0 +1,213 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path, PurePath
+
+from zotify.config import Config
+
+
+class SongArchive:
+    """
+    SQLite store behind the global song archive and the per-directory archives
+    
+    Lookups are answered from in-memory sets loaded once per run, and adds are
+    written through to the database so other processes sharing it see them on their
+    next run. The plain text archive files are reread whenever their size or mtime
+    changed since they were last loaded. A directory's .song_ids file stays
+    authoritative, as it's what moves with the folder: its rows are replaced by the
+    file's, and dropped if it was deleted. The global .song_archive file is merged
+    in, dropping the songs whose lines were removed from it, so editing it still
+    works. Songs still on their way into the library can be reserved, so they count
+    as archived for this run before their entry is written.
+    """
+    
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._song_ids: set[str] | None = None
+        self._directory_song_ids: dict[str, set[str]] = {}
+        # directory key (None for the global archive) -> ids reserved but not added yet
+        self._reserved: dict[str | None, set[str]] = {}
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db_path = self.location()
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS songs (song_id TEXT PRIMARY KEY, downloaded TEXT, '
+                             'author_name TEXT, song_name TEXT, filename TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS directory_songs (directory TEXT NOT NULL, song_id TEXT NOT NULL, '
+                             'downloaded TEXT, author_name TEXT, song_name TEXT, filename TEXT, '
+                             'PRIMARY KEY (directory, song_id))')
+            # the global archive file as last seen, by path, and the songs it held
+            self._db.execute('CREATE TABLE IF NOT EXISTS archive_files (source TEXT PRIMARY KEY, '
+                             'mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS archive_file_songs (source TEXT NOT NULL, song_id TEXT NOT NULL, '
+                             'PRIMARY KEY (source, song_id))')
+            # the .song_ids file each directory's rows were loaded from, as last seen
+            self._db.execute('CREATE TABLE IF NOT EXISTS directory_files (directory TEXT PRIMARY KEY, '
+                             'mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL)')
+        return self._db
+    
+    @staticmethod
+    def location() -> PurePath:
+        return Config.get_song_archive_location().with_name('.song_archive.db')
+    
+    @staticmethod
+    def directory_key(download_path: str | PurePath) -> str:
+        # relative to ROOT_PATH when inside it, so the library can be moved
+        path = Path(download_path).expanduser().absolute()
+        try:
+            return path.relative_to(Path(Config.get_root_path()).absolute()).as_posix()
+        except ValueError:
+            return path.as_posix()
+    
+    @staticmethod
+    def _stat(tsv_path: PurePath) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(tsv_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    @staticmethod
+    def _read_tsv(tsv_path: PurePath) -> list[list[str | None]]:
+        rows = []
+        if Path(tsv_path).is_file():
+            with open(tsv_path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    fields = line.rstrip('\n').split('\t')
+                    if fields[0].strip():
+                        rows.append((fields + [None] * 5)[:5])
+        return rows
+    
+    @staticmethod
+    def _source(tsv_path: PurePath) -> str:
+        return Path(tsv_path).absolute().as_posix()
+    
+    def _load_global_tsv(self, db: sqlite3.Connection, tsv_path: PurePath) -> None:
+        """ Merges the global archive file into the songs table if the file changed since it was loaded """
+        source = self._source(tsv_path)
+        current = self._stat(tsv_path)
+        row = db.execute('SELECT mtime_ns, size FROM archive_files WHERE source = ?', (source,)).fetchone()
+        last = tuple(row) if row is not None else None
+        if current == last:
+            return
+        
+        rows = self._read_tsv(tsv_path) if current is not None else []
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if current is None:
+                # a deleted file doesn't take the songs downloaded since with it
+                db.execute('DELETE FROM archive_files WHERE source = ?', (source,))
+                db.execute('DELETE FROM archive_file_songs WHERE source = ?', (source,))
+            else:
+                # only songs the file held before are dropped, songs added while it wasn't exported are kept
+                song_ids = {row[0] for row in rows}
+                removed = [(song_id,) for (song_id,) in db.execute(
+                    'SELECT song_id FROM archive_file_songs WHERE source = ?', (source,)) if song_id not in song_ids]
+                db.executemany('DELETE FROM songs WHERE song_id = ?', removed)
+                db.executemany('INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?)', rows)
+                db.execute('DELETE FROM archive_file_songs WHERE source = ?', (source,))
+                db.executemany('INSERT OR IGNORE INTO archive_file_songs VALUES (?, ?)',
+                               [(source, song_id) for song_id in song_ids])
+                db.execute('INSERT OR REPLACE INTO archive_files VALUES (?, ?, ?)', (source, *current))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+    
+    def _load_directory_tsv(self, db: sqlite3.Connection, tsv_path: PurePath, directory: str) -> None:
+        """ Reloads a directory's rows from its .song_ids file if the file changed since they were loaded """
+        current = self._stat(tsv_path)
+        row = db.execute('SELECT mtime_ns, size FROM directory_files WHERE directory = ?', (directory,)).fetchone()
+        last = tuple(row) if row is not None else None
+        if current == last:
+            return
+        
+        rows = self._read_tsv(tsv_path) if current is not None else []
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            # rows from before the file was first loaded (written without it) are kept
+            if last is not None:
+                db.execute('DELETE FROM directory_songs WHERE directory = ?', (directory,))
+            db.executemany('INSERT OR REPLACE INTO directory_songs VALUES (?, ?, ?, ?, ?, ?)',
+                           [(directory, *row) for row in rows])
+            if current is None:
+                db.execute('DELETE FROM directory_files WHERE directory = ?', (directory,))
+            else:
+                db.execute('INSERT OR REPLACE INTO directory_files VALUES (?, ?, ?)', (directory, *current))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+    
+    def song_ids(self) -> set[str]:
+        """ Returns the ids in the global archive, the set is shared and must not be modified """
+        with self._lock:
+            if self._song_ids is None:
+                db = self._connect()
+                self._load_global_tsv(db, Config.get_song_archive_location())
+                self._song_ids = {row[0] for row in db.execute('SELECT song_id FROM songs')}
+            return self._song_ids
+    
+    def directory_song_ids(self, download_path: str | PurePath) -> set[str]:
+        """ Returns the ids archived for a download directory, the set is shared and must not be modified """
+        key = self.directory_key(download_path)
+        with self._lock:
+            if key not in self._directory_song_ids:
+                db = self._connect()
+                self._load_directory_tsv(db, PurePath(download_path) / '.song_ids', key)
+                self._directory_song_ids[key] = {row[0] for row in db.execute(
+                    'SELECT song_id FROM directory_songs WHERE directory = ?', (key,))}
+            return self._directory_song_ids[key]
+    
+    def add(self, song_id: str, downloaded: str, author_name: str, song_name: str, filename: str) -> None:
+        self.song_ids()
+        with self._lock:
+            db = self._connect()
+            db.execute('INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?)',
+                       (song_id, downloaded, author_name, song_name, filename))
+            if Config.get_export_tsv_archives():
+                # its line is appended to the file, so removing that line later drops it again
+                db.execute('INSERT OR IGNORE INTO archive_file_songs VALUES (?, ?)',
+                           (self._source(Config.get_song_archive_location()), song_id))
+            self._song_ids.add(song_id)
+            self._reserved.get(None, set()).discard(song_id)
+    
+    def add_to_directory(self, download_path: str | PurePath, song_id: str, downloaded: str,
+                         author_name: str, song_name: str, filename: str) -> None:
+        song_ids = self.directory_song_ids(download_path)
+        key = self.directory_key(download_path)
+        with self._lock:
+            self._connect().execute('INSERT OR REPLACE INTO directory_songs VALUES (?, ?, ?, ?, ?, ?)',
+                                    (key, song_id, downloaded, author_name, song_name, filename))
+            song_ids.add(song_id)
+            self._reserved.get(key, set()).discard(song_id)
+    
+    def reserve(self, song_id: str, download_path: str | PurePath | None = None) -> None:
+        """ Counts song_id as archived (for download_path, when given) until it's added or released """
+        if download_path is None:
+            song_ids, key = self.song_ids(), None
+        else:
+            song_ids, key = self.directory_song_ids(download_path), self.directory_key(download_path)
+        with self._lock:
+            if song_id not in song_ids:
+                self._reserved.setdefault(key, set()).add(song_id)
+                song_ids.add(song_id)
+    
+    def release(self, song_id: str, download_path: str | PurePath | None = None) -> None:
+        """ Drops a reservation whose song never made it into the library """
+        key = None if download_path is None else self.directory_key(download_path)
+        with self._lock:
+            reserved = self._reserved.get(key)
+            if reserved is None or song_id not in reserved:
+                return
+            reserved.discard(song_id)
+            song_ids = self._song_ids if key is None else self._directory_song_ids.get(key)
+            if song_ids is not None:
+                song_ids.discard(song_id)
+
+
+SONG_ARCHIVE = SongArchive()
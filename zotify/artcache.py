@@ -0,0 +1,131 @@
+import hashlib
+import io
+import os
+import threading
+import uuid
+from pathlib import Path, PurePath
+
+from zotify.cache import RequestMemo
+from zotify.config import Config
+from zotify.network import http_get
+from zotify.termoutput import Printer
+
+
+class AlbumArtCache:
+    """
+    Cache of album cover images, in memory for this run and on disk across runs
+    
+    Every track of an album shares its cover, so the image is requested once and then
+    reused for the album's other tracks, concurrent requests for it included. Covers
+    are stored by a hash of their URL and the ALBUM_ART_MAX_SIZE/ALBUM_ART_QUALITY they
+    were processed with, and the least recently used ones are evicted once the disk
+    cache grows past ALBUM_ART_CACHE_SIZE megabytes.
+    """
+    
+    def __init__(self, max_entries: int = 32) -> None:
+        self._memo = RequestMemo(max_entries)
+        self._lock = threading.Lock()
+        self._size: int | None = None
+        self.downloads = 0
+    
+    @staticmethod
+    def key(image_url: str) -> str:
+        variant = f'{image_url}|{Config.get_album_art_max_size()}|{Config.get_album_art_quality()}'
+        return hashlib.sha1(variant.encode('utf-8')).hexdigest()
+    
+    def get(self, image_url: str) -> bytes:
+        """ Returns the (processed) cover image at image_url, only requesting it if it isn't cached """
+        key = self.key(image_url)
+        # a failed load raises, and isn't remembered for the album's other tracks
+        return self._memo.fetch(key, lambda: self._load(key, image_url), keep=is_image)
+    
+    def _load(self, key: str, image_url: str) -> bytes:
+        max_size = Config.get_album_art_cache_size() * 1024 * 1024
+        path = Config.get_album_art_cache_location() / f'{key}.jpg'
+        if max_size:
+            try:
+                img = Path(path).read_bytes()
+                if is_image(img):
+                    # mtime doubles as last use, for eviction
+                    os.utime(path)
+                    return img
+                Path(path).unlink()
+            except OSError:
+                pass
+        
+        response = http_get(image_url)
+        response.raise_for_status()
+        if not is_image(response.content):
+            raise ValueError(f'Album art at {image_url} is not an image')
+        # jpeg format expected from request
+        img = process_cover(response.content)
+        self.downloads += 1
+        if max_size:
+            self._store(path, img, max_size)
+        return img
+    
+    def _store(self, path: PurePath, img: bytes, max_size: int) -> None:
+        with self._lock:
+            Path(path.parent).mkdir(parents=True, exist_ok=True)
+            if self._size is None:
+                self._size = sum(entry.stat().st_size for entry in os.scandir(path.parent) if entry.is_file())
+            # written aside and moved in place, so concurrent runs never read half a file
+            temp = path.with_name(f'.{uuid.uuid4().hex}.tmp')
+            with open(temp, 'wb') as file:
+                file.write(img)
+            Path(temp).replace(path)
+            self._size += len(img)
+            if self._size > max_size:
+                self._evict(path.parent, max_size)
+    
+    def _evict(self, directory: PurePath, max_size: int) -> None:
+        entries = sorted((entry for entry in os.scandir(directory) if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime)
+        self._size = sum(entry.stat().st_size for entry in entries)
+        # trim to 90% so a full cache doesn't evict on every single insert
+        for entry in entries:
+            if self._size <= max_size * 0.9:
+                break
+            try:
+                Path(entry.path).unlink()
+            except OSError:
+                continue
+            self._size -= entry.stat().st_size
+    
+    def print_stats(self) -> None:
+        Printer.debug(f'###   ALBUM ART CACHE: {self.downloads} COVERS DOWNLOADED, ' +\
+                      f'{self._memo.saved} REUSED IN MEMORY   ###')
+
+
+def is_image(img: bytes) -> bool:
+    """ Tells cover images (jpeg, png or webp) from error pages and truncated responses """
+    return img.startswith((b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n')) or (img[:4] == b'RIFF' and img[8:12] == b'WEBP')
+
+
+def process_cover(img: bytes) -> bytes:
+    """ Downscales and/or recompresses a cover image as set by ALBUM_ART_MAX_SIZE and ALBUM_ART_QUALITY """
+    max_dimension = Config.get_album_art_max_size()
+    quality = Config.get_album_art_quality()
+    if not max_dimension and not quality:
+        return img
+    
+    from PIL import Image
+    try:
+        with Image.open(io.BytesIO(img)) as image:
+            resize = max_dimension and max(image.size) > max_dimension
+            if not resize and not quality:
+                return img
+            if resize:
+                image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            out = io.BytesIO()
+            image.convert('RGB').save(out, 'JPEG', quality=quality or 90, optimize=True)
+    except (OSError, ValueError) as e:
+        Printer.debug(f'###   COULD NOT PROCESS ALBUM ART, EMBEDDING IT AS IS: {e}   ###')
+        return img
+    
+    processed = out.getvalue()
+    # recompressing an already small jpeg can grow it
+    return processed if resize or len(processed) < len(img) else img
+
+
+ALBUM_ART_CACHE = AlbumArtCache()
@@ -0,0 +1,191 @@
+import copy
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable
+
+from zotify.config import Config
+from zotify.const import TRACKS_URL, ALBUM_URL, ARTIST_URL, EPISODE_INFO_URL, TRACK_STATS_URL
+from zotify.termoutput import Printer, PrintChannel
+
+
+DAY = 24 * 60 * 60
+
+# first match wins, anything unlisted (playlists, the user's library, search...) is never cached
+API_CACHE_TTLS = (
+    (re.escape(ARTIST_URL) + r'/\w+/albums', 0), # discographies grow with every new release
+    (re.escape(ARTIST_URL), DAY),
+    (re.escape(TRACKS_URL), 7 * DAY),
+    (re.escape(ALBUM_URL), 7 * DAY),
+    (re.escape(EPISODE_INFO_URL), 7 * DAY),
+    (re.escape(TRACK_STATS_URL), 30 * DAY),
+    (r'https://spclient\.wg\.\w+\.com/color-lyrics/', 7 * DAY),
+)
+
+
+class ApiCache:
+    """
+    Persistent SQLite cache of successful Web API responses, keyed by URL and parameters
+    
+    Entries expire after their endpoint's TTL and the least recently used ones are
+    evicted once the database grows past API_CACHE_SIZE megabytes.
+    """
+    
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._size = 0
+        self._ttls = [(re.compile(pattern), ttl) for pattern, ttl in API_CACHE_TTLS]
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(url: str, params: dict | None = None) -> str:
+        if params:
+            url += '#' + '&'.join(f'{k}={params[k]}' for k in sorted(params))
+        # responses are localized
+        return f'{Config.get_language()}|{url}'
+    
+    def ttl(self, url: str) -> int:
+        for pattern, ttl in self._ttls:
+            if pattern.match(url):
+                return ttl
+        return 0
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db_path = Config.get_api_cache_location()
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, body TEXT NOT NULL, '
+                             'size INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            self._size = self._total_size()
+        return self._db
+    
+    def _total_size(self) -> int:
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+    
+    def get(self, url: str, params: dict | None = None) -> str | None:
+        """ Returns the cached raw response body, or None if missing, expired or bypassed """
+        if Config.get_disable_api_cache() or not self.ttl(url):
+            return None
+        
+        key = self.key(url, params)
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            row = db.execute('SELECT body FROM responses WHERE key = ? AND expires > ?', (key, now)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return row[0]
+    
+    def put(self, url: str, body: str, params: dict | None = None) -> None:
+        """ Stores a successful response body under its endpoint's TTL """
+        ttl = self.ttl(url)
+        if Config.get_disable_api_cache() or not ttl or not body:
+            return
+        
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                       (self.key(url, params), body, len(body), now + ttl, now))
+            # running estimate, only recounted when it looks like the cache is full
+            self._size += len(body)
+            if self._size > Config.get_api_cache_size() * 1024 * 1024:
+                self._evict(db, now)
+    
+    def _evict(self, db: sqlite3.Connection, now: float) -> None:
+        max_size = Config.get_api_cache_size() * 1024 * 1024
+        db.execute('DELETE FROM responses WHERE expires <= ?', (now,))
+        # trim to 90% so a full cache doesn't evict on every single insert
+        excess = self._total_size() - int(max_size * 0.9)
+        if excess > 0:
+            for key, entry_size in db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+                if excess <= 0:
+                    break
+                db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                excess -= entry_size
+        self._size = self._total_size()
+    
+    def print_stats(self) -> None:
+        lookups = self.hits + self.misses
+        if not lookups:
+            return
+        Printer.print(PrintChannel.PROGRESS_INFO, f'###   API CACHE: {self.hits} HITS / {lookups} LOOKUPS ' +\
+                                                  f'({self.hits / lookups:.0%} HIT RATE)   ###')
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class RequestMemo:
+    """
+    In-memory memo of this run's API responses, in front of the persistent cache
+    
+    Identical requests made while one is already in flight wait for and share its
+    response instead of being sent again. Only the most recent responses are kept.
+    Every caller gets its own copy, so changing a response doesn't change it for others.
+    """
+    
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._results: OrderedDict[str, Any] = OrderedDict()
+        self._inflight: dict[str, _Flight] = {}
+        self.saved = 0
+    
+    def fetch(self, key: str, func: Callable[[], Any], keep: Callable[[Any], bool] = lambda result: True) -> Any:
+        """ Returns func()'s result for this key, calling it only if no other call has or is producing it """
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.saved += 1
+                return copy.deepcopy(self._results[key])
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.saved += 1
+        
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+        
+        try:
+            flight.result = func()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                # failed responses are shared with the waiting requests, but not remembered
+                if flight.error is None and keep(flight.result):
+                    self._results[key] = flight.result
+                    if len(self._results) > self.max_entries:
+                        self._results.popitem(last=False)
+            flight.done.set()
+        return copy.deepcopy(flight.result)
+    
+    def print_stats(self) -> None:
+        Printer.debug(f'###   REQUEST MEMO: {self.saved} DUPLICATE API CALLS SAVED   ###')
+
+
+API_CACHE = ApiCache()
+REQUEST_MEMO = RequestMemo()
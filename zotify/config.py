@@ -1,4 +1,5 @@
 import json
+import os
 import sys
 from pathlib import Path, PurePath
 from typing import Any
@@ -35,15 +36,24 @@ CONFIG_VALUES = {
     MAX_FILENAME_LENGTH:        { 'default': '0',                       'type': int,    'arg': ('--max-filename-length'                  ,) },
     
     # Download Options
-    BULK_WAIT_TIME:             { 'default': '1',                       'type': int,    'arg': ('--bulk-wait-time'                       ,) },
+    BULK_WAIT_TIME:             { 'default': '0',                       'type': int,    'arg': ('--bulk-wait-time'                       ,) },
     DOWNLOAD_REAL_TIME:         { 'default': 'False',                   'type': bool,   'arg': ('-rt', '--download-real-time'            ,) },
     TEMP_DOWNLOAD_DIR:          { 'default': '',                        'type': str,    'arg': ('-td', '--temp-download-dir'             ,) },
+    MOVE_WORKERS:               { 'default': '2',                       'type': int,    'arg': ('--move-workers'                         ,) },
+    MOVE_RETRIES:               { 'default': '3',                       'type': int,    'arg': ('--move-retries'                         ,) },
     DOWNLOAD_PARENT_ALBUM:      { 'default': 'False',                   'type': bool,   'arg': ('--download-parent-album'                ,) },
+    DOWNLOAD_WORKERS:           { 'default': '1',                       'type': int,    'arg': ('--workers', '--download-workers'        ,) },
+    DOWNLOAD_PIPELINE:          { 'default': 'False',                   'type': bool,   'arg': ('--download-pipeline'                    ,) },
+    WRITE_BUFFER_SIZE:          { 'default': '8',                       'type': int,    'arg': ('--write-buffer-size'                    ,) },
+    FSYNC_POLICY:               { 'default': 'never',                   'type': str,    'arg': ('--fsync-policy'                         ,) },
     
     # Encoding Options
     DOWNLOAD_FORMAT:            { 'default': 'copy',                    'type': str,    'arg': ('--codec', '--download-format'           ,) },
     DOWNLOAD_QUALITY:           { 'default': 'auto',                    'type': str,    'arg': ('-q', '--download-quality'               ,) },
     TRANSCODE_BITRATE:          { 'default': 'auto',                    'type': str,    'arg': ('-b', '--bitrate', '--transcode-bitrate' ,) },
+    TRANSCODE_WORKERS:          { 'default': '0',                       'type': int,    'arg': ('--transcode-workers'                    ,) },
+    STREAM_TRANSCODE:           { 'default': 'False',                   'type': bool,   'arg': ('--stream-transcode'                     ,) },
+    TRANSCODE_TAGS:             { 'default': 'False',                   'type': bool,   'arg': ('--transcode-tags'                       ,) },
     
     # Archive Options
     SONG_ARCHIVE_LOCATION:      { 'default': '',                        'type': str,    'arg': ('--song-archive-location'                ,) },
@@ -52,6 +62,9 @@ CONFIG_VALUES = {
     SKIP_EXISTING:              { 'default': 'True',                    'type': bool,   'arg': ('-ie', '--skip-existing'                 ,) },
     SKIP_PREVIOUSLY_DOWNLOADED: { 'default': 'False',                   'type': bool,   'arg': ('-ip', '--skip-prev-downloaded', 
                                                                                                 '--skip-previously-downloaded'           ,) },
+    EXPORT_TSV_ARCHIVES:        { 'default': 'True',                    'type': bool,   'arg': ('--export-tsv-archives'                  ,) },
+    INCREMENTAL_SYNC:           { 'default': 'False',                   'type': bool,   'arg': ('--incremental-sync'                     ,) },
+    TRACK_DEDUP_MODE:           { 'default': 'none',                    'type': str,    'arg': ('--track-dedup-mode'                     ,) },
     
     # Playlist File Options
     EXPORT_M3U8:                { 'default': 'False',                   'type': bool,   'arg': ('-e, --export-m3u8'                      ,) },
@@ -73,10 +86,21 @@ CONFIG_VALUES = {
     MD_ARTISTDELIMITER:         { 'default': ', ',                      'type': str,    'arg': ('--md-artistdelimiter'                   ,) },
     MD_SAVE_LYRICS:             { 'default': 'True',                    'type': bool,   'arg': ('--md-save-lyrics'                       ,) },
     ALBUM_ART_JPG_FILE:         { 'default': 'False',                   'type': bool,   'arg': ('--album-art-jpg-file'                   ,) },
+    ALBUM_ART_MAX_SIZE:         { 'default': '0',                       'type': int,    'arg': ('--album-art-max-size'                   ,) },
+    ALBUM_ART_QUALITY:          { 'default': '0',                       'type': int,    'arg': ('--album-art-quality'                    ,) },
     
     # API Options
     RETRY_ATTEMPTS:             { 'default': '1',                       'type': int,    'arg': ('--retry-attempts'                       ,) },
     CHUNK_SIZE:                 { 'default': '20000',                   'type': int,    'arg': ('--chunk-size'                           ,) },
+    API_RATE_LIMIT:             { 'default': '10',                      'type': int,    'arg': ('--api-rate-limit'                       ,) },
+    AUDIO_KEY_RATE_LIMIT:       { 'default': '30',                      'type': int,    'arg': ('--audio-key-rate-limit'                 ,) },
+    PAGINATION_WORKERS:         { 'default': '8',                       'type': int,    'arg': ('--pagination-workers'                   ,) },
+    HTTP_POOL_SIZE:             { 'default': '16',                      'type': int,    'arg': ('--http-pool-size'                       ,) },
+    HTTP_TIMEOUT:               { 'default': '30',                      'type': int,    'arg': ('--http-timeout'                         ,) },
+    DISABLE_API_CACHE:          { 'default': 'False',                   'type': bool,   'arg': ('--disable-api-cache'                    ,) },
+    API_CACHE_LOCATION:         { 'default': '',                        'type': str,    'arg': ('--api-cache-location'                   ,) },
+    API_CACHE_SIZE:             { 'default': '256',                     'type': int,    'arg': ('--api-cache-size'                       ,) },
+    ALBUM_ART_CACHE_SIZE:       { 'default': '64',                      'type': int,    'arg': ('--album-art-cache-size'                 ,) },
     OAUTH_ADDRESS:              { 'default': '0.0.0.0',                 'type': str,    'arg': ('--oauth-address'                        ,) },
     REDIRECT_ADDRESS:           { 'default': '127.0.0.1',               'type': str,    'arg': ('--redirect-address'                     ,) },
     
@@ -238,6 +262,14 @@ class Config:
     def get_skip_previously_downloaded(cls) -> bool:
         return cls.get(SKIP_PREVIOUSLY_DOWNLOADED)
     
+    @classmethod
+    def get_export_tsv_archives(cls) -> bool:
+        return cls.get(EXPORT_TSV_ARCHIVES)
+    
+    @classmethod
+    def get_incremental_sync(cls) -> bool:
+        return cls.get(INCREMENTAL_SYNC)
+    
     @classmethod
     def get_split_album_discs(cls) -> bool:
         return cls.get(SPLIT_ALBUM_DISCS)
@@ -274,6 +306,14 @@ class Config:
     def get_transcode_bitrate(cls) -> str:
         return cls.get(TRANSCODE_BITRATE)
     
+    @classmethod
+    def get_stream_transcode(cls) -> bool:
+        return cls.get(STREAM_TRANSCODE)
+    
+    @classmethod
+    def get_transcode_tags(cls) -> bool:
+        return cls.get(TRANSCODE_TAGS)
+    
     @classmethod
     def get_song_archive_location(cls) -> PurePath:
         if cls.get(SONG_ARCHIVE_LOCATION) == '':
@@ -294,6 +334,23 @@ class Config:
         Path(song_archive.parent).mkdir(parents=True, exist_ok=True)
         return song_archive
     
+    @classmethod
+    def get_sync_state_location(cls) -> PurePath:
+        # kept alongside the song archive it is checked against
+        return cls.get_song_archive_location().parent / '.sync_state.db'
+    
+    @classmethod
+    def get_track_dedup_mode(cls) -> str:
+        mode = cls.get(TRACK_DEDUP_MODE).lower()
+        if mode not in {"hardlink", "reflink", "copy", "none"}:
+            raise ValueError()
+        return mode
+    
+    @classmethod
+    def get_track_store_location(cls) -> PurePath:
+        # kept alongside the song archive, the files it points to are the archived ones
+        return cls.get_song_archive_location().parent / '.track_store.db'
+    
     @classmethod
     def get_save_credentials(cls) -> bool:
         return cls.get(SAVE_CREDENTIALS)
@@ -327,6 +384,14 @@ class Config:
             temp_download_path = cls.get_root_path() / PurePath(temp_download_path).relative_to(".")
         return PurePath(Path(temp_download_path).expanduser())
     
+    @classmethod
+    def get_move_workers(cls) -> int:
+        return max(cls.get(MOVE_WORKERS), 0)
+    
+    @classmethod
+    def get_move_retries(cls) -> int:
+        return max(cls.get(MOVE_RETRIES), 0)
+    
     @classmethod
     def get_disc_track_totals(cls) -> bool:
         return cls.get(MD_DISC_TRACK_TOTALS)
@@ -440,6 +505,17 @@ class Config:
     def get_album_art_jpg_file(cls) -> bool:
         return cls.get(ALBUM_ART_JPG_FILE)
     
+    @classmethod
+    def get_album_art_max_size(cls) -> int:
+        return max(cls.get(ALBUM_ART_MAX_SIZE), 0)
+    
+    @classmethod
+    def get_album_art_quality(cls) -> int:
+        quality = cls.get(ALBUM_ART_QUALITY)
+        if not 0 <= quality <= 95:
+            raise ValueError()
+        return quality
+    
     @classmethod
     def get_max_filename_length(cls) -> int:
         return cls.get(MAX_FILENAME_LENGTH)
@@ -473,6 +549,92 @@ class Config:
     def get_download_parent_album(cls) -> bool:
         return cls.get(DOWNLOAD_PARENT_ALBUM)
     
+    @classmethod
+    def get_download_workers(cls) -> int:
+        return max(cls.get(DOWNLOAD_WORKERS), 1)
+    
+    @classmethod
+    def get_download_pipeline(cls) -> bool:
+        return cls.get(DOWNLOAD_PIPELINE)
+    
+    @classmethod
+    def get_write_buffer_size(cls) -> int:
+        return max(cls.get(WRITE_BUFFER_SIZE), 0)
+    
+    @classmethod
+    def get_fsync_policy(cls) -> str:
+        policy = cls.get(FSYNC_POLICY)
+        if policy not in {"never", "file", "batch"}:
+            raise ValueError()
+        return policy
+    
+    @classmethod
+    def get_transcode_workers(cls) -> int:
+        if cls.get(TRANSCODE_WORKERS) <= 0:
+            return os.cpu_count() or 1
+        return cls.get(TRANSCODE_WORKERS)
+    
+    @classmethod
+    def get_api_rate_limit(cls) -> int:
+        return max(cls.get(API_RATE_LIMIT), 0)
+    
+    @classmethod
+    def get_audio_key_rate_limit(cls) -> int:
+        return max(cls.get(AUDIO_KEY_RATE_LIMIT), 0)
+    
+    @classmethod
+    def get_pagination_workers(cls) -> int:
+        return max(cls.get(PAGINATION_WORKERS), 1)
+    
+    @classmethod
+    def get_http_pool_size(cls) -> int:
+        # may be called before the config is loaded (e.g. while logging in)
+        return max(cls.get(HTTP_POOL_SIZE) or int(CONFIG_VALUES[HTTP_POOL_SIZE]['default']), 1)
+    
+    @classmethod
+    def get_http_timeout(cls) -> int | None:
+        timeout = cls.get(HTTP_TIMEOUT)
+        if timeout is None:
+            timeout = int(CONFIG_VALUES[HTTP_TIMEOUT]['default'])
+        return timeout if timeout > 0 else None
+    
+    @classmethod
+    def get_disable_api_cache(cls) -> bool:
+        return cls.get(DISABLE_API_CACHE)
+    
+    @classmethod
+    def get_api_cache_size(cls) -> int:
+        return max(cls.get(API_CACHE_SIZE), 1)
+    
+    @classmethod
+    def get_api_cache_location(cls) -> PurePath:
+        if cls.get(API_CACHE_LOCATION) == '':
+            system_paths = {
+                'win32': Path.home() / 'AppData/Roaming/Zotify',
+                'linux': Path.home() / '.local/share/zotify',
+                'darwin': Path.home() / 'Library/Application Support/Zotify'
+            }
+            if sys.platform not in system_paths:
+                api_cache = PurePath(Path.cwd() / '.zotify/.api_cache.db')
+            else:
+                api_cache = PurePath(system_paths[sys.platform] / '.api_cache.db')
+        else:
+            api_cache_path: str = cls.get(API_CACHE_LOCATION)
+            if api_cache_path[0] == ".":
+                api_cache_path = cls.get_root_path() / PurePath(api_cache_path).relative_to(".")
+            api_cache = PurePath(Path(api_cache_path).expanduser() / '.api_cache.db')
+        Path(api_cache.parent).mkdir(parents=True, exist_ok=True)
+        return api_cache
+    
+    @classmethod
+    def get_album_art_cache_size(cls) -> int:
+        return max(cls.get(ALBUM_ART_CACHE_SIZE), 0)
+    
+    @classmethod
+    def get_album_art_cache_location(cls) -> PurePath:
+        # kept alongside the API cache
+        return cls.get_api_cache_location().parent / 'album_art'
+    
     @classmethod
     def get_oauth_addresses(cls) -> tuple[str, str]:
         return cls.get(REDIRECT_ADDRESS), cls.get(OAUTH_ADDRESS)
@@ -30,6 +30,9 @@ ID = 'id'
 IMAGES = 'images'
 IS_PLAYABLE = 'is_playable'
 ITEMS = 'items'
+TOTAL = 'total'
+SNAPSHOT_ID = 'snapshot_id'
+ADDED_AT = 'added_at'
 NAME = 'name'
 OWNER = 'owner'
 PLAYLIST = 'playlist'
@@ -155,3 +158,26 @@ DOWNLOAD_PARENT_ALBUM = 'DOWNLOAD_PARENT_ALBUM'
 DISABLE_SONG_ARCHIVE = 'DISABLE_SONG_ARCHIVE'
 REDIRECT_ADDRESS = 'REDIRECT_ADDRESS'
 OAUTH_ADDRESS = 'OAUTH_ADDRESS'
+DOWNLOAD_WORKERS = 'DOWNLOAD_WORKERS'
+DOWNLOAD_PIPELINE = 'DOWNLOAD_PIPELINE'
+TRANSCODE_WORKERS = 'TRANSCODE_WORKERS'
+HTTP_POOL_SIZE = 'HTTP_POOL_SIZE'
+HTTP_TIMEOUT = 'HTTP_TIMEOUT'
+DISABLE_API_CACHE = 'DISABLE_API_CACHE'
+API_CACHE_LOCATION = 'API_CACHE_LOCATION'
+API_CACHE_SIZE = 'API_CACHE_SIZE'
+PAGINATION_WORKERS = 'PAGINATION_WORKERS'
+API_RATE_LIMIT = 'API_RATE_LIMIT'
+AUDIO_KEY_RATE_LIMIT = 'AUDIO_KEY_RATE_LIMIT'
+INCREMENTAL_SYNC = 'INCREMENTAL_SYNC'
+EXPORT_TSV_ARCHIVES = 'EXPORT_TSV_ARCHIVES'
+TRACK_DEDUP_MODE = 'TRACK_DEDUP_MODE'
+STREAM_TRANSCODE = 'STREAM_TRANSCODE'
+TRANSCODE_TAGS = 'TRANSCODE_TAGS'
+ALBUM_ART_MAX_SIZE = 'ALBUM_ART_MAX_SIZE'
+ALBUM_ART_QUALITY = 'ALBUM_ART_QUALITY'
+ALBUM_ART_CACHE_SIZE = 'ALBUM_ART_CACHE_SIZE'
+WRITE_BUFFER_SIZE = 'WRITE_BUFFER_SIZE'
+FSYNC_POLICY = 'FSYNC_POLICY'
+MOVE_WORKERS = 'MOVE_WORKERS'
+MOVE_RETRIES = 'MOVE_RETRIES'
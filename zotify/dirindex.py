@@ -0,0 +1,103 @@
+import os
+import threading
+from fnmatch import fnmatchcase
+from pathlib import Path, PurePath
+
+
+class DirectoryIndex:
+    """
+    Per-run cache of the download directories' listings
+    
+    Each directory is listed once, the first time it is asked about, and then kept
+    up to date as zotify writes files into it, so existence, size and filename
+    collision checks don't each hit the (possibly network) filesystem.
+    """
+    
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # directory -> {name: DirEntry, or the size of a file written this run}, None if missing
+        self._listings: dict[str, dict[str, os.DirEntry | int] | None] = {}
+    
+    def _listing(self, directory: str | PurePath) -> dict[str, os.DirEntry | int] | None:
+        key = str(directory)
+        if key not in self._listings:
+            try:
+                with os.scandir(key) as entries:
+                    self._listings[key] = {entry.name: entry for entry in entries}
+            except (FileNotFoundError, NotADirectoryError):
+                self._listings[key] = None
+        return self._listings[key]
+    
+    def dir_exists(self, directory: str | PurePath) -> bool:
+        with self._lock:
+            return self._listing(directory) is not None
+    
+    def exists(self, path: str | PurePath) -> bool:
+        path = PurePath(path)
+        with self._lock:
+            listing = self._listing(path.parent)
+            return listing is not None and path.name in listing
+    
+    def file_size(self, path: str | PurePath) -> int:
+        """ Returns the size of the file at path, 0 if there is no such file """
+        path = PurePath(path)
+        with self._lock:
+            listing = self._listing(path.parent)
+            entry = listing.get(path.name) if listing is not None else None
+            if entry is None:
+                return 0
+            if isinstance(entry, int):
+                return entry
+            # DirEntry caches its stat, so each file is only stat'ed once
+            return entry.stat().st_size if entry.is_file() else 0
+    
+    def count_matching(self, directory: str | PurePath, pattern: str) -> int:
+        """ Returns how many names in directory match the glob pattern """
+        with self._lock:
+            listing = self._listing(directory)
+            return sum(1 for name in listing if fnmatchcase(name, pattern)) if listing is not None else 0
+    
+    def mkdir(self, directory: str | PurePath) -> None:
+        """ Creates directory (and its parents) unless it is already known to exist """
+        if self.dir_exists(directory):
+            return
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._listings.pop(str(directory), None)
+    
+    def added(self, path: str | PurePath) -> None:
+        """ Records a file written (or replaced) by zotify """
+        path = PurePath(path)
+        size = Path(path).stat().st_size
+        with self._lock:
+            listing = self._listing(path.parent)
+            if listing is not None:
+                listing[path.name] = size
+    
+    def reserve(self, path: str | PurePath, size: int) -> None:
+        """ Records a file that's about to be moved into place, so its name is taken already """
+        path = PurePath(path)
+        with self._lock:
+            listing = self._listing(path.parent)
+            if listing is not None:
+                listing[path.name] = size
+    
+    def release(self, path: str | PurePath) -> None:
+        """ Forgets a reserve()d file that never made it into place """
+        path = PurePath(path)
+        try:
+            size = Path(path).stat().st_size
+        except OSError:
+            size = None
+        with self._lock:
+            listing = self._listing(path.parent)
+            if listing is None:
+                return
+            if size is None:
+                listing.pop(path.name, None)
+            else:
+                # a file it was going to replace is still there
+                listing[path.name] = size
+
+
+DIR_INDEX = DirectoryIndex()
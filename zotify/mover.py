@@ -0,0 +1,134 @@
+import errno
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path, PurePath
+from typing import Callable
+
+from zotify.dirindex import DIR_INDEX
+from zotify.termoutput import Printer, PrintChannel
+from zotify.zotify import Zotify
+
+
+# finished downloads waiting to be moved, per MOVE_WORKERS, before downloading holds off
+QUEUED_MOVES_PER_WORKER = 4
+
+
+def move_file(source: str | PurePath, target: str | PurePath) -> None:
+    """ Moves source over target, copying it across filesystems so target is never seen half written """
+    try:
+        os.replace(source, target)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    
+    temp = PurePath(target).with_name(f'.{uuid.uuid4().hex}.tmp')
+    try:
+        shutil.copyfile(source, temp)
+        Path(temp).replace(target)
+    except BaseException:
+        Path(temp).unlink(missing_ok=True)
+        raise
+    Path(source).unlink()
+
+
+class FileMover:
+    """
+    Background stage moving finished tracks from TEMP_DOWNLOAD_DIR into the library
+    
+    Moving onto another filesystem (a NAS, say) is a full copy, so it's done by
+    MOVE_WORKERS threads while the next tracks download, retrying failed moves up
+    to MOVE_RETRIES times. Archive and m3u8 writes go through commit(), which runs
+    them in the order they were made, each only once the move it depends on has
+    succeeded.
+    """
+    
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._slots: threading.BoundedSemaphore | None = None
+        self._moves: set[Future] = set()
+        # commits may be made from inside a commit, or from a move's done callback
+        self._commit_lock = threading.RLock()
+        self._commits: deque[tuple[Future | None, Callable, tuple, dict]] = deque()
+        self._waiting_on: Future | None = None
+    
+    def move(self, source: str | PurePath, target: str | PurePath) -> Future:
+        """ Moves source to target, returning a future of whether it succeeded """
+        workers = Zotify.CONFIG.get_move_workers()
+        if workers <= 0:
+            future = Future()
+            future.set_result(self._move(source, target))
+            return future
+        
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=workers)
+                self._slots = threading.BoundedSemaphore(workers * QUEUED_MOVES_PER_WORKER)
+        # bounded, so the staging directory can't fill up when the library is much slower
+        self._slots.acquire()
+        future = self._executor.submit(self._move, source, target)
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._moves.add(future)
+        return future
+    
+    def _move(self, source: str | PurePath, target: str | PurePath) -> bool:
+        retries = Zotify.CONFIG.get_move_retries()
+        for attempt in range(retries + 1):
+            try:
+                move_file(source, target)
+                DIR_INDEX.added(target)
+                return True
+            except OSError as e:
+                error = e
+                if attempt < retries:
+                    time.sleep(2 ** attempt)
+        
+        Printer.print(PrintChannel.ERRORS, f'###   ERROR:  FAILED TO MOVE "{PurePath(target).name}" INTO THE LIBRARY   ###\n' +\
+                                           f'###   IT WAS LEFT AT "{source}"   ###')
+        Printer.traceback_printer(error)
+        return False
+    
+    def commit(self, move: Future | None, func: Callable, args: tuple = (), kwargs: dict | None = None) -> None:
+        """ Runs func after every earlier commit, and only if move (when given) succeeded """
+        with self._commit_lock:
+            self._commits.append((move, func, args, kwargs or {}))
+            self._flush()
+    
+    def _flush(self) -> None:
+        with self._commit_lock:
+            while self._commits:
+                move, func, args, kwargs = self._commits[0]
+                if move is not None and not move.done():
+                    if move is not self._waiting_on:
+                        self._waiting_on = move
+                        move.add_done_callback(lambda _: self._flush())
+                    return
+                self._commits.popleft()
+                if move is not None and (move.exception() is not None or not move.result()):
+                    continue
+                try:
+                    func(*args, **kwargs)
+                except Exception as e:
+                    Printer.print(PrintChannel.ERRORS, '###   ERROR:  FAILED TO UPDATE ARCHIVE OR M3U8   ###')
+                    Printer.traceback_printer(e)
+    
+    def join(self) -> None:
+        """ Blocks until every move so far has finished and the commits waiting on them have run """
+        while True:
+            with self._lock:
+                self._moves = {move for move in self._moves if not move.done()}
+                moves = list(self._moves)
+            if not moves:
+                break
+            wait(moves)
+        self._flush()
+
+
+MOVER = FileMover()
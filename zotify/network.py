@@ -0,0 +1,30 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+from zotify.config import Config
+
+
+_SESSION: requests.Session | None = None
+_SESSION_LOCK = threading.Lock()
+
+
+def http_session() -> requests.Session:
+    """ Returns the shared keep-alive session, so repeat requests to a host reuse its connection """
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                pool_size = Config.get_http_pool_size()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _SESSION = session
+    return _SESSION
+
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    """ Drop-in for requests.get over the shared session, applying HTTP_TIMEOUT """
+    kwargs.setdefault('timeout', Config.get_http_timeout())
+    return http_session().get(url, **kwargs)
@@ -0,0 +1,172 @@
+import struct
+import zlib
+from typing import BinaryIO
+
+
+CAPTURE_PATTERN = b'OggS'
+# capture pattern, version, header type, granule position, serial number, page sequence number, CRC, segment count
+PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+CRC_OFFSET = 22
+
+CONTINUED = 0x01
+BEGINNING_OF_STREAM = 0x02
+END_OF_STREAM = 0x04
+
+# a stream that doesn't start a page within this many bytes isn't Ogg, and is written as is
+MAX_SYNC_SEARCH = 64 * 1024
+
+# header, segment table and the largest body the segment table can describe
+MAX_PAGE_SIZE = PAGE_HEADER.size + 255 + 255 * 255
+
+_BIT_REVERSED = bytes(int(f'{i:08b}'[::-1], 2) for i in range(256))
+_ZEROS = memoryview(bytes(MAX_PAGE_SIZE))
+
+
+def _reverse32(value: int) -> int:
+    return int.from_bytes(value.to_bytes(4, 'little').translate(_BIT_REVERSED), 'big')
+
+
+def _reflected_crc(reversed_data, register: int = 0) -> int:
+    # zlib.crc32 inverts the register on the way in and out, this undoes both
+    return zlib.crc32(reversed_data, register ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+
+def ogg_crc(data: bytes | bytearray) -> int:
+    """
+    CRC-32 of an Ogg page (polynomial 0x04C11DB7, no reflection, initial value and final xor 0)
+    
+    zlib's CRC-32 uses the same polynomial, bit-reflected, with an inverted register.
+    Feeding it bit-reversed bytes, and undoing the inversions, gives the unreflected CRC,
+    so the whole page is checksummed in C instead of byte by byte.
+    """
+    return _reverse32(_reflected_crc(data.translate(_BIT_REVERSED)))
+
+
+class OggPassthrough:
+    """
+    Writes an Ogg stream into a file page by page, instead of remuxing it with ffmpeg
+    
+    Does the fix-ups ffmpeg's remux did for the streams librespot returns: anything
+    before the first page and pages failing their CRC are dropped, only the first
+    logical stream is kept, pages are renumbered without gaps, and the last page is
+    flagged as the end of the stream. Streams that turn out not to be Ogg are written
+    unchanged.
+    """
+    
+    def __init__(self, file: BinaryIO) -> None:
+        self.file = file
+        self._buffer = bytearray()
+        # the page held back until it's known whether it's the last one, and its CRC
+        self._pending: bytearray | None = None
+        self._pending_crc = 0
+        self._serial: int | None = None
+        self._sequence = 0
+        self._synced = False
+        self.passthrough = False
+    
+    def write(self, data: bytes) -> int:
+        if self.passthrough:
+            return self.file.write(data)
+        
+        self._buffer += data
+        if not self._synced:
+            start = self._buffer.find(CAPTURE_PATTERN)
+            if start < 0:
+                if len(self._buffer) > MAX_SYNC_SEARCH:
+                    self.passthrough = True
+                    self.file.write(self._buffer)
+                    self._buffer.clear()
+                return len(data)
+            self._synced = True
+        
+        self._read_pages()
+        return len(data)
+    
+    def _read_pages(self) -> None:
+        buffer = self._buffer
+        offset = 0
+        while True:
+            start = buffer.find(CAPTURE_PATTERN, offset)
+            if start < 0:
+                # the capture pattern may be split across writes
+                offset = max(offset, len(buffer) - len(CAPTURE_PATTERN) + 1)
+                break
+            offset = start
+            
+            if len(buffer) - offset < PAGE_HEADER.size:
+                break
+            segments = buffer[offset + PAGE_HEADER.size - 1]
+            body_offset = offset + PAGE_HEADER.size + segments
+            if len(buffer) < body_offset:
+                break
+            end = body_offset + sum(buffer[offset + PAGE_HEADER.size:body_offset])
+            if len(buffer) < end:
+                break
+            
+            page = buffer[offset:end]
+            # checksummed bit-reversed with the CRC field zeroed, the CRC itself is left in place
+            reversed_page = page.translate(_BIT_REVERSED)
+            reversed_page[CRC_OFFSET:CRC_OFFSET + 4] = bytes(4)
+            crc = _reflected_crc(reversed_page)
+            if page[4] != 0 or _reverse32(crc) != struct.unpack_from('<I', page, CRC_OFFSET)[0]:
+                # not a real page boundary, or a damaged page, resync on the next capture pattern
+                offset += 1
+                continue
+            offset = end
+            self._add_page(page, crc)
+        
+        del buffer[:offset]
+    
+    def _add_page(self, page: bytearray, crc: int) -> None:
+        serial = struct.unpack_from('<I', page, 14)[0]
+        if self._serial is None:
+            self._serial = serial
+        elif serial != self._serial:
+            return
+        
+        if self._pending is not None:
+            self._write_page(self._pending, self._pending_crc, last=False)
+        self._pending = page
+        self._pending_crc = crc
+    
+    def _write_page(self, page: bytearray, crc: int, last: bool) -> None:
+        """ Writes page with its header type and sequence number fixed up, crc being its CRC before that """
+        header_type = page[5] & CONTINUED
+        if self._sequence == 0:
+            header_type |= BEGINNING_OF_STREAM
+        if last:
+            header_type |= END_OF_STREAM
+        
+        # the CRC is linear, so only the header bytes that changed are checksummed,
+        # padded with zeros to the page's length, and xor'ed into the page's CRC
+        changed = bytearray(CRC_OFFSET)
+        changed[5] = page[5] ^ header_type
+        struct.pack_into('<I', changed, 18, struct.unpack_from('<I', page, 18)[0] ^ self._sequence)
+        if any(changed):
+            page[5] = header_type
+            struct.pack_into('<I', page, 18, self._sequence)
+            crc ^= _reflected_crc(_ZEROS[:len(page) - CRC_OFFSET], _reflected_crc(changed.translate(_BIT_REVERSED)))
+            struct.pack_into('<I', page, CRC_OFFSET, _reverse32(crc))
+        self.file.write(page)
+        self._sequence += 1
+    
+    def close(self) -> None:
+        try:
+            if not self._synced and self._buffer:
+                # too short to tell, keep it as it was
+                self.file.write(self._buffer)
+            elif self._pending is not None:
+                self._write_page(self._pending, self._pending_crc, last=True)
+            self._pending = None
+            self._buffer.clear()
+        finally:
+            self.file.close()
+    
+    def __enter__(self) -> 'OggPassthrough':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        if exc_type is not None:
+            self.file.__exit__(exc_type, exc_value, tb)
+            return
+        self.close()
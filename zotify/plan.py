@@ -0,0 +1,114 @@
+from collections import Counter
+
+from librespot.audio.decoders import AudioQuality
+
+from zotify.syncstate import SYNC_STATE
+from zotify.termoutput import Printer, PrintChannel
+from zotify.track import TRACK_RECORDS, parse_song_info, get_track_filename, check_duplicates, get_skip_reason
+from zotify.trackstore import TRACK_STORE
+from zotify.utils import fmt_bytes
+from zotify.zotify import Zotify
+
+
+# stream bitrates in kbps, only used to estimate the size of a plan
+QUALITY_KBPS = {
+    AudioQuality.NORMAL: 96,
+    AudioQuality.HIGH: 160,
+    AudioQuality.VERY_HIGH: 320,
+}
+
+QUEUED = "TO DOWNLOAD"
+REUSED = "FROM EARLIER DOWNLOADS"
+UNRESOLVED = "UNRESOLVED"
+# get_skip_reason()'s reasons, as printed in a plan's counts
+SKIP_LABELS = {
+    "TRACK IS UNAVAILABLE": "UNAVAILABLE",
+    "TRACK ALREADY EXISTS": "ALREADY EXIST",
+    "TRACK ALREADY DOWNLOADED ONCE": "DOWNLOADED BEFORE",
+}
+
+
+class DownloadPlanner:
+    """
+    Pre-flight pass over a collection's tracks, before any of them is queued
+    
+    Track records are already batched by prefetch_song_info, so every output path is
+    rendered and checked against the song archives and the directory index in memory.
+    Tracks that would only be skipped are dropped here, without the loaders, output
+    and stream setup of download_track. With --plan-only nothing is downloaded and
+    the plan is just printed.
+    """
+    
+    def __init__(self) -> None:
+        self.plan_only = False
+        self.totals: Counter[str] = Counter()
+        self.total_bytes = 0
+        self.collections = 0
+    
+    def enabled(self) -> bool:
+        # skipped tracks still get their .m3u8 entry and lyrics, and may pull in their whole album
+        return self.plan_only or not (Zotify.CONFIG.get_export_m3u8() or Zotify.CONFIG.get_always_check_lyrics()
+                                      or Zotify.CONFIG.get_download_parent_album())
+    
+    def check(self, mode: str, track_id: str, extra_keys: dict | None) -> tuple[str, int]:
+        """ Returns what will happen to a track (QUEUED, REUSED, or the reason it is skipped) and its estimated size """
+        track = TRACK_RECORDS.get(track_id)
+        if track is None:
+            # not batched, download_track fetches it and reports any error
+            return UNRESOLVED, 0
+        try:
+            (artists, raw_artists, album_name, album_artist, name, image_url, release_year, disc_number,
+             track_number, total_tracks, compilation, scraped_song_id, is_playable, duration_ms) = parse_song_info(track)
+            filename = get_track_filename(mode, track_id, extra_keys or {}, artists, album_name, album_artist, name,
+                                          release_year, disc_number, track_number, total_tracks, scraped_song_id)
+        except Exception:
+            return UNRESOLVED, 0
+        
+        skip_reason = get_skip_reason(is_playable, *check_duplicates(filename, scraped_song_id))
+        if skip_reason is not None:
+            return skip_reason, 0
+        if TRACK_STORE.find(scraped_song_id, Zotify.DOWNLOAD_QUALITY.name) is not None:
+            return REUSED, 0
+        return QUEUED, duration_ms * QUALITY_KBPS.get(Zotify.DOWNLOAD_QUALITY, 160) // 8
+    
+    def plan(self, label: str, jobs: list[tuple[str, str, dict | None]]) -> list[tuple[str, str, dict | None]]:
+        """ Returns the (mode, track_id, extra_keys) jobs that still need downloading, printing a summary """
+        if not jobs or not self.enabled():
+            return jobs
+        
+        counts: Counter[str] = Counter()
+        size = 0
+        queued = []
+        for mode, track_id, extra_keys in jobs:
+            outcome, estimate = self.check(mode, track_id, extra_keys)
+            counts[outcome] += 1
+            size += estimate
+            if outcome in {QUEUED, REUSED, UNRESOLVED}:
+                queued.append((mode, track_id, extra_keys))
+            else:
+                # nothing else will read this record
+                TRACK_RECORDS.pop(track_id, None)
+                # already there or unavailable, retrying either won't change anything
+                if not self.plan_only:
+                    SYNC_STATE.track_done(track_id)
+        
+        self.totals.update(counts)
+        self.total_bytes += size
+        self.collections += 1
+        self.print_plan(f'"{label}"', len(jobs), counts, size)
+        return queued
+    
+    def print_plan(self, label: str, tracks: int, counts: Counter[str], size: int) -> None:
+        channel = PrintChannel.MANDATORY if self.plan_only else PrintChannel.PROGRESS_INFO
+        outcomes = [f'{counts[QUEUED] + counts[UNRESOLVED]} {QUEUED} (~{fmt_bytes(size)})']
+        outcomes += [f'{count} {SKIP_LABELS.get(outcome, outcome)}' for outcome, count in counts.items()
+                     if outcome not in {QUEUED, UNRESOLVED}]
+        Printer.print(channel, f'###   PLAN: {label} - {tracks} TRACKS   ###\n' +\
+                               f'###   {", ".join(outcomes)}   ###')
+    
+    def print_totals(self) -> None:
+        if self.collections > 1:
+            self.print_plan('TOTAL', sum(self.totals.values()), self.totals, self.total_bytes)
+
+
+PLANNER = DownloadPlanner()
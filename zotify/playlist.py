@@ -1,39 +1,23 @@
-from zotify.const import USER_PLAYLISTS_URL, PLAYLISTS_URL, ITEMS, ID, TRACK, NAME, TYPE
+from zotify.const import USER_PLAYLISTS_URL, PLAYLISTS_URL, ID, TRACK, NAME, TYPE, SNAPSHOT_ID
 from zotify.podcast import download_episode
+from zotify.mover import MOVER
+from zotify.plan import PLANNER
+from zotify.pool import DownloadPool
+from zotify.syncstate import SYNC_STATE
 from zotify.termoutput import Printer, PrintChannel
-from zotify.track import download_track
+from zotify.track import download_track_stages, prefetch_song_info
 from zotify.utils import split_sanitize_input, strptime_utc
 from zotify.zotify import Zotify
 
 
 def get_all_playlists():
     """ Returns list of users playlists """
-    playlists = []
-    limit = 50
-    offset = 0
-    
-    while True:
-        resp = Zotify.invoke_url_with_params(USER_PLAYLISTS_URL, limit=limit, offset=offset)
-        offset += limit
-        playlists.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
-    
-    return playlists
+    return Zotify.invoke_url_paginated(USER_PLAYLISTS_URL, limit=50)
 
 
 def get_playlist_songs(playlist_id: str) -> tuple[list[str], list[dict]]:
     """ returns list of songs in a playlist """
-    playlist_tracks = []
-    offset = 0
-    limit = 100
-    
-    while True:
-        resp = Zotify.invoke_url_with_params(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=limit, offset=offset)
-        offset += limit
-        playlist_tracks.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
+    playlist_tracks = Zotify.invoke_url_paginated(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=100)
     
     playlist_tracks.sort(key=lambda s: strptime_utc(s['added_at']))
     
@@ -63,32 +47,68 @@ def get_playlist_info(playlist_id) -> tuple[str, str]:
     return resp['name'].strip(), resp['owner']['display_name'].strip()
 
 
+def get_playlist_snapshot(playlist_id) -> str:
+    """ Returns the playlist's snapshot_id, which changes whenever its items do """
+    (raw, resp) = Zotify.invoke_url(f'{PLAYLISTS_URL}/{playlist_id}?fields=snapshot_id')
+    return resp[SNAPSHOT_ID]
+
+
 def download_playlist(playlist, pbar_stack: list | None = None):
     """Downloads all the songs from a playlist"""
+    # a partial sync would leave out tracks from the playlist's .m3u8
+    incremental = Zotify.CONFIG.get_incremental_sync() and not Zotify.CONFIG.get_export_m3u8()
+    synced = set()
+    if incremental:
+        snapshot_id = get_playlist_snapshot(playlist[ID])
+        state = SYNC_STATE.get_playlist(playlist[ID])
+        if state is not None:
+            last_snapshot_id, synced, complete = state
+            if last_snapshot_id == snapshot_id and complete:
+                Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  PLAYLIST UNCHANGED SINCE LAST SYNC   ###\n' +\
+                                                 f'###   Playlist_Name: {playlist[NAME]}   ###')
+                return
+    
     playlist_num, playlist_songs = get_playlist_songs(playlist[ID])
     
+    prefetch_song_info([song[ID] for song in playlist_songs if song is not None and song[TYPE] != "episode" and song[ID] not in synced])
+    
+    jobs = {i: ('extplaylist', song[ID],
+                {'playlist_song_name': song[NAME],
+                 'playlist': playlist[NAME],
+                 'playlist_num': playlist_num[i],
+                 'playlist_id': playlist[ID],
+                 'playlist_track_id': song[ID]})
+            for i, song in enumerate(playlist_songs)
+            if song is not None and song[TYPE] != "episode" and song[ID] not in synced}
+    queued = {track_id for mode, track_id, extra_keys in PLANNER.plan(playlist[NAME], list(jobs.values()))}
+    if PLANNER.plan_only:
+        return
+    
     pos, pbar_stack = Printer.pbar_position_handler(3, pbar_stack)
     pbar = Printer.pbar(playlist_songs, unit='song', pos=pos,
                         disable=not Zotify.CONFIG.get_show_playlist_pbar())
     pbar_stack.append(pbar)
     
-    for i, song in enumerate(pbar):
-        if song is None:
-            continue
-        elif song[TYPE] == "episode": # Playlist item is a podcast episode
-            pbar.unit = 'episode'
-            download_episode(song[ID])
-        else:
-            pbar.unit = 'song'
-            download_track('extplaylist', song[ID],
-                           {'playlist_song_name': song[NAME],
-                            'playlist': playlist[NAME],
-                            'playlist_num': playlist_num[i],
-                            'playlist_id': playlist[ID],
-                            'playlist_track_id': song[ID]},
-                           pbar_stack)
-        pbar.set_description(song[NAME])
-        Printer.refresh_all_pbars(pbar_stack)
+    with DownloadPool() as pool:
+        for i, song in enumerate(pbar):
+            if song is None or song[ID] in synced:
+                continue
+            elif song[TYPE] == "episode": # Playlist item is a podcast episode
+                pbar.unit = 'episode'
+                pool.submit(download_episode, song[ID])
+            elif song[ID] in queued:
+                pbar.unit = 'song'
+                pool.submit(download_track_stages, *jobs[i], pbar_stack)
+            pbar.set_description(song[NAME])
+            Printer.refresh_all_pbars(pbar_stack)
+    
+    if incremental:
+        # only count items this run (or an earlier sync) got into the library, so failed ones are retried next sync
+        MOVER.join()
+        items = {song[ID] for song in playlist_songs if song is not None}
+        done = SYNC_STATE.done_tracks()
+        synced = {song[ID] for song in playlist_songs if song is not None and (song[ID] in synced or song[ID] in done)}
+        SYNC_STATE.set_playlist(playlist[ID], snapshot_id, synced, synced >= items)
 
 
 def download_from_user_playlist():
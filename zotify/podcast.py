@@ -2,9 +2,14 @@ import time
 from pathlib import PurePath, Path
 from librespot.metadata import EpisodeId
 
-from zotify.const import EPISODE_INFO_URL, SHOWS_URL, PARTNER_URL, PERSISTED_QUERY, ERROR, ID, ITEMS, NAME, SHOW, DURATION_MS
+from zotify.const import EPISODE_INFO_URL, SHOWS_URL, PARTNER_URL, PERSISTED_QUERY, ERROR, ID, NAME, SHOW, DURATION_MS
+from zotify.dirindex import DIR_INDEX
+from zotify.network import http_get
+from zotify.streamreader import download_stream
+from zotify.syncstate import SYNC_STATE
 from zotify.termoutput import PrintChannel, Printer, Loader
 from zotify.utils import create_download_directory, fix_filename, fmt_seconds, wait_between_downloads
+from zotify.writebehind import open_output
 from zotify.zotify import Zotify
 
 
@@ -20,30 +25,18 @@ def get_episode_info(episode_id_str) -> tuple[str | None, str | None, str | None
 
 
 def get_show_episodes(show_id_str) -> list:
-    episodes = []
-    offset = 0
-    limit = 50
-    
     with Loader(PrintChannel.PROGRESS_INFO, "Fetching episodes..."):
-        while True:
-            resp = Zotify.invoke_url_with_params(
-                f'{SHOWS_URL}/{show_id_str}/episodes', limit=limit, offset=offset)
-            offset += limit
-            for episode in resp[ITEMS]:
-                episodes.append(episode[ID])
-            if len(resp[ITEMS]) < limit:
-                break
+        episodes = Zotify.invoke_url_paginated(f'{SHOWS_URL}/{show_id_str}/episodes', limit=50)
     
-    return episodes
+    return [episode[ID] for episode in episodes]
 
 
 def download_podcast_directly(url, filename):
     import functools
     import shutil
-    import requests
     from tqdm.auto import tqdm
     
-    r = requests.get(url, stream=True, allow_redirects=True)
+    r = http_get(url, stream=True, allow_redirects=True)
     if r.status_code != 200:
         r.raise_for_status()  # Will only raise for 4xx codes, so...
         raise RuntimeError(
@@ -79,6 +72,8 @@ def download_show(show_id, pbar_stack: list | None = None):
 
 def download_episode(episode_id, pbar_stack: list | None = None) -> None:
     podcast_name, duration_ms, episode_name = get_episode_info(episode_id)
+    # the id a playlist sync looks for, episode_id becomes an EpisodeId below
+    listed_id = episode_id
     
     Printer.print(PrintChannel.MANDATORY, "\n")
     prepare_download_loader = Loader(PrintChannel.PROGRESS_INFO, "Preparing download...")
@@ -111,18 +106,17 @@ def download_episode(episode_id, pbar_stack: list | None = None) -> None:
                 total_size = stream.input_stream.size
                 
                 filepath = PurePath(download_directory).joinpath(f"{filename}.ogg")
-                if (Path(filepath).is_file()
-                    and Path(filepath).stat().st_size == total_size
+                if (DIR_INDEX.file_size(filepath) == total_size
                     and Zotify.CONFIG.get_skip_existing()
                 ):
                     prepare_download_loader.stop()
                     Printer.print(PrintChannel.SKIPS, f'###   SKIPPING:  "{podcast_name} - {episode_name}" (EPISODE ALREADY EXISTS)   ###')
+                    SYNC_STATE.track_done(listed_id)
                     return
                 prepare_download_loader.stop()
                 time_start = time.time()
-                downloaded = 0
                 pos, pbar_stack = Printer.pbar_position_handler(1, pbar_stack)
-                with open(filepath, 'wb') as file, Printer.pbar(
+                with open_output(filepath, total_size) as file, Printer.pbar(
                     desc=filename,
                     total=total_size,
                     unit='B',
@@ -132,19 +126,10 @@ def download_episode(episode_id, pbar_stack: list | None = None) -> None:
                     pos=pos
                 ) as pbar:
                     prepare_download_loader.stop()
-                    while True:
-                    #for _ in range(int(total_size / Zotify.CONFIG.get_chunk_size()) + 2):
-                        data = stream.input_stream.stream().read(Zotify.CONFIG.get_chunk_size())
-                        pbar.update(file.write(data))
-                        downloaded += len(data)
-                        if data == b'':
-                            break
-                        if Zotify.CONFIG.get_download_real_time():
-                            delta_real = time.time() - time_start
-                            delta_want = (downloaded / total_size) * (int(duration_ms)/1000)
-                            if delta_want > delta_real:
-                                time.sleep(delta_want - delta_real)
+                    download_stream(stream.input_stream.stream(), total_size, file, pbar, int(duration_ms))
                 
+                DIR_INDEX.added(filepath)
+                SYNC_STATE.track_done(listed_id)
                 time_dl_end = time.time()
                 time_elapsed_dl = fmt_seconds(time_dl_end - time_start)
                 
@@ -155,6 +140,7 @@ def download_episode(episode_id, pbar_stack: list | None = None) -> None:
         else:
             filepath = PurePath(download_directory).joinpath(f"{filename}.mp3")
             download_podcast_directly(direct_download_url, filepath)
+            SYNC_STATE.track_done(listed_id)
             
             wait_between_downloads()
     
@@ -0,0 +1,182 @@
+import threading
+from concurrent.futures import Future
+from inspect import isgeneratorfunction
+from queue import Queue
+from typing import Any, Callable, Iterator
+
+from zotify.mover import MOVER
+from zotify.termoutput import Printer, PrintChannel
+from zotify.zotify import Zotify
+
+
+WORKER = threading.local()
+
+
+class TranscodeSlots:
+    """ Caps how many ffmpeg processes run at once across every pool, sized by TRANSCODE_WORKERS """
+    
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._semaphore: threading.Semaphore | None = None
+    
+    def __enter__(self):
+        with self._lock:
+            if self._semaphore is None:
+                self._semaphore = threading.Semaphore(Zotify.CONFIG.get_transcode_workers())
+        self._semaphore.acquire()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        self._semaphore.release()
+
+
+TRANSCODE_SLOTS = TranscodeSlots()
+
+
+def in_worker() -> bool:
+    """ Returns True when called from inside a DownloadPool worker thread """
+    return getattr(WORKER, 'job', None) is not None
+
+
+def worker_slot() -> int | None:
+    """ Returns the index of the current worker thread, None outside of a pool """
+    return getattr(WORKER, 'slot', None) if in_worker() else None
+
+
+def commit_in_order(func: Callable, *args, **kwargs) -> None:
+    """ Runs func immediately, or when inside a pool, once every earlier job has committed """
+    commit_after_move(None, func, *args, **kwargs)
+
+
+def commit_after_move(move: Future | None, func: Callable, *args, **kwargs) -> None:
+    """ commit_in_order, but func is held back until move (a FileMover move) succeeded, and dropped if it failed """
+    job = getattr(WORKER, 'job', None)
+    if job is None:
+        MOVER.commit(move, func, args, kwargs)
+    else:
+        job.commits.append((move, func, args, kwargs))
+
+
+class DownloadJob:
+    def __init__(self, index: int, func: Callable, args: tuple) -> None:
+        self.index = index
+        self.commits: list[tuple[Future | None, Callable, tuple, dict]] = []
+        # generator functions advance one stage per next(), plain functions are a single stage
+        if isgeneratorfunction(func):
+            self.steps: Iterator = func(*args)
+        else:
+            self.steps = (func(*args) for _ in (None,))
+
+
+class DownloadPool:
+    """
+    Runs download jobs across DOWNLOAD_WORKERS threads
+    
+    Archive and m3u8 writes made through commit_in_order() are held back until every
+    earlier job has finished (and its files were moved into the library), so they land
+    in submission order regardless of which worker finishes first. With a single worker (or when nested inside another pool)
+    jobs run inline on the calling thread, exactly as before.
+    
+    When DOWNLOAD_PIPELINE is enabled, jobs submitted as generator functions (such as
+    download_track_stages) are split at each yield: every stage gets its own workers,
+    joined by bounded queues, so one track streams while another is being converted.
+    The final convert & tag stage is sized by TRANSCODE_WORKERS instead of DOWNLOAD_WORKERS.
+    """
+    
+    def __init__(self, workers: int | None = None) -> None:
+        self.workers = workers if workers is not None else Zotify.CONFIG.get_download_workers()
+        pipelined = Zotify.CONFIG.get_download_pipeline()
+        self.parallel = (self.workers > 1 or pipelined) and not in_worker()
+        
+        # metadata -> stream -> convert & tag
+        stage_workers = [self.workers, self.workers, Zotify.CONFIG.get_transcode_workers()] if pipelined else [self.workers]
+        # streaming workers draw the progress bars, so they take the first lines
+        slot_order = sorted(range(len(stage_workers)), key=lambda stage: stage != 1)
+        self._stages: list[tuple[Queue, int, int]] = []
+        for stage, workers in enumerate(stage_workers):
+            slot_base = sum(stage_workers[s] for s in slot_order[:slot_order.index(stage)])
+            # bounded so neither the submitting loop nor any stage runs far ahead of the next
+            self._stages.append((Queue(maxsize=workers), workers, slot_base))
+        
+        self._threads: list[list[threading.Thread]] = []
+        self._lock = threading.Lock()
+        self._finished: dict[int, DownloadJob] = {}
+        self._submitted = 0
+        self._next_commit = 0
+    
+    def submit(self, func: Callable, *args: Any) -> None:
+        """ Queues a job, blocking while the first stage's workers are busy """
+        if not self.parallel:
+            for _ in DownloadJob(0, func, args).steps:
+                pass
+            return
+        
+        if not self._threads:
+            for stage, (_, workers, slot_base) in enumerate(self._stages):
+                threads = []
+                for slot in range(slot_base, slot_base + workers):
+                    thread = threading.Thread(target=self._work, args=(stage, slot), daemon=True)
+                    thread.start()
+                    threads.append(thread)
+                self._threads.append(threads)
+        
+        self._stages[0][0].put(DownloadJob(self._submitted, func, args))
+        self._submitted += 1
+    
+    def join(self) -> None:
+        """ Blocks until all submitted jobs have finished and committed """
+        # drain stage by stage, a stage only forwards jobs to the next one before it exits
+        for (jobs, _, _), threads in zip(self._stages, self._threads):
+            for _ in threads:
+                jobs.put(None)
+            for thread in threads:
+                thread.join()
+        self._threads = []
+    
+    def _work(self, stage: int, slot: int) -> None:
+        WORKER.slot = slot
+        jobs = self._stages[stage][0]
+        last_stage = stage == len(self._stages) - 1
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            
+            WORKER.job = job
+            done = True
+            try:
+                if last_stage:
+                    for _ in job.steps:
+                        pass
+                else:
+                    next(job.steps)
+                    done = False
+            except StopIteration:
+                pass
+            except Exception as e:
+                Printer.print(PrintChannel.ERRORS, '###   ERROR:  DOWNLOAD WORKER FAILED   ###')
+                Printer.traceback_printer(e)
+            finally:
+                WORKER.job = None
+            
+            if done:
+                self._commit(job)
+            else:
+                self._stages[stage + 1][0].put(job)
+    
+    def _commit(self, job: DownloadJob) -> None:
+        with self._lock:
+            self._finished[job.index] = job
+            while self._next_commit in self._finished:
+                # handed over in job order, the mover keeps that order while waiting on moves
+                for move, func, args, kwargs in self._finished.pop(self._next_commit).commits:
+                    MOVER.commit(move, func, args, kwargs)
+                self._next_commit += 1
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        # workers are daemons, don't wait on them if the submitting loop was interrupted
+        if exc_type is None:
+            self.join()
@@ -0,0 +1,109 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable
+
+from zotify.config import Config
+from zotify.termoutput import Printer, PrintChannel
+
+
+# throttled requests are waited out without using up RETRY_ATTEMPTS, unless it keeps happening
+MAX_THROTTLED_RETRIES = 5
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """ Exponential backoff for the given retry attempt (0-based), with jitter so workers don't retry in lockstep """
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """ Returns the seconds asked for by a Retry-After header, given either as seconds or as an HTTP date """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every thread making one kind of request
+    
+    Starts at the configured maximum rate. Each throttled request halves the rate and
+    pauses all callers, for the server's Retry-After or an exponential backoff with
+    jitter, and each successful one creeps the rate back up towards the maximum.
+    How often a request was retried is counted by its caller, so one thread's
+    success doesn't reset another's retries.
+    """
+    
+    def __init__(self, name: str, max_rate: Callable[[], float]) -> None:
+        self.name = name
+        self._max_rate_getter = max_rate
+        self._lock = threading.Lock()
+        self.max_rate: float | None = None
+        self.rate = 0.0
+        self._tokens = 0.0
+        self._updated = 0.0
+        self._paused_until = 0.0
+    
+    def _setup(self) -> None:
+        # read lazily, the config isn't loaded when this module is imported
+        if self.max_rate is None:
+            self.max_rate = self._max_rate_getter()
+            self.rate = self.max_rate
+            self._tokens = 1.0
+            self._updated = time.monotonic()
+    
+    def acquire(self) -> None:
+        """ Blocks until a request may be sent """
+        while True:
+            with self._lock:
+                self._setup()
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self.max_rate <= 0:
+                    return
+                else:
+                    # allows a burst of up to one second's worth of requests
+                    self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        return
+                    wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+    
+    def throttled(self, retry_after: float | None = None, attempt: int = 0) -> float:
+        """ Slows down after a rate limited request (its attempt-th retry), returns how long callers are paused for """
+        with self._lock:
+            self._setup()
+            now = time.monotonic()
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            # concurrent requests rejected by the same limit only count once
+            if now >= self._paused_until and self.max_rate > 0:
+                self.rate = max(self.rate / 2, self.max_rate / 64)
+            self._paused_until = max(self._paused_until, now + delay)
+            self._tokens = 0.0
+            self._updated = self._paused_until
+            delay = self._paused_until - now
+        
+        Printer.print(PrintChannel.WARNINGS, f'###   WARNING:  {self.name} RATE LIMITED - PAUSING FOR {delay:.0f} SECONDS   ###')
+        return delay
+    
+    def succeeded(self) -> None:
+        """ Ramps the rate back up after a request went through """
+        with self._lock:
+            self._setup()
+            if self.max_rate > 0 and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+API_LIMITER = RateLimiter('API', Config.get_api_rate_limit)
+AUDIO_KEY_LIMITER = RateLimiter('AUDIO KEY', lambda: Config.get_audio_key_rate_limit() / 60)
@@ -0,0 +1,110 @@
+import time
+from typing import BinaryIO, Iterator
+
+from librespot.audio.storage import ChannelManager
+
+from zotify.zotify import Zotify
+
+
+# blocks grow while data is already buffered, and shrink back when the network is the bottleneck
+MAX_BLOCK_SIZE = 1024 * 1024
+FAST_BLOCK_TIME = 0.02
+SLOW_BLOCK_TIME = 0.25
+# seconds between progress bar refreshes
+PBAR_INTERVAL = 0.1
+
+
+class ChunkReader:
+    """
+    Iterates over a content stream's data in blocks, from its position up to total_size
+    
+    librespot keeps each decrypted 128 KiB chunk of a stream as a bytes object, and
+    its read() copies the requested range into a new BytesIO and then into new bytes.
+    Here blocks are memoryviews of those chunks, so no data is copied on the way to
+    the output file; streams without chunk buffers fall back to read(). Block size
+    starts at CHUNK_SIZE and adapts to how fast blocks arrive, and the end of the
+    stream is known from its size instead of waiting for empty reads, so a stream that
+    ends early raises IOError rather than leaving a silently truncated file.
+    """
+    
+    def __init__(self, input_stream, total_size: int) -> None:
+        self.input_stream = input_stream
+        self.total_size = total_size
+        self.min_block_size = max(Zotify.CONFIG.get_chunk_size(), 1)
+        self.block_size = self.min_block_size
+        # librespot has already skipped the header in front of the audio data
+        self.pos = input_stream.pos() if callable(getattr(input_stream, 'pos', None)) else 0
+        # librespot's chunked streams, anything else is read() from
+        self._zero_copy = callable(getattr(input_stream, 'buffer', None)) and \
+                          callable(getattr(input_stream, 'check_availability', None))
+    
+    def _adapt(self, elapsed: float) -> None:
+        if elapsed < FAST_BLOCK_TIME:
+            self.block_size = min(self.block_size * 2, MAX_BLOCK_SIZE)
+        elif elapsed > SLOW_BLOCK_TIME:
+            self.block_size = max(self.block_size // 2, self.min_block_size)
+    
+    def _chunk_blocks(self) -> Iterator[memoryview]:
+        chunks = self.input_stream.buffer()
+        chunk, offset = divmod(self.pos, ChannelManager.chunk_size)
+        while self.pos < self.total_size and chunk < len(chunks):
+            start = time.monotonic()
+            # waits for the chunk, requesting it if needed, as read() does
+            self.input_stream.check_availability(chunk, True, False)
+            view = memoryview(chunks[chunk])[:self.total_size - chunk * ChannelManager.chunk_size]
+            if offset >= len(view):
+                break
+            while offset < len(view):
+                block = view[offset:offset + self.block_size]
+                offset += len(block)
+                self.pos += len(block)
+                yield block
+                self._adapt(time.monotonic() - start)
+                start = time.monotonic()
+            chunk += 1
+            offset = 0
+        self._check_complete()
+    
+    def _read_blocks(self) -> Iterator[memoryview]:
+        while self.pos < self.total_size:
+            start = time.monotonic()
+            data = self.input_stream.read(min(self.block_size, self.total_size - self.pos))
+            if not data:
+                break
+            self.pos += len(data)
+            yield memoryview(data)
+            self._adapt(time.monotonic() - start)
+        self._check_complete()
+    
+    def _check_complete(self) -> None:
+        if self.pos < self.total_size:
+            raise IOError(f'Stream ended at byte {self.pos} of {self.total_size}')
+    
+    def __iter__(self) -> Iterator[memoryview]:
+        if self._zero_copy:
+            return self._chunk_blocks()
+        return self._read_blocks()
+
+
+def download_stream(input_stream, total_size: int, file: BinaryIO, pbar, duration_ms: int) -> int:
+    """ Writes a content stream into file, updating pbar and pacing it with DOWNLOAD_REAL_TIME, returns the bytes written """
+    real_time = Zotify.CONFIG.get_download_real_time()
+    time_start = time.time()
+    downloaded = 0
+    pending = 0
+    last_update = time.monotonic()
+    for block in ChunkReader(input_stream, total_size):
+        file.write(block)
+        downloaded += len(block)
+        pending += len(block)
+        if time.monotonic() - last_update >= PBAR_INTERVAL:
+            pbar.update(pending)
+            pending = 0
+            last_update = time.monotonic()
+        if real_time:
+            delta_real = time.time() - time_start
+            delta_want = (downloaded / total_size) * (duration_ms/1000)
+            if delta_want > delta_real:
+                time.sleep(delta_want - delta_real)
+    pbar.update(pending)
+    return downloaded
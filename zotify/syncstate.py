@@ -0,0 +1,71 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from zotify.config import Config
+
+
+class SyncState:
+    """
+    Remembers what previous runs already synced, so INCREMENTAL_SYNC can skip it
+    
+    Playlists are stored with the snapshot_id they were last synced at and the ids
+    of their items that were synced. Other collections (e.g. Liked Songs) only keep
+    the time up to which everything was synced. A track counts as synced once this
+    run has downloaded it, or skipped it because it's already there, under the id
+    it was listed by (which may not be the id it was archived under).
+    """
+    
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._done: set[str] = set()
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db_path = Config.get_sync_state_location()
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS playlists (id TEXT PRIMARY KEY, snapshot_id TEXT NOT NULL, '
+                             'items TEXT NOT NULL, complete INTEGER NOT NULL, synced REAL NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS last_synced (key TEXT PRIMARY KEY, synced REAL NOT NULL)')
+        return self._db
+    
+    def track_done(self, track_id: str) -> None:
+        """ Records that a track was downloaded, or skipped (unavailable ones included), by this run """
+        with self._lock:
+            self._done.add(track_id)
+    
+    def done_tracks(self) -> set[str]:
+        """ Returns the ids of the tracks this run dealt with, the set is shared and must not be modified """
+        return self._done
+    
+    def get_playlist(self, playlist_id: str) -> tuple[str, set[str], bool] | None:
+        """ Returns the snapshot_id, synced item ids and whether every item was synced, None if never synced """
+        with self._lock:
+            row = self._connect().execute('SELECT snapshot_id, items, complete FROM playlists WHERE id = ?',
+                                          (playlist_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0], set(json.loads(row[1])), bool(row[2])
+    
+    def set_playlist(self, playlist_id: str, snapshot_id: str, items: set[str], complete: bool) -> None:
+        with self._lock:
+            self._connect().execute('INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?, ?)',
+                                    (playlist_id, snapshot_id, json.dumps(sorted(items)), int(complete), time.time()))
+    
+    def get_last_sync(self, key: str) -> float | None:
+        """ Returns the timestamp everything under key was synced up to, None if never synced """
+        with self._lock:
+            row = self._connect().execute('SELECT synced FROM last_synced WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+    
+    def set_last_sync(self, key: str, timestamp: float) -> None:
+        with self._lock:
+            self._connect().execute('INSERT OR REPLACE INTO last_synced VALUES (?, ?)', (key, timestamp))
+
+
+SYNC_STATE = SyncState()
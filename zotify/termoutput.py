@@ -82,8 +82,15 @@ class Printer:
     
     @staticmethod
     def pbar_position_handler(default_pos: int, pbar_stack: list[tqdm] | None) -> tuple[int, list[tqdm]]:
+        from zotify.pool import worker_slot
         pos = default_pos
-        if pbar_stack is not None:
+        slot = worker_slot()
+        if slot is not None:
+            # each worker gets its own line below every shared bar
+            pos = max([-pbar.pos for pbar in pbar_stack or []] + [default_pos]) + 1 + slot
+            if pbar_stack is None:
+                pbar_stack = []
+        elif pbar_stack is not None:
             pos = -pbar_stack[-1].pos + (0 if pbar_stack[-1].disable else -2)
         else:
             # next bar must be appended to this empty list
@@ -186,6 +193,11 @@ class Loader:
         self.paused = False
     
     def start(self):
+        from zotify.pool import in_worker
+        if in_worker():
+            # concurrent workers would fight over the same terminal line
+            self.done = True
+            return self
         ACTIVE_LOADER.append(self)
         Printer.print(self.channel, "\n", loader=True)
         self._thread.start()
@@ -1,78 +1,168 @@
+import base64
+import hashlib
+import json
 import math
+import re
+import struct
+import subprocess
 import time
 import uuid
 import ffmpy
-from typing import Any
+from concurrent.futures import Future
+from typing import Any, BinaryIO
 from pathlib import Path, PurePath
 from librespot.metadata import TrackId
 
 from zotify.const import TRACKS, ALBUM, GENRES, NAME, DISC_NUMBER, TRACK_NUMBER, TOTAL_TRACKS, \
-    IS_PLAYABLE, ARTISTS, IMAGES, URL, RELEASE_DATE, ID, TRACKS_URL, TRACK_STATS_URL, \
+    IS_PLAYABLE, ARTISTS, IMAGES, URL, RELEASE_DATE, ID, TRACKS_URL, TRACK_STATS_URL, ARTIST_URL, \
     CODEC_MAP, EXT_MAP, DURATION_MS, HREF, ARTISTS, WIDTH, COMPILATION, ALBUM_TYPE
 from zotify.config import EXPORT_M3U8
+from zotify.archive import SONG_ARCHIVE
+from zotify.dirindex import DIR_INDEX
+from zotify.ogg import OggPassthrough
 from zotify.termoutput import Printer, PrintChannel, Loader, ACTIVE_LOADER
-from zotify.utils import fix_filename, set_audio_tags, set_music_thumbnail, create_download_directory, \
+from zotify.utils import fix_filename, set_audio_tags, get_cover_art, save_cover_jpg, create_download_directory, \
     add_to_m3u8, fetch_m3u8_songs, get_directory_song_ids, add_to_directory_song_archive, \
-    get_archived_song_ids, add_to_song_archive, fmt_seconds, wait_between_downloads
+    get_archived_song_ids, add_to_song_archive, fmt_seconds, wait_between_downloads, \
+    conv_artist_format, conv_genre_format
+from zotify.mover import MOVER
+from zotify.pool import TRANSCODE_SLOTS, commit_in_order, commit_after_move
+from zotify.streamreader import download_stream
+from zotify.syncstate import SYNC_STATE
+from zotify.trackstore import TRACK_STORE, materialize
+from zotify.writebehind import open_output
 from zotify.zotify import Zotify
 
 
-def get_song_info(song_id) -> tuple[list[str], list[Any], str, str, Any, Any, Any, Any, Any, Any, Any, Any, Any, int]:
-    """ Retrieves metadata for downloaded songs """
+# track records resolved ahead of time by prefetch_song_info, keyed by the requested id
+TRACK_RECORDS: dict[str, dict] = {}
+# artist records are small and shared by many tracks, so they're kept for the whole run
+ARTIST_RECORDS: dict[str, dict] = {}
+
+
+def prefetch_song_info(track_ids: list[str | None]) -> None:
+    """ Batch-fetches track records for a whole collection, 50 ids per request """
+    missing = [track_id for track_id in dict.fromkeys(track_ids) if track_id and track_id not in TRACK_RECORDS]
+    if not missing:
+        return
+    
+    limit = 50
+    with Loader(PrintChannel.PROGRESS_INFO, "Fetching track information..."):
+        for i in range(0, len(missing), limit):
+            batch = missing[i:i + limit]
+            (raw, info) = Zotify.invoke_url(f'{TRACKS_URL}?ids={",".join(batch)}&market=from_token')
+            if not TRACKS in info:
+                # leave these to be fetched one by one, where the error is reported per track
+                continue
+            # records come back in request order, relinked tracks carry a different id
+            for track_id, track in zip(batch, info[TRACKS]):
+                if track is not None:
+                    TRACK_RECORDS[track_id] = track
+    
+    if Zotify.CONFIG.get_save_genres():
+        prefetch_artist_info([artist[ID] for track_id in missing if track_id in TRACK_RECORDS
+                              for artist in TRACK_RECORDS[track_id][ARTISTS]])
+
+
+def prefetch_artist_info(artist_ids: list[str | None]) -> None:
+    """ Batch-fetches artist records not yet seen this run, 50 ids per request """
+    missing = [artist_id for artist_id in dict.fromkeys(artist_ids) if artist_id and artist_id not in ARTIST_RECORDS]
+    if not missing:
+        return
+    
+    limit = 50
+    with Loader(PrintChannel.PROGRESS_INFO, "Fetching artist information..."):
+        for i in range(0, len(missing), limit):
+            batch = missing[i:i + limit]
+            (raw, info) = Zotify.invoke_url(f'{ARTIST_URL}?ids={",".join(batch)}')
+            if not ARTISTS in info:
+                continue
+            for artist_id, artist in zip(batch, info[ARTISTS]):
+                if artist is not None:
+                    ARTIST_RECORDS[artist_id] = artist
+
+
+def get_track_record(song_id: str) -> dict:
+    """ Returns a track's API record, reusing one batched by prefetch_song_info when available """
+    if song_id in TRACK_RECORDS:
+        return TRACK_RECORDS[song_id]
+    
     with Loader(PrintChannel.PROGRESS_INFO, "Fetching track information..."):
         (raw, info) = Zotify.invoke_url(f'{TRACKS_URL}?ids={song_id}&market=from_token')
     
-    if not TRACKS in info:
+    if not TRACKS in info or not info[TRACKS] or info[TRACKS][0] is None:
         raise ValueError(f'Invalid response from TRACKS_URL:\n{raw}')
     
+    TRACK_RECORDS[song_id] = info[TRACKS][0]
+    return info[TRACKS][0]
+
+
+def get_song_info(song_id) -> tuple[list[str], list[Any], str, str, Any, Any, Any, Any, Any, Any, Any, Any, Any, int]:
+    """ Retrieves metadata for downloaded songs """
+    track = get_track_record(song_id)
+    # last use of the record in this run, don't let a big library pile up in memory
+    TRACK_RECORDS.pop(song_id, None)
+    return parse_song_info(track)
+
+
+def parse_song_info(track: dict) -> tuple[list[str], list[Any], str, str, Any, Any, Any, Any, Any, Any, Any, Any, Any, int]:
+    """ Extracts the metadata used for downloading and tagging from a track's API record """
     try:
         artists = []
-        for data in info[TRACKS][0][ARTISTS]:
+        for data in track[ARTISTS]:
             artists.append(data[NAME])
         
-        album_name = info[TRACKS][0][ALBUM][NAME]
-        album_artist = info[TRACKS][0][ALBUM][ARTISTS][0][NAME]
-        album_compilation = 1 if COMPILATION in info[TRACKS][0][ALBUM][ALBUM_TYPE] else 0
-        name = info[TRACKS][0][NAME]
-        release_year = info[TRACKS][0][ALBUM][RELEASE_DATE].split('-')[0]
-        disc_number = info[TRACKS][0][DISC_NUMBER]
-        track_number = info[TRACKS][0][TRACK_NUMBER]
-        total_tracks = info[TRACKS][0][ALBUM][TOTAL_TRACKS]
-        scraped_song_id = info[TRACKS][0][ID]
-        is_playable = info[TRACKS][0][IS_PLAYABLE]
-        duration_ms = info[TRACKS][0][DURATION_MS]
+        album_name = track[ALBUM][NAME]
+        album_artist = track[ALBUM][ARTISTS][0][NAME]
+        album_compilation = 1 if COMPILATION in track[ALBUM][ALBUM_TYPE] else 0
+        name = track[NAME]
+        release_year = track[ALBUM][RELEASE_DATE].split('-')[0]
+        disc_number = track[DISC_NUMBER]
+        track_number = track[TRACK_NUMBER]
+        total_tracks = track[ALBUM][TOTAL_TRACKS]
+        scraped_song_id = track[ID]
+        is_playable = track[IS_PLAYABLE]
+        duration_ms = track[DURATION_MS]
         
-        image = info[TRACKS][0][ALBUM][IMAGES][0]
-        for i in info[TRACKS][0][ALBUM][IMAGES]:
+        image = track[ALBUM][IMAGES][0]
+        for i in track[ALBUM][IMAGES]:
             if i[WIDTH] > image[WIDTH]:
                 image = i
         image_url = image[URL]
         
-        return (artists, info[TRACKS][0][ARTISTS], album_name, album_artist, name, 
+        return (artists, track[ARTISTS], album_name, album_artist, name, 
                 image_url, release_year, disc_number, track_number, total_tracks, 
                 album_compilation, scraped_song_id, is_playable, duration_ms)
     except Exception as e:
-        raise ValueError(f'Failed to parse TRACKS_URL response: {str(e)}\n{raw}')
+        raise ValueError(f'Failed to parse TRACKS_URL response: {str(e)}\n{json.dumps(track)}')
 
 
 def get_song_genres(rawartists: list[str], track_name: str) -> list[str]:
     if Zotify.CONFIG.get_save_genres():
+        raw = ''
         try:
-            with Loader(PrintChannel.PROGRESS_INFO, "Fetching artist information..."):
-                genres = []
-                for data in rawartists:
+            # usually already batched by prefetch_song_info, otherwise one request covers all of the track's artists
+            prefetch_artist_info([data[ID] for data in rawartists])
+            
+            genres = []
+            for data in rawartists:
+                if data[ID] in ARTIST_RECORDS:
+                    artistInfo = ARTIST_RECORDS[data[ID]]
+                else:
                     # query artist genres via href, which will be the api url
-                    (raw, artistInfo) = Zotify.invoke_url(f'{data[HREF]}')
-                    if Zotify.CONFIG.get_all_genres() and len(artistInfo[GENRES]) > 0:
-                        for genre in artistInfo[GENRES]:
-                            genres.append(genre)
-                    elif len(artistInfo[GENRES]) > 0:
-                        genres.append(artistInfo[GENRES][0])
-                
-                if len(genres) == 0:
-                    Printer.print(PrintChannel.WARNINGS, "###   WARNING:  NO GENRES FOUND   ###\n" +\
-                                                        f"###   Track_Name: {track_name}   ###")
-                    genres.append('')
+                    with Loader(PrintChannel.PROGRESS_INFO, "Fetching artist information..."):
+                        (raw, artistInfo) = Zotify.invoke_url(f'{data[HREF]}')
+                raw = json.dumps(artistInfo)
+                if Zotify.CONFIG.get_all_genres() and len(artistInfo[GENRES]) > 0:
+                    for genre in artistInfo[GENRES]:
+                        genres.append(genre)
+                elif len(artistInfo[GENRES]) > 0:
+                    genres.append(artistInfo[GENRES][0])
+            
+            if len(genres) == 0:
+                Printer.print(PrintChannel.WARNINGS, "###   WARNING:  NO GENRES FOUND   ###\n" +\
+                                                    f"###   Track_Name: {track_name}   ###")
+                genres.append('')
             
             return genres
         except Exception as e:
@@ -126,11 +216,12 @@ def handle_lyrics(track_id: str, song_name: str, filedir: PurePath) -> list[str]
         if lyricdir is None:
             lyricdir = filedir
         
-        Path(lyricdir).mkdir(parents=True, exist_ok=True)
+        DIR_INDEX.mkdir(lyricdir)
         
         lyrics = get_song_lyrics(track_id)
         with open(lyricdir / f"{song_name}.lrc", 'w', encoding='utf-8') as file:
             file.writelines(lyrics)
+        DIR_INDEX.added(lyricdir / f"{song_name}.lrc")
         
     except ValueError:
         Printer.print(PrintChannel.SKIPS, f'###   SKIPPING:  LYRICS FOR "{song_name}" (LYRICS NOT AVAILABLE)   ###')
@@ -138,8 +229,156 @@ def handle_lyrics(track_id: str, song_name: str, filedir: PurePath) -> list[str]
     return lyrics
 
 
+def add_track_to_m3u8(liked_m3u8: bool, song_duration: float, song_name: str, filename: PurePath) -> None:
+    """ Adds a track to the run's .m3u8 file, merging into the archived Liked Songs.m3u8 if needed """
+    
+    # an earlier track may have already finished merging the Liked Songs archive
+    if not Zotify.CONFIG.get_export_m3u8():
+        return
+    
+    filedir = PurePath(filename).parent
+    if liked_m3u8:
+        m3u_path = filedir / "Liked Songs.m3u8"
+        songs_m3u = fetch_m3u8_songs(m3u_path)
+    song_label = add_to_m3u8(liked_m3u8, song_duration, song_name, filename)
+    if liked_m3u8:
+        if songs_m3u is not None and song_label in songs_m3u[0]:
+            Zotify.CONFIG.Values[EXPORT_M3U8] = False
+            Path(filedir / (Zotify.datetime_launch + "_zotify.m3u8")).replace(m3u_path)
+            with open(m3u_path, 'a', encoding='utf-8') as file:
+                file.writelines(songs_m3u[3:])
+
+
+def get_track_filename(mode: str, track_id: str, extra_keys: dict, artists: list[str], album_name: str, album_artist: str,
+                       name: str, release_year, disc_number, track_number, total_tracks, scraped_song_id: str) -> PurePath:
+    """ Renders the OUTPUT template for mode into the track's full path under ROOT_PATH """
+    output_template = Zotify.CONFIG.get_output(mode)
+    
+    for k in extra_keys:
+        output_template = output_template.replace("{"+k+"}", fix_filename(extra_keys[k]))
+    
+    ext = EXT_MAP.get(Zotify.CONFIG.get_download_format().lower())
+    
+    output_template = output_template.replace("{artist}", fix_filename(artists[0]))
+    output_template = output_template.replace("{album_artist}", fix_filename(album_artist))
+    output_template = output_template.replace("{album}", fix_filename(album_name))
+    output_template = output_template.replace("{song_name}", fix_filename(name))
+    output_template = output_template.replace("{release_year}", fix_filename(release_year))
+    output_template = output_template.replace("{disc_number}", fix_filename(disc_number))
+    output_template = output_template.replace("{track_number}", '{:02d}'.format(int(fix_filename(track_number))))
+    output_template = output_template.replace("{total_tracks}", fix_filename(total_tracks))
+    output_template = output_template.replace("{id}", fix_filename(scraped_song_id))
+    output_template = output_template.replace("{track_id}", fix_filename(track_id))
+    output_template += f".{ext}"
+    
+    return PurePath(Zotify.CONFIG.get_root_path()).joinpath(output_template)
+
+
+def check_duplicates(filename: PurePath, scraped_song_id: str) -> tuple[int, bool, bool]:
+    """ Returns the size of any file already at filename, and whether the song is in the directory and global archives """
+    filedir = PurePath(filename).parent
+    check_name = DIR_INDEX.file_size(filename)
+    check_local = scraped_song_id in get_directory_song_ids(filedir)
+    if Zotify.CONFIG.get_disable_directory_archives():
+        check_local = not Zotify.CONFIG.get_skip_existing() or not Zotify.CONFIG.get_skip_previously_downloaded()
+        # avoids overwrite case only when both "safety switches" are on
+    check_all_time = scraped_song_id in get_archived_song_ids()
+    return check_name, check_local, check_all_time
+
+
+def get_skip_reason(is_playable: bool, check_name: int, check_local: bool, check_all_time: bool) -> str | None:
+    """ Returns why a track won't be downloaded, None if it will be """
+    if not is_playable:
+        return "TRACK IS UNAVAILABLE"
+    if check_local and check_name and Zotify.CONFIG.get_skip_existing() and not Zotify.CONFIG.get_disable_directory_archives():
+        return "TRACK ALREADY EXISTS"
+    if check_all_time and Zotify.CONFIG.get_skip_previously_downloaded():
+        return "TRACK ALREADY DOWNLOADED ONCE"
+    return None
+
+
+def get_tag_signature(tag_values: tuple, image_url: str) -> str:
+    """ Fingerprints the tags and cover art write_track_tags writes, to tell if a reused file needs retagging """
+    (artists, genres, name, album_name, album_artist, release_year, disc_number,
+     track_number, total_tracks, total_discs, compilation, lyrics) = tag_values
+    written = [conv_artist_format(artists), conv_genre_format(genres), name, album_name, album_artist, release_year,
+               disc_number, track_number, compilation, image_url]
+    if Zotify.CONFIG.get_disc_track_totals():
+        written += [total_tracks, total_discs]
+    if Zotify.CONFIG.get_save_lyrics_tags():
+        written.append(lyrics)
+    return hashlib.sha1(json.dumps(written, default=str).encode()).hexdigest()
+
+
+def reuse_stored_track(source: PurePath, source_tags: str | None, filename: PurePath, tag_values: tuple,
+                       image_url: str, mode: str) -> str:
+    """ Makes filename from an earlier download of the same track, retagging only if its tags differ """
+    tags = get_tag_signature(tag_values, image_url)
+    dedup_mode = Zotify.CONFIG.get_track_dedup_mode()
+    if tags != source_tags and dedup_mode == 'hardlink':
+        # retagging a hardlink would retag the earlier download too
+        dedup_mode = 'reflink'
+    
+    made = materialize(source, filename, dedup_mode)
+    write_track_tags(filename, tag_values, image_url, mode, tagged=tags == source_tags)
+    return made
+
+
+def write_track_tags(filename: PurePath, tag_values: tuple, image_url: str, mode: str, tagged: bool = False) -> None:
+    """ Tags a track and sets its cover art with one load and save of the file, unless already tagged, and saves the cover jpg if desired """
+    if tagged:
+        save_cover_jpg(filename, image_url, mode)
+        return
+    try:
+        artwork = get_cover_art(image_url)
+    except Exception:
+        # the other tags are still written, the caller reports the missing cover
+        set_audio_tags(filename, *tag_values)
+        raise
+    set_audio_tags(filename, *tag_values, artwork=artwork)
+    save_cover_jpg(filename, image_url, mode, artwork)
+
+
+def reserve_staged_track(scraped_song_id: str, filename: PurePath, size: int,
+                         check_all_time: bool, check_local: bool) -> None:
+    """ Takes a staged track's filename and archive entries now, so tracks checked while it's moved see them """
+    DIR_INDEX.reserve(filename, size)
+    if not check_all_time and not Zotify.CONFIG.get_disable_song_archive():
+        SONG_ARCHIVE.reserve(scraped_song_id)
+    if not check_local and not Zotify.CONFIG.get_disable_directory_archives():
+        SONG_ARCHIVE.reserve(scraped_song_id, PurePath(filename).parent)
+
+
+def release_staged_track(scraped_song_id: str, filename: PurePath) -> None:
+    """ Gives back what reserve_staged_track took, for a track that failed to move """
+    DIR_INDEX.release(filename)
+    SONG_ARCHIVE.release(scraped_song_id)
+    SONG_ARCHIVE.release(scraped_song_id, PurePath(filename).parent)
+
+
+def archive_track(scraped_song_id: str, filename: PurePath, artist: str, name: str,
+                  check_all_time: bool, check_local: bool, move: Future | None = None) -> None:
+    """ Records a finished track in whichever song archives don't have it yet, once it's moved into place if staged """
+    # add song ID to global .song_archive file
+    if not check_all_time:
+        commit_after_move(move, add_to_song_archive, scraped_song_id, PurePath(filename).name, artist, name)
+    # add song ID to download directory's .song_ids file
+    if not check_local:
+        commit_after_move(move, add_to_directory_song_archive, PurePath(filename).parent, scraped_song_id, PurePath(filename).name, artist, name)
+
+
 def download_track(mode: str, track_id: str, extra_keys: dict | None = None, pbar_stack: list | None = None) -> None:
     """ Downloads raw song audio content stream"""
+    for _ in download_track_stages(mode, track_id, extra_keys, pbar_stack):
+        pass
+
+
+def download_track_stages(mode: str, track_id: str, extra_keys: dict | None = None, pbar_stack: list | None = None):
+    """
+    Generator form of download_track, yielding between its three stages so a
+    DownloadPool pipeline can hand each one to its own set of workers:
+    metadata & duplicate checks -> audio stream -> conversion & tagging
+    """
     
     # recursive header for parent album download
     child_request_mode = mode
@@ -150,9 +389,9 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, pba
         else:
             album_id = total_tracks = None
             try:
-                (raw, info) = Zotify.invoke_url(f'{TRACKS_URL}?ids={track_id}&market=from_token')
-                album_id = info[TRACKS][0][ALBUM][ID]
-                total_tracks = info[TRACKS][0][ALBUM][TOTAL_TRACKS]
+                track = get_track_record(track_id)
+                album_id = track[ALBUM][ID]
+                total_tracks = track[ALBUM][TOTAL_TRACKS]
             except:
                 Printer.print(PrintChannel.ERRORS, '###   ERROR:  FAILED TO FIND PARENT ALBUM   ###\n' +\
                                                   f'###   Track_ID: {track_id}   ###')
@@ -160,7 +399,8 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, pba
             if album_id and total_tracks and int(total_tracks) > 1:
                 from zotify.album import download_album
                 # uses album OUTPUT template for filename formatting, but handle m3u8 as if only this track was downloaded
-                return download_album(album_id, pbar_stack, M3U8_bypass=(mode, track_id))
+                download_album(album_id, pbar_stack, M3U8_bypass=(mode, track_id))
+                return
     
     if extra_keys is None:
         extra_keys = {}
@@ -168,8 +408,6 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, pba
     Printer.print(PrintChannel.MANDATORY, "\n")
     
     try:
-        output_template = Zotify.CONFIG.get_output(mode)
-        
         (artists, raw_artists, album_name, album_artist, name, image_url, release_year, disc_number,
          track_number, total_tracks, compilation, scraped_song_id, is_playable, duration_ms) = get_song_info(track_id)
         total_discs = None
@@ -181,58 +419,34 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, pba
         
         song_name = fix_filename(artists[0]) + ' - ' + fix_filename(name)
         
-        for k in extra_keys:
-            output_template = output_template.replace("{"+k+"}", fix_filename(extra_keys[k]))
-        
-        ext = EXT_MAP.get(Zotify.CONFIG.get_download_format().lower())
-        
-        output_template = output_template.replace("{artist}", fix_filename(artists[0]))
-        output_template = output_template.replace("{album_artist}", fix_filename(album_artist))
-        output_template = output_template.replace("{album}", fix_filename(album_name))
-        output_template = output_template.replace("{song_name}", fix_filename(name))
-        output_template = output_template.replace("{release_year}", fix_filename(release_year))
-        output_template = output_template.replace("{disc_number}", fix_filename(disc_number))
-        output_template = output_template.replace("{track_number}", '{:02d}'.format(int(fix_filename(track_number))))
-        output_template = output_template.replace("{total_tracks}", fix_filename(total_tracks))
-        output_template = output_template.replace("{id}", fix_filename(scraped_song_id))
-        output_template = output_template.replace("{track_id}", fix_filename(track_id))
-        output_template += f".{ext}"
-        
-        filename = PurePath(Zotify.CONFIG.get_root_path()).joinpath(output_template)
+        filename = get_track_filename(mode, track_id, extra_keys, artists, album_name, album_artist, name,
+                                      release_year, disc_number, track_number, total_tracks, scraped_song_id)
         filedir = PurePath(filename).parent
         
         filename_temp = filename
         if Zotify.CONFIG.get_temp_download_dir() != '':
-            filename_temp = PurePath(Zotify.CONFIG.get_temp_download_dir()).joinpath(f'zotify_{str(uuid.uuid4())}_{track_id}.{ext}')
+            filename_temp = PurePath(Zotify.CONFIG.get_temp_download_dir()).joinpath(f'zotify_{str(uuid.uuid4())}_{track_id}{filename.suffix}')
         
-        check_name = Path(filename).is_file() and Path(filename).stat().st_size
-        check_local = scraped_song_id in get_directory_song_ids(filedir)
-        if Zotify.CONFIG.get_disable_directory_archives():
-            check_local = not Zotify.CONFIG.get_skip_existing() or not Zotify.CONFIG.get_skip_previously_downloaded()
-            # avoids overwrite case only when both "safety switches" are on
-        check_all_time = scraped_song_id in get_archived_song_ids()
+        check_name, check_local, check_all_time = check_duplicates(filename, scraped_song_id)
         Printer.debug("Duplicate Check\n" +\
                      f"File Already Exists: {check_name}\n" +\
                      f"song_id in Local Archive: {check_local}\n" +\
                      f"song_id in Global Archive: {check_all_time}")
+        skip_reason = get_skip_reason(is_playable, check_name, check_local, check_all_time)
         
         # same filename, not same song_id, rename the newcomer
         if not check_local and check_name:
-            c = len([file for file in Path(filedir).iterdir() if file.match(filename.stem + "*")])
+            c = DIR_INDEX.count_matching(filedir, filename.stem + "*")
             filename = PurePath(filedir).joinpath(f'{filename.stem}_{c}{filename.suffix}')
         
         liked_m3u8 = child_request_mode == "liked" and Zotify.CONFIG.get_liked_songs_archive_m3u8()
+        m3u8_entry = None
         if Zotify.CONFIG.get_export_m3u8() and track_id == child_request_id:
-            if liked_m3u8:
-                m3u_path = filedir / "Liked Songs.m3u8"
-                songs_m3u = fetch_m3u8_songs(m3u_path)
-            song_label = add_to_m3u8(liked_m3u8, get_song_duration(track_id), song_name, filename)
-            if liked_m3u8:
-                if songs_m3u is not None and song_label in songs_m3u[0]:
-                    Zotify.CONFIG.Values[EXPORT_M3U8] = False
-                    Path(filedir / (Zotify.datetime_launch + "_zotify.m3u8")).replace(m3u_path)
-                    with open(m3u_path, 'a', encoding='utf-8') as file:
-                        file.writelines(songs_m3u[3:])
+            m3u8_entry = (add_track_to_m3u8, liked_m3u8, get_song_duration(track_id), song_name, filename)
+            # a staged download is only listed once it's been moved into the library
+            if skip_reason is not None or filename_temp == filename:
+                commit_in_order(*m3u8_entry)
+                m3u8_entry = None
         
         if Zotify.CONFIG.get_always_check_lyrics():
             lyrics = handle_lyrics(track_id, song_name, filedir)
@@ -247,97 +461,128 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, pba
     
     else:
         try:
-            if not is_playable:
+            if skip_reason is not None:
                 prepare_download_loader.stop()
-                Printer.print(PrintChannel.SKIPS, f'###   SKIPPING:  "{song_name}" (TRACK IS UNAVAILABLE)   ###')
+                Printer.print(PrintChannel.SKIPS, f'###   SKIPPING:  "{song_name}" ({skip_reason})   ###')
+                # an unavailable track won't become available by retrying, it must not hold back the next sync
+                SYNC_STATE.track_done(track_id)
             else:
-                if check_local and check_name and Zotify.CONFIG.get_skip_existing() and not Zotify.CONFIG.get_disable_directory_archives():
-                    prepare_download_loader.stop()
-                    Printer.print(PrintChannel.SKIPS, f'###   SKIPPING:  "{song_name}" (TRACK ALREADY EXISTS)   ###')
+                yield # metadata stage done
                 
-                elif check_all_time and Zotify.CONFIG.get_skip_previously_downloaded():
-                    prepare_download_loader.stop()
-                    Printer.print(PrintChannel.SKIPS, f'###   SKIPPING:  "{song_name}" (TRACK ALREADY DOWNLOADED ONCE)   ###')
+                # the id the track was listed under, INCREMENTAL_SYNC doesn't know the relinked one
+                listed_id = track_id
+                if track_id != scraped_song_id:
+                    track_id = scraped_song_id
                 
-                else:
-                    if track_id != scraped_song_id:
-                        track_id = scraped_song_id
-                    track = TrackId.from_base62(track_id)
-                    stream = Zotify.get_content_stream(track, Zotify.DOWNLOAD_QUALITY)
-                    if stream is None:
-                        prepare_download_loader.stop()
-                        Printer.print(PrintChannel.ERRORS, '###   ERROR:  SKIPPING SONG - FAILED TO GET CONTENT STREAM   ###\n' +\
-                                                          f'###   Track_ID: {track_id}   ###')
-                        Printer.print(PrintChannel.MANDATORY, "\n\n")
-                        return
+                quality = Zotify.DOWNLOAD_QUALITY.name
+                stored = TRACK_STORE.find(scraped_song_id, quality)
+                if stored is not None and Path(stored[0]) != Path(filename).absolute():
+                    # already downloaded under another OUTPUT template, make this one from that file
+                    genres = get_song_genres(raw_artists, name)
+                    lyrics = handle_lyrics(track_id, song_name, filedir)
                     create_download_directory(filedir)
-                    total_size = stream.input_stream.size
-                    
+                    tag_values = (artists, genres, name, album_name, album_artist, release_year,
+                                  disc_number, track_number, total_tracks, total_discs, compilation, lyrics)
+                    made = reuse_stored_track(*stored, filename, tag_values, image_url, mode)
+                    DIR_INDEX.added(filename)
                     prepare_download_loader.stop()
                     
-                    time_start = time.time()
-                    downloaded = 0
-                    pos, pbar_stack = Printer.pbar_position_handler(1, pbar_stack)
-                    with open(filename_temp, 'wb') as file, Printer.pbar(
-                            desc=song_name,
-                            total=total_size,
-                            unit='B',
-                            unit_scale=True,
-                            unit_divisor=1024,
-                            disable=not Zotify.CONFIG.get_show_download_pbar(),
-                            pos=pos
-                    ) as pbar:
-                        b = 0
-                        while b < 5:
-                        #for _ in range(int(total_size / Zotify.CONFIG.get_chunk_size()) + 2):
-                            data = stream.input_stream.stream().read(Zotify.CONFIG.get_chunk_size())
-                            pbar.update(file.write(data))
-                            downloaded += len(data)
-                            b += 1 if data == b'' else 0
-                            if Zotify.CONFIG.get_download_real_time():
-                                delta_real = time.time() - time_start
-                                delta_want = (downloaded / total_size) * (duration_ms/1000)
-                                if delta_want > delta_real:
-                                    time.sleep(delta_want - delta_real)
-                    
-                    time_dl_end = time.time()
-                    
+                    Printer.print(PrintChannel.DOWNLOADS, f'###   DOWNLOADED: "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}"   ###\n' +\
+                                                          f'###   {made.upper()} OF AN EARLIER DOWNLOAD   ###')
+                    # made in place, it wasn't staged
+                    if m3u8_entry is not None:
+                        commit_in_order(*m3u8_entry)
+                    archive_track(scraped_song_id, filename, artists[0], name, check_all_time, check_local)
+                    commit_in_order(SYNC_STATE.track_done, listed_id)
+                    return
+                
+                track = TrackId.from_base62(track_id)
+                stream = Zotify.get_content_stream(track, Zotify.DOWNLOAD_QUALITY)
+                if stream is None:
+                    prepare_download_loader.stop()
+                    Printer.print(PrintChannel.ERRORS, '###   ERROR:  SKIPPING SONG - FAILED TO GET CONTENT STREAM   ###\n' +\
+                                                      f'###   Track_ID: {track_id}   ###')
+                    Printer.print(PrintChannel.MANDATORY, "\n\n")
+                    return
+                create_download_directory(filedir)
+                total_size = stream.input_stream.size
+                
+                prepare_download_loader.stop()
+                
+                tag_values = None
+                if Zotify.CONFIG.get_stream_transcode() and Zotify.CONFIG.get_transcode_tags():
+                    # tags are written as the stream is converted, so they're needed before it starts
                     genres = get_song_genres(raw_artists, name)
-                    
                     lyrics = handle_lyrics(track_id, song_name, filedir)
+                    tag_values = (artists, genres, name, album_name, album_artist, release_year,
+                                  disc_number, track_number, total_tracks, total_discs, compilation, lyrics)
+                output, converted, tagged = open_audio_output(filename_temp, total_size, tag_values, image_url)
+                
+                time_start = time.time()
+                pos, pbar_stack = Printer.pbar_position_handler(1, pbar_stack)
+                with output as file, Printer.pbar(
+                        desc=song_name,
+                        total=total_size,
+                        unit='B',
+                        unit_scale=True,
+                        unit_divisor=1024,
+                        disable=not Zotify.CONFIG.get_show_download_pbar(),
+                        pos=pos
+                ) as pbar:
+                    download_stream(stream.input_stream.stream(), total_size, file, pbar, duration_ms)
+                
+                time_dl_end = time.time()
+                
+                yield # stream stage done
+                
+                time_ffmpeg_start = time.time()
+                if tag_values is None:
+                    genres = get_song_genres(raw_artists, name)
                     
-                    # no metadata is written to track prior to conversion
-                    convert_audio_format(filename_temp)
-                    
-                    try:
-                        set_audio_tags(filename_temp, artists, genres, name, album_name, album_artist, release_year, 
-                                       disc_number, track_number, total_tracks, total_discs, compilation, lyrics)
-                        set_music_thumbnail(filename_temp, image_url, mode)
-                    except Exception as e:
-                        Printer.print(PrintChannel.ERRORS, "###   ERROR:  FAILED TO WRITE METADATA   ###\n" +\
-                                                           "###   Ensure FFMPEG is installed and added to your PATH   ###")
-                        Printer.traceback_printer(e)
-                    
-                    if filename_temp != filename:
-                        if Path(filename).exists():
-                            Path(filename).unlink()
-                        Path(filename_temp).rename(filename)
-                    
-                    time_ffmpeg_end = time.time()
-                    time_elapsed_dl = fmt_seconds(time_dl_end - time_start)
-                    time_elapsed_ffmpeg = fmt_seconds(time_ffmpeg_end - time_dl_end)
-                    
-                    Printer.print(PrintChannel.DOWNLOADS, f'###   DOWNLOADED: "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}"   ###\n' +\
-                                                          f'###   DOWNLOAD TOOK {time_elapsed_dl} (PLUS {time_elapsed_ffmpeg} CONVERTING)   ###')
-                    
-                    # add song ID to global .song_archive file
-                    if not check_all_time:
-                        add_to_song_archive(scraped_song_id, PurePath(filename).name, artists[0], name)
-                    # add song ID to download directory's .song_ids file
-                    if not check_local:
-                        add_to_directory_song_archive(filedir, scraped_song_id, PurePath(filename).name, artists[0], name)
+                    lyrics = handle_lyrics(track_id, song_name, filedir)
                     
-                    wait_between_downloads()
+                    tag_values = (artists, genres, name, album_name, album_artist, release_year,
+                                  disc_number, track_number, total_tracks, total_discs, compilation, lyrics)
+                
+                # no metadata is written to track prior to conversion, unless by ffmpeg during it
+                if not converted:
+                    tagged = convert_audio_format(filename_temp, tag_values, image_url)
+                
+                tags = None
+                try:
+                    write_track_tags(filename_temp, tag_values, image_url, mode, tagged)
+                    tags = get_tag_signature(tag_values, image_url)
+                except Exception as e:
+                    Printer.print(PrintChannel.ERRORS, "###   ERROR:  FAILED TO WRITE METADATA   ###\n" +\
+                                                       "###   Ensure FFMPEG is installed and added to your PATH   ###")
+                    Printer.traceback_printer(e)
+                
+                if filename_temp == filename:
+                    DIR_INDEX.added(filename)
+                    TRACK_STORE.add(scraped_song_id, quality, filename, tags)
+                
+                time_ffmpeg_end = time.time()
+                time_elapsed_dl = fmt_seconds(time_dl_end - time_start)
+                time_elapsed_ffmpeg = fmt_seconds(time_ffmpeg_end - time_ffmpeg_start)
+                
+                Printer.print(PrintChannel.DOWNLOADS, f'###   DOWNLOADED: "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}"   ###\n' +\
+                                                      f'###   DOWNLOAD TOOK {time_elapsed_dl} (PLUS {time_elapsed_ffmpeg} CONVERTING)   ###')
+                
+                move = None
+                if filename_temp != filename:
+                    # moved in the background, the next track doesn't wait on the library's storage
+                    reserve_staged_track(scraped_song_id, filename, Path(filename_temp).stat().st_size,
+                                         check_all_time, check_local)
+                    move = MOVER.move(filename_temp, filename)
+                    move.add_done_callback(lambda done: (done.exception() is None and done.result()) or
+                                           release_staged_track(scraped_song_id, filename))
+                    commit_after_move(move, TRACK_STORE.add, scraped_song_id, quality, filename, tags)
+                    if m3u8_entry is not None:
+                        commit_after_move(move, *m3u8_entry)
+                archive_track(scraped_song_id, filename, artists[0], name, check_all_time, check_local, move)
+                commit_after_move(move, SYNC_STATE.track_done, listed_id)
+                
+                wait_between_downloads()
             
         except Exception as e:
             Printer.print(PrintChannel.ERRORS, '###   ERROR:  SKIPPING SONG - GENERAL DOWNLOAD ERROR   ###\n' +\
@@ -352,11 +597,8 @@ def download_track(mode: str, track_id: str, extra_keys: dict | None = None, pba
     Printer.print(PrintChannel.MANDATORY, "\n")
 
 
-def convert_audio_format(filename) -> None:
-    """ Converts raw audio into playable file """
-    temp_filename = f'{PurePath(filename).parent}.tmp'
-    Path(filename).replace(temp_filename)
-    
+def get_ffmpeg_output_params() -> tuple[str, list[str]]:
+    """ Returns the codec and ffmpeg output options for the configured DOWNLOAD_FORMAT """
     download_format = Zotify.CONFIG.get_download_format().lower()
     file_codec = CODEC_MAP.get(download_format, 'copy')
     bitrate = None
@@ -374,19 +616,173 @@ def convert_audio_format(filename) -> None:
     output_params = ['-c:a', file_codec]
     if bitrate is not None:
         output_params += ['-b:a', bitrate]
+    return file_codec, output_params
+
+
+def get_ffmpeg_tag_params(filename: PurePath, tag_values: tuple, image_url: str) -> tuple[list[PurePath], list[str]] | None:
+    """
+    Returns the extra (temporary) input files and output options that make ffmpeg write a track's
+    tags and cover art while converting it, None when TRANSCODE_TAGS is off or music_tag is needed
+    """
+    if not Zotify.CONFIG.get_transcode_tags():
+        return None
+    
+    (artists, genres, name, album_name, album_artist, release_year, disc_number,
+     track_number, total_tracks, total_discs, compilation, lyrics) = tag_values
+    artist = conv_artist_format(artists)
+    genre = conv_genre_format(genres)
+    ext = PurePath(filename).suffix.lstrip('.')
+    save_lyrics = lyrics and Zotify.CONFIG.get_save_lyrics_tags()
+    if isinstance(artist, list) or isinstance(genre, list):
+        # ffmpeg takes a single value per tag
+        return None
+    if ext == "mp3" and save_lyrics:
+        # ffmpeg would save them in a custom text frame instead of an unsynchronised lyrics one
+        return None
+    
+    metadata = {'title': name, 'artist': artist, 'album_artist': album_artist, 'album': album_name,
+                'date': release_year, 'genre': genre, 'track': track_number, 'disc': disc_number}
+    if compilation:
+        metadata['compilation'] = compilation
+    if Zotify.CONFIG.get_disc_track_totals():
+        if ext == "ogg":
+            metadata['TRACKTOTAL'] = total_tracks
+            if total_discs is not None:
+                metadata['DISCTOTAL'] = total_discs
+        else:
+            metadata['track'] = f'{track_number}/{total_tracks}'
+            if total_discs is not None:
+                metadata['disc'] = f'{disc_number}/{total_discs}'
+    if save_lyrics:
+        metadata['lyrics'] = "".join(lyrics)
+    
+    try:
+        artwork = get_cover_art(image_url)
+    except Exception:
+        # left to write_track_tags, which reports the failure
+        return None
+    temp_stem = f'{PurePath(filename).with_suffix("")}.{uuid.uuid4().hex}'
+    inputs = [PurePath(f'{temp_stem}.ffmetadata')]
+    output_params = ['-map', '0:a', '-map_metadata', '1']
+    if ext == "ogg":
+        # Ogg has no picture stream, covers go in a FLAC picture block comment
+        mime = b'image/jpeg'
+        picture = struct.pack('>II', 3, len(mime)) + mime + struct.pack('>6I', 0, 0, 0, 0, 0, len(artwork)) + artwork
+        metadata['METADATA_BLOCK_PICTURE'] = base64.b64encode(picture).decode('ascii')
+    else:
+        inputs.append(PurePath(f'{temp_stem}.jpg'))
+        with open(inputs[1], 'wb') as cover_file:
+            cover_file.write(artwork)
+        output_params += ['-map', '2:v', '-c:v', 'copy', '-disposition:v', 'attached_pic']
+    
+    with open(inputs[0], 'w', encoding='utf-8') as metadata_file:
+        metadata_file.write(';FFMETADATA1\n')
+        for key, value in metadata.items():
+            metadata_file.write(f'{key}=' + re.sub(r'([=;#\\\n])', r'\\\1', str(value)) + '\n')
+    return inputs, output_params
+
+
+def convert_audio_format(filename, tag_values: tuple | None = None, image_url: str | None = None) -> bool:
+    """ Converts raw audio into playable file, returns whether ffmpeg also wrote its tags """
+    # unique per job, conversions sharing a directory must not collide
+    temp_filename = PurePath(filename).with_suffix(f'.{uuid.uuid4().hex}.tmp')
+    Path(filename).replace(temp_filename)
+    
+    file_codec, output_params = get_ffmpeg_output_params()
+    tag_inputs, tag_params = [], []
+    if tag_values is not None and file_codec != 'copy':
+        tag_inputs, tag_params = get_ffmpeg_tag_params(filename, tag_values, image_url) or ([], [])
     
     try:
         ff_m = ffmpy.FFmpeg(
             global_options=['-y', '-hide_banner', f'-loglevel {Zotify.CONFIG.get_ffmpeg_log_level()}'],
-            inputs={temp_filename: None},
-            outputs={filename: output_params}
+            inputs={temp_filename: None, **{tag_input: None for tag_input in tag_inputs}},
+            outputs={filename: output_params + tag_params}
         )
-        with Loader(PrintChannel.PROGRESS_INFO, "Converting file..."):
+        with TRANSCODE_SLOTS, Loader(PrintChannel.PROGRESS_INFO, "Converting file..."):
             ff_m.run()
         
         if Path(temp_filename).exists():
             Path(temp_filename).unlink()
+        return bool(tag_inputs)
     
     except ffmpy.FFExecutableNotFoundError:
+        Path(temp_filename).replace(filename)
         Printer.print(PrintChannel.WARNINGS, '###   WARNING:  FFMPEG NOT FOUND   ###\n' +\
                                             f'###   SKIPPING CONVERSION TO {file_codec.upper()}  ###')
+        return False
+    
+    finally:
+        for tag_input in tag_inputs:
+            Path(tag_input).unlink(missing_ok=True)
+
+
+def open_audio_output(filename: PurePath, size_hint: int = 0, tag_values: tuple | None = None,
+                      image_url: str | None = None) -> tuple[BinaryIO, bool, bool]:
+    """
+    Opens the file a track's stream is written to, and returns whether it still needs
+    convert_audio_format, and whether its tags are written on the way (by ffmpeg)
+    """
+    if get_ffmpeg_output_params()[0] == 'copy':
+        # the stream is already in its final container, so it's remuxed in process
+        return OggPassthrough(open_output(filename, size_hint)), True, False
+    if Zotify.CONFIG.get_stream_transcode():
+        # without ffmpeg, the raw stream is saved as is and convert_audio_format reports it
+        transcoder = StreamTranscoder.open(filename, tag_values, image_url)
+        if transcoder is not None:
+            return transcoder, True, transcoder.tagged
+    return open_output(filename, size_hint), False, False
+
+
+class StreamTranscoder:
+    """
+    ffmpeg process converting the audio written to it into filename as it arrives
+    
+    Used as the download's output file with STREAM_TRANSCODE, so conversion overlaps
+    the network read and no intermediate file is written. Conversions paced by the
+    download aren't counted against TRANSCODE_WORKERS.
+    """
+    
+    def __init__(self, process: subprocess.Popen, tag_inputs: list[PurePath]) -> None:
+        self.process = process
+        self.tag_inputs = tag_inputs
+        self.tagged = bool(tag_inputs)
+    
+    @classmethod
+    def open(cls, filename: PurePath, tag_values: tuple | None = None, image_url: str | None = None) -> 'StreamTranscoder | None':
+        """ Starts converting into filename, None if ffmpeg can't be run """
+        file_codec, output_params = get_ffmpeg_output_params()
+        tag_inputs, tag_params = [], []
+        if tag_values is not None:
+            tag_inputs, tag_params = get_ffmpeg_tag_params(filename, tag_values, image_url) or ([], [])
+        try:
+            process = subprocess.Popen(['ffmpeg', '-y', '-hide_banner', '-loglevel', Zotify.CONFIG.get_ffmpeg_log_level(),
+                                        '-f', 'ogg', '-i', 'pipe:0', *[arg for tag_input in tag_inputs for arg in ('-i', str(tag_input))],
+                                        *output_params, *tag_params, str(filename)],
+                                       stdin=subprocess.PIPE)
+        except OSError:
+            for tag_input in tag_inputs:
+                Path(tag_input).unlink(missing_ok=True)
+            return None
+        return cls(process, tag_inputs)
+    
+    def write(self, data: bytes) -> int:
+        self.process.stdin.write(data)
+        return len(data)
+    
+    def __enter__(self) -> 'StreamTranscoder':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        try:
+            if exc_type is not None:
+                self.process.kill()
+                self.process.wait()
+                return
+            self.process.stdin.close()
+            returncode = self.process.wait()
+            if returncode != 0:
+                raise RuntimeError(f'ffmpeg exited with code {returncode}')
+        finally:
+            for tag_input in self.tag_inputs:
+                Path(tag_input).unlink(missing_ok=True)
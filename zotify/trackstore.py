@@ -0,0 +1,126 @@
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from pathlib import Path, PurePath
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+from zotify.config import Config
+from zotify.const import CODEC_MAP
+from zotify.dirindex import DIR_INDEX
+
+
+# linux ioctl sharing a file's extents with another file on copy-on-write filesystems (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+def reflink(source: str | PurePath, target: str | PurePath) -> None:
+    """ Clones source into a new file at target, raises OSError where the filesystem can't """
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            Path(target).unlink()
+            raise
+
+
+def materialize(source: str | PurePath, target: str | PurePath, mode: str) -> str:
+    """
+    Creates target as a hardlink, a reflink or a copy of source, falling back to a copy
+    when the requested kind of link isn't possible. Returns the kind actually made.
+    """
+    # built next to target and moved over it, so target is never left half written
+    temp = PurePath(target).with_name(f'.{uuid.uuid4().hex}.tmp')
+    made = 'copy'
+    try:
+        if mode == 'hardlink':
+            try:
+                os.link(source, temp)
+                made = 'hardlink'
+            except OSError:
+                pass
+        elif mode == 'reflink':
+            try:
+                reflink(source, temp)
+                made = 'reflink'
+            except OSError:
+                pass
+        if made == 'copy':
+            shutil.copyfile(source, temp)
+        Path(temp).replace(target)
+    except BaseException:
+        Path(temp).unlink(missing_ok=True)
+        raise
+    return made
+
+
+class TrackStore:
+    """
+    Index of the audio file already made for each track, per format and quality
+    
+    When a track comes up again under another OUTPUT template (another playlist, Liked
+    Songs, its album) the new file is made from the first one, per TRACK_DEDUP_MODE,
+    instead of streaming and converting the track again. Entries whose file has since
+    been moved, deleted or edited are forgotten.
+    """
+    
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db_path = Config.get_track_store_location()
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS files (song_id TEXT NOT NULL, variant TEXT NOT NULL, '
+                             'path TEXT NOT NULL, size INTEGER NOT NULL, tags TEXT, PRIMARY KEY (song_id, variant))')
+        return self._db
+    
+    @staticmethod
+    def variant(quality: str) -> str:
+        """ Identifies the audio a file holds, so only files of the same format and quality are reused """
+        download_format = Config.get_download_format().lower()
+        if CODEC_MAP.get(download_format, 'copy') == 'copy':
+            return f'{download_format}|{quality}'
+        return f'{download_format}|{quality}|{Config.get_transcode_bitrate()}'
+    
+    def find(self, song_id: str, quality: str) -> tuple[PurePath, str | None] | None:
+        """ Returns the path and tag signature of a file holding song_id, None if there is no usable one """
+        if Config.get_track_dedup_mode() == 'none':
+            return None
+        
+        key = (song_id, self.variant(quality))
+        with self._lock:
+            row = self._connect().execute('SELECT path, size, tags FROM files WHERE song_id = ? AND variant = ?',
+                                          key).fetchone()
+        if row is None:
+            return None
+        
+        path, size, tags = PurePath(row[0]), row[1], row[2]
+        if DIR_INDEX.file_size(path) != size:
+            with self._lock:
+                self._connect().execute('DELETE FROM files WHERE song_id = ? AND variant = ?', key)
+            return None
+        return path, tags
+    
+    def add(self, song_id: str, quality: str, path: str | PurePath, tags: str | None) -> None:
+        """ Records the file just made for song_id, tags being its tag signature or None if they weren't written """
+        if Config.get_track_dedup_mode() == 'none':
+            return
+        
+        path = Path(path).absolute()
+        with self._lock:
+            self._connect().execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                                    (song_id, self.variant(quality), path.as_posix(), path.stat().st_size, tags))
+
+
+TRACK_STORE = TrackStore()
@@ -4,27 +4,21 @@ import os
 import re
 import subprocess
 import music_tag
-import requests
 from time import sleep
 from pathlib import Path, PurePath
 
 from zotify.const import ALBUMARTIST, ARTIST, TRACKTITLE, ALBUM, YEAR, DISCNUMBER, \
     TRACKNUMBER, ARTWORK, TOTALTRACKS, TOTALDISCS, EXT_MAP, LYRICS, COMPILATION, GENRE
+from zotify.archive import SONG_ARCHIVE
+from zotify.artcache import ALBUM_ART_CACHE
+from zotify.dirindex import DIR_INDEX
 from zotify.zotify import Zotify
 from zotify.termoutput import PrintChannel, Printer
 
 
-def get_archived_song_ids() -> list[str]:
-    """ Returns list of all time downloaded songs """
-    
-    ids = []
-    archive_path = Zotify.CONFIG.get_song_archive_location()
-    
-    if Path(archive_path).exists():
-        with open(archive_path, 'r', encoding='utf-8') as f:
-            ids = [line.strip().split('\t')[0] for line in f.readlines()]
-    
-    return ids
+def get_archived_song_ids() -> set[str]:
+    """ Returns set of all time downloaded songs (shared, don't modify) """
+    return SONG_ARCHIVE.song_ids()
 
 
 def add_to_song_archive(song_id: str, filename: str, author_name: str, song_name: str) -> None:
@@ -33,40 +27,37 @@ def add_to_song_archive(song_id: str, filename: str, author_name: str, song_name
     if Zotify.CONFIG.get_disable_song_archive():
         return
     
-    archive_path = Zotify.CONFIG.get_song_archive_location()
-    if Path(archive_path).exists():
+    downloaded = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    SONG_ARCHIVE.add(song_id, downloaded, author_name, song_name, filename)
+    
+    if Zotify.CONFIG.get_export_tsv_archives():
+        archive_path = Zotify.CONFIG.get_song_archive_location()
         with open(archive_path, 'a', encoding='utf-8') as file:
-            file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
-    else:
-        with open(archive_path, 'w', encoding='utf-8') as file:
-            file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+            file.write(f'{song_id}\t{downloaded}\t{author_name}\t{song_name}\t{filename}\n')
 
 
 def create_download_directory(download_path: str | PurePath) -> None:
     """ Create directory and add a hidden file with song ids """
-    Path(download_path).mkdir(parents=True, exist_ok=True)
+    DIR_INDEX.mkdir(download_path)
     
     # add hidden file with song ids
     hidden_file_path = PurePath(download_path).joinpath('.song_ids')
     if Zotify.CONFIG.get_disable_directory_archives():
         return
-    if not Path(hidden_file_path).is_file():
-        with open(hidden_file_path, 'w', encoding='utf-8') as f:
+    if not DIR_INDEX.exists(hidden_file_path):
+        # append mode, another worker may have just created and written to it
+        with open(hidden_file_path, 'a', encoding='utf-8') as f:
             pass
+        DIR_INDEX.added(hidden_file_path)
 
 
-def get_directory_song_ids(download_path: str) -> list[str]:
-    """ Gets song ids of songs in directory """
+def get_directory_song_ids(download_path: str) -> set[str]:
+    """ Gets song ids of songs in directory (shared, don't modify) """
     
-    song_ids = []
-    
-    hidden_file_path = PurePath(download_path).joinpath('.song_ids')
-    
-    if Path(hidden_file_path).is_file() and not Zotify.CONFIG.get_disable_directory_archives():
-        with open(hidden_file_path, 'r', encoding='utf-8') as file:
-            song_ids.extend([line.strip().split('\t')[0] for line in file.readlines()])
+    if Zotify.CONFIG.get_disable_directory_archives():
+        return set()
     
-    return song_ids
+    return SONG_ARCHIVE.directory_song_ids(download_path)
 
 
 def add_to_directory_song_archive(download_path: str, song_id: str, filename: str, author_name: str, song_name: str) -> None:
@@ -75,11 +66,15 @@ def add_to_directory_song_archive(download_path: str, song_id: str, filename: st
     if Zotify.CONFIG.get_disable_directory_archives():
         return
     
+    downloaded = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    SONG_ARCHIVE.add_to_directory(download_path, song_id, downloaded, author_name, song_name, filename)
+    
+    # always written, the directory's archive moves with it
     hidden_file_path = PurePath(download_path).joinpath('.song_ids')
     # not checking if file exists because we need an exception
     # to be raised if something is wrong
     with open(hidden_file_path, 'a', encoding='utf-8') as file:
-        file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+        file.write(f'{song_id}\t{downloaded}\t{author_name}\t{song_name}\t{filename}\n')
 
 
 def get_downloaded_song_duration(filename: str) -> float:
@@ -182,8 +177,8 @@ def conv_genre_format(genres: list[str]) -> list[str] | str:
         return Zotify.CONFIG.get_genre_delimiter().join(genres)
 
 
-def set_audio_tags(filename, artists: list[str], genres: list[str], name, album_name, album_artist, release_year, disc_number, track_number, total_tracks, total_discs, compilation: int, lyrics: list[str] | None) -> None:
-    """ sets music_tag metadata """
+def set_audio_tags(filename, artists: list[str], genres: list[str], name, album_name, album_artist, release_year, disc_number, track_number, total_tracks, total_discs, compilation: int, lyrics: list[str] | None, artwork: bytes | None = None) -> None:
+    """ sets music_tag metadata, and the album cover if given, with a single load and save of the file """
     tags = music_tag.load_file(filename)
     tags[ALBUMARTIST] = album_artist
     tags[ARTIST] = conv_artist_format(artists)
@@ -212,27 +207,32 @@ def set_audio_tags(filename, artists: list[str], genres: list[str], name, album_
     if lyrics and Zotify.CONFIG.get_save_lyrics_tags():
         tags[LYRICS] = "".join(lyrics)
     
+    if artwork is not None:
+        tags[ARTWORK] = artwork
+    
     tags.save()
 
 
-def set_music_thumbnail(filename: PurePath, image_url: str, mode: str) -> None:
-    """ Fetch an album cover image, set album cover tag, and save to file if desired """
-    
-    # jpeg format expected from request
-    img = requests.get(image_url).content
-    tags = music_tag.load_file(filename)
-    tags[ARTWORK] = img
-    tags.save()
+def get_cover_art(image_url: str) -> bytes:
+    """ Fetches an album cover image, from the album art cache when possible """
+    return ALBUM_ART_CACHE.get(image_url)
+
+
+def save_cover_jpg(filename: PurePath, image_url: str, mode: str, img: bytes | None = None) -> None:
+    """ Saves the album cover next to a track if desired, fetching it only if it isn't there yet """
     
     if not Zotify.CONFIG.get_album_art_jpg_file():
         return
     
-    jpg_filename = 'cover.jpg' if '{album}' in Zotify.CONFIG.get_output(mode) else filename.stem + '.jpg'
+    jpg_filename = 'cover.jpg' if '{album}' in Zotify.CONFIG.get_output(mode) else PurePath(filename).stem + '.jpg'
     jpg_path = Path(filename).parent.joinpath(jpg_filename)
     
-    if not jpg_path.exists():
+    if not DIR_INDEX.exists(jpg_path):
+        if img is None:
+            img = get_cover_art(image_url)
         with open(jpg_path, 'wb') as jpg_file:
             jpg_file.write(img)
+        DIR_INDEX.added(jpg_path)
 
 
 def regex_input_for_urls(search_input: str, non_global: bool = False) -> tuple[
@@ -305,6 +305,14 @@ def fmt_seconds(secs: float) -> str:
         return f'{h}'.zfill(2) + ':' + f'{m}'.zfill(2) + ':' + f'{s}'.zfill(2)
 
 
+def fmt_bytes(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.0f} B' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
 def strptime_utc(dtstr) -> datetime.datetime:
     return datetime.datetime.strptime(dtstr[:-1], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
 
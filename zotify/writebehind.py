@@ -0,0 +1,159 @@
+import os
+import threading
+from collections import deque
+from pathlib import PurePath
+from typing import BinaryIO
+
+from zotify.zotify import Zotify
+
+
+# most blocks a single writev may be given
+IOV_MAX = 1024
+
+
+class WriteBehindFile:
+    """
+    Output file written by a background thread, behind a bounded buffer
+    
+    Download loops hand their blocks to write() and go straight back to reading the
+    network, so a slow disk or a network filesystem stall only holds the download up
+    once WRITE_BUFFER_SIZE megabytes are waiting. Whatever queued up while the last
+    write ran is written with a single writev. The file is preallocated to the size
+    of the stream when it's known, and synced as set by FSYNC_POLICY.
+    """
+    
+    def __init__(self, path: str | PurePath, size_hint: int = 0) -> None:
+        self.max_buffered = Zotify.CONFIG.get_write_buffer_size() * 1024 * 1024
+        self.fsync_policy = Zotify.CONFIG.get_fsync_policy()
+        self.fd: int | None = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+        self.written = 0
+        self._cond = threading.Condition()
+        self._blocks: deque[memoryview] = deque()
+        self._buffered = 0
+        self._closing = False
+        self._error: OSError | None = None
+        
+        if size_hint > 0 and hasattr(os, 'posix_fallocate'):
+            try:
+                # one contiguous allocation instead of growing the file block by block
+                os.posix_fallocate(self.fd, 0, size_hint)
+            except OSError:
+                pass # not every filesystem supports it
+        
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def write(self, data: bytes | bytearray | memoryview) -> int:
+        if not (isinstance(data, bytes) or isinstance(data, memoryview) and data.readonly):
+            # mutable buffers may be reused by the caller as soon as write returns
+            data = bytes(data)
+        block = memoryview(data).cast('B')
+        with self._cond:
+            while self._buffered >= self.max_buffered and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+            if block:
+                self._blocks.append(block)
+                self._buffered += len(block)
+                self._cond.notify_all()
+        return len(block)
+    
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._blocks and not self._closing:
+                    self._cond.wait()
+                if not self._blocks:
+                    return
+                blocks = list(self._blocks)
+                self._blocks.clear()
+            
+            size = sum(len(block) for block in blocks)
+            try:
+                self._write_blocks(blocks)
+                if self.fsync_policy == 'batch':
+                    os.fsync(self.fd)
+            except OSError as e:
+                with self._cond:
+                    self._error = e
+                    self._blocks.clear()
+                    self._cond.notify_all()
+                return
+            
+            with self._cond:
+                self._buffered -= size
+                self._cond.notify_all()
+    
+    def _write_blocks(self, blocks: list[memoryview]) -> None:
+        while blocks:
+            if hasattr(os, 'writev'):
+                written = os.writev(self.fd, blocks[:IOV_MAX])
+            else:
+                written = os.write(self.fd, blocks[0])
+            self.written += written
+            # drop what was written, keeping the rest of a partly written block
+            while written:
+                if written >= len(blocks[0]):
+                    written -= len(blocks.pop(0))
+                else:
+                    blocks[0] = blocks[0][written:]
+                    written = 0
+    
+    def _stop(self, discard: bool) -> None:
+        with self._cond:
+            self._closing = True
+            if discard:
+                self._blocks.clear()
+            self._cond.notify_all()
+        self._thread.join()
+    
+    def close(self) -> None:
+        if self.fd is None:
+            return
+        try:
+            self._stop(discard=False)
+            # gives back preallocated space the data didn't fill
+            self._truncate()
+            if self._error is not None:
+                raise self._error
+            if self.fsync_policy != 'never':
+                os.fsync(self.fd)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+    
+    def _truncate(self) -> None:
+        """ Cuts the file back to what was written, so it's never left at its preallocated size """
+        try:
+            os.ftruncate(self.fd, self.written)
+        except OSError:
+            if self._error is None:
+                raise
+    
+    def __enter__(self) -> 'WriteBehindFile':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        if self.fd is None:
+            return
+        # the download failed, its file is incomplete anyway, but mustn't look complete
+        # by size (as preallocated) to SKIP_EXISTING
+        self._stop(discard=True)
+        try:
+            self._truncate()
+        except OSError:
+            pass
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+
+def open_output(path: str | PurePath, size_hint: int = 0) -> BinaryIO:
+    """ Opens the file a download is written to, behind a WriteBehindFile unless WRITE_BUFFER_SIZE is 0 """
+    if Zotify.CONFIG.get_write_buffer_size() <= 0:
+        return open(path, 'wb')
+    return WriteBehindFile(path, size_hint)
@@ -1,15 +1,19 @@
 import json
 import datetime
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 from pathlib import Path
 from librespot.audio.decoders import VorbisOnlyAudioQuality
+from requests import RequestException
 
 from zotify import OAuth, Session
-from zotify.const import TYPE, \
+from zotify.const import TYPE, ITEMS, TOTAL, \
     PREMIUM, USER_READ_EMAIL, OFFSET, LIMIT, \
     PLAYLIST_READ_PRIVATE, USER_LIBRARY_READ, USER_FOLLOW_READ
+from zotify.cache import API_CACHE, REQUEST_MEMO
 from zotify.config import Config
+from zotify.network import http_get
+from zotify.ratelimit import API_LIMITER, AUDIO_KEY_LIMITER, MAX_THROTTLED_RETRIES, backoff_delay, parse_retry_after
 from zotify.termoutput import Printer, PrintChannel, Loader
 
 
@@ -55,16 +59,26 @@ class Zotify:
     
     @classmethod
     def get_content_stream(cls, content_id, quality):
-        try:
-            return cls.SESSION.content_feeder().load(content_id, VorbisOnlyAudioQuality(quality), False, None)
-        except RuntimeError as e:
-            if 'Failed fetching audio key!' in e.args[0]:
+        tryCount = 0
+        while True:
+            AUDIO_KEY_LIMITER.acquire()
+            try:
+                stream = cls.SESSION.content_feeder().load(content_id, VorbisOnlyAudioQuality(quality), False, None)
+            except RuntimeError as e:
+                if 'Failed fetching audio key!' not in e.args[0]:
+                    raise e
+                # audio key denials are how rate limiting shows up here
+                AUDIO_KEY_LIMITER.throttled(attempt=tryCount)
+                if tryCount < cls.CONFIG.get_retry_attempts():
+                    tryCount += 1
+                    continue
                 gid, fileid = e.args[0].split('! ')[1].split(', ')
                 Printer.print(PrintChannel.ERRORS, '###   ERROR:  FAILED TO FETCH AUDIO KEY   ###\n' +\
-                                                   '###   MAY BE CAUSED BY RATE LIMITS - CONSIDER INCREASING `BULK_WAIT_TIME`   ###\n' +\
+                                                   '###   MAY BE CAUSED BY RATE LIMITS - CONSIDER LOWERING `AUDIO_KEY_RATE_LIMIT`   ###\n' +\
                                                   f'###   GID: {gid[5:]} - File_ID: {fileid[8:]}   ###')
-            else:
-                raise e
+                return None
+            AUDIO_KEY_LIMITER.succeeded()
+            return stream
     
     @classmethod
     def __get_auth_token(cls):
@@ -84,31 +98,111 @@ class Zotify:
     
     @classmethod
     def invoke_url_with_params(cls, url, limit, offset, **kwargs):
-        headers = cls.get_auth_header()
         params = {LIMIT: limit, OFFSET: offset}
         params.update(kwargs)
-        return requests.get(url, headers=headers, params=params).json()
+        return REQUEST_MEMO.fetch(API_CACHE.key(url, params), lambda: cls.__fetch_url_with_params(url, params),
+                                  keep=lambda responsejson: bool(responsejson) and 'error' not in responsejson)
+    
+    @classmethod
+    def __fetch_url_with_params(cls, url: str, params: dict):
+        headers = cls.get_auth_header()
+        cached = API_CACHE.get(url, params)
+        if cached is not None:
+            return json.loads(cached)
+        
+        throttles = 0
+        while True:
+            API_LIMITER.acquire()
+            response = http_get(url, headers=headers, params=params)
+            if response.status_code != 429:
+                API_LIMITER.succeeded()
+                break
+            API_LIMITER.throttled(parse_retry_after(response.headers.get('Retry-After')), throttles)
+            throttles += 1
+            if throttles > MAX_THROTTLED_RETRIES:
+                break
+        responsejson = response.json()
+        if responsejson and 'error' not in responsejson:
+            API_CACHE.put(url, response.text, params)
+        return responsejson
+    
+    @classmethod
+    def invoke_url_paginated(cls, url: str, limit: int, first_page: dict | None = None, **kwargs) -> list:
+        """ Returns the items of every page, the pages after the first fetched concurrently """
+        # the first page may already be embedded in another response (e.g. an album's tracks)
+        resp = first_page if first_page is not None else cls.invoke_url_with_params(url, limit=limit, offset=0, **kwargs)
+        # not extended in place, it may belong to the caller
+        items: list = list(resp[ITEMS])
+        if len(resp[ITEMS]) < limit:
+            return items
+        
+        if resp.get(TOTAL) is None:
+            # no total to plan with, page serially until a short page
+            offset = limit
+            while True:
+                resp = cls.invoke_url_with_params(url, limit=limit, offset=offset, **kwargs)
+                offset += limit
+                items.extend(resp[ITEMS])
+                if len(resp[ITEMS]) < limit:
+                    return items
+        
+        offsets = range(limit, resp[TOTAL], limit)
+        if not offsets:
+            return items
+        
+        def fetch_page(offset: int) -> list:
+            return cls.invoke_url_with_params(url, limit=limit, offset=offset, **kwargs)[ITEMS]
+        
+        with ThreadPoolExecutor(max_workers=min(cls.CONFIG.get_pagination_workers(), len(offsets))) as executor:
+            # map() yields pages in offset order, whichever finishes first
+            for page in executor.map(fetch_page, offsets):
+                items.extend(page)
+        return items
     
     @classmethod
     def invoke_url(cls, url: str, tryCount: int = 0):
+        return REQUEST_MEMO.fetch(API_CACHE.key(url), lambda: cls.__fetch_url(url, tryCount),
+                                  keep=lambda response: bool(response[1]) and 'error' not in response[1])
+    
+    @classmethod
+    def __fetch_url(cls, url: str, tryCount: int = 0, throttles: int = 0):
+        cached = API_CACHE.get(url)
+        if cached is not None:
+            return cached, json.loads(cached)
+        
         headers = cls.get_auth_header()
-        response = requests.get(url, headers=headers)
-        responsetext = response.text
+        API_LIMITER.acquire()
         try:
-            responsejson = response.json()
-            # responsejson = {"error": {"status": "Unknown", "message": "Received an empty response"}}
-        except json.decoder.JSONDecodeError:
-            responsejson = {"error": {"status": "Unknown", "message": "Received an empty response"}}
+            response = http_get(url, headers=headers)
+        except RequestException as e:
+            # timeouts and dropped connections are retried like any other API error
+            responsetext = ""
+            responsejson = {"error": {"status": "Unknown", "message": f"Request failed: {e}"}}
+        else:
+            if response.status_code == 429:
+                API_LIMITER.throttled(parse_retry_after(response.headers.get('Retry-After')), throttles)
+                if throttles < MAX_THROTTLED_RETRIES:
+                    return cls.__fetch_url(url, tryCount, throttles + 1)
+            else:
+                API_LIMITER.succeeded()
+            responsetext = response.text
+            try:
+                responsejson = response.json()
+                # responsejson = {"error": {"status": "Unknown", "message": "Received an empty response"}}
+            except json.decoder.JSONDecodeError:
+                responsejson = {"error": {"status": "Unknown", "message": "Received an empty response"}}
         
         if not responsejson or 'error' in responsejson:
             if tryCount < cls.CONFIG.get_retry_attempts():
                 Printer.print(PrintChannel.WARNINGS, f"###   WARNING:  API ERROR (TRY {tryCount}) - RETRYING   ###\n" +\
                                                      f"###   {responsejson['error']['status']}: {responsejson['error']['message']}")
-                sleep(5)
-                return cls.invoke_url(url, tryCount + 1)
+                sleep(backoff_delay(tryCount, base=2))
+                return cls.__fetch_url(url, tryCount + 1)
             
             Printer.print(PrintChannel.API_ERRORS, f"###   API ERROR:  API ERROR (TRY {tryCount}) - RETRY LIMIT EXCEDED   ###\n" +\
                                                    f"###   {responsejson['error']['status']}: {responsejson['error']['message']}")
+        else:
+            API_CACHE.put(url, responsetext)
         
         return responsetext, responsejson
     